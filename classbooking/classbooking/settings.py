@@ -52,6 +52,8 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
+    # Does nothing unless REQUEST_METRICS_ENABLED, see below
+    "main.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -59,14 +61,16 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # WhiteNoise, usable by async views without a thread hop
+    "main.middleware.StaticFilesMiddleware",
 ]
 
 ROOT_URLCONF = "classbooking.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # Django's own backend, also timing renders for RequestMetricsMiddleware
+        "BACKEND": "main.templating.DjangoTemplates",
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -85,17 +89,139 @@ WSGI_APPLICATION = "classbooking.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connections are closed after every request by default. Under WSGI,
+# DB_CONN_MAX_AGE keeps them open for that many seconds ("None" forever) and
+# DB_CONN_HEALTH_CHECKS checks them before reuse. Under ASGI persistent
+# connections aren't reused across requests, so leave it at 0 and set
+# DB_POOL=True for Django's psycopg 3 connection pool, which replaces
+# persistent connections (CONN_MAX_AGE is forced to 0).
+# SQLite (DEBUG) runs in WAL mode so readers don't block the writer, and waits
+# up to SQLITE_TIMEOUT seconds for the write lock instead of failing.
+
+DB_POOL = os.environ.get("DB_POOL", "False") == "True"
+DB_CONN_MAX_AGE = os.environ.get("DB_CONN_MAX_AGE", "0")
+DB_CONN_MAX_AGE = (
+    0 if DB_POOL else None if DB_CONN_MAX_AGE == "None" else int(DB_CONN_MAX_AGE)
+)
+DB_CONN_HEALTH_CHECKS = os.environ.get("DB_CONN_HEALTH_CHECKS", "True") == "True"
+
 if not os.environ.get("DEBUG", "False") == "True":
-    DATABASES = {"default": dj_database_url.parse(os.environ.get("DATABASE_URL"))}
+    DATABASES = {
+        "default": dj_database_url.parse(
+            os.environ.get("DATABASE_URL"),
+            conn_max_age=DB_CONN_MAX_AGE,
+            conn_health_checks=DB_CONN_HEALTH_CHECKS,
+        )
+    }
+    if DB_POOL:
+        DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+            # Seconds a request waits for a free connection before failing
+            "timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        }
 else:
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": "db.sqlite3",
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": DB_CONN_HEALTH_CHECKS,
+            "OPTIONS": {
+                "timeout": float(os.environ.get("SQLITE_TIMEOUT", 20)),
+                # Take the write lock when a transaction starts, so it waits
+                # for the timeout above rather than failing on its first write
+                "transaction_mode": os.environ.get(
+                    "SQLITE_TRANSACTION_MODE", "IMMEDIATE"
+                ),
+                "init_command": (
+                    "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL"
+                    if os.environ.get("SQLITE_WAL", "True") == "True"
+                    else ""
+                ),
+            },
         }
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default, set CACHE_BACKEND to e.g.
+# django.core.cache.backends.filebased.FileBasedCache and CACHE_LOCATION to a
+# directory to share the cache between worker processes.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "classbooking"),
+    }
+}
+
+# Seconds a classroom availability snapshot may be served before it is rebuilt
+
+AVAILABILITY_CACHE_TIMEOUT = int(os.environ.get("AVAILABILITY_CACHE_TIMEOUT", 300))
+
+
+# Sessions
+# cached_db reads sessions from the cache and falls back to the database, so
+# most requests skip the session SELECT. Set SESSION_ENGINE to
+# django.contrib.sessions.backends.signed_cookies to keep no server-side state.
+# Run manage.py purge_sessions regularly to delete expired sessions.
+
+SESSION_ENGINE = os.environ.get(
+    "SESSION_ENGINE", "django.contrib.sessions.backends.cached_db"
+)
+
+# Authentication
+# home.backends keeps the users it loads in memory for AUTH_USER_CACHE_TIMEOUT
+# seconds (0 turns it off), saving the User SELECT on each request. Changed
+# users are announced through the cache above.
+
+AUTHENTICATION_BACKENDS = ["home.backends.CachedModelBackend"]
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get("AUTH_USER_CACHE_TIMEOUT", 60))
+AUTH_USER_CACHE_SIZE = int(os.environ.get("AUTH_USER_CACHE_SIZE", 10000))
+
+
+# Password hashing
+# PASSWORD_HASHER picks the algorithm new passwords are hashed with: pbkdf2
+# (default), scrypt, or argon2 (fastest for the same strength, needs the
+# argon2-cffi package). The others stay listed so existing hashes still verify,
+# users are rehashed with the chosen one when they next log in. Their cost
+# can be tuned, empty means Django's defaults.
+
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2")
+_PASSWORD_HASHERS = {
+    "pbkdf2": "home.hashers.PBKDF2PasswordHasher",
+    "scrypt": "home.hashers.ScryptPasswordHasher",
+    "argon2": "home.hashers.Argon2PasswordHasher",
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+]
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS") or 0)
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.environ.get("PASSWORD_SCRYPT_WORK_FACTOR") or 0)
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get("PASSWORD_ARGON2_TIME_COST") or 0)
+# In KiB
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get("PASSWORD_ARGON2_MEMORY_COST") or 0)
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get("PASSWORD_ARGON2_PARALLELISM") or 0)
+
+# Login throttling (home.throttle)
+# After LOGIN_THROTTLE_USER failed logins for one username, or
+# LOGIN_THROTTLE_IP from one address, further attempts are refused without
+# checking the password until LOGIN_THROTTLE_WINDOW seconds after the first
+# failure. Counters live in the default cache, share it between workers
+# (CACHE_BACKEND) for the limits to hold across processes. Behind a proxy set
+# LOGIN_THROTTLE_IP_HEADER (e.g. HTTP_X_FORWARDED_FOR) or every client shares
+# the proxy's address.
+
+LOGIN_THROTTLE_USER = int(os.environ.get("LOGIN_THROTTLE_USER", 5))
+LOGIN_THROTTLE_IP = int(os.environ.get("LOGIN_THROTTLE_IP", 50))
+LOGIN_THROTTLE_WINDOW = int(os.environ.get("LOGIN_THROTTLE_WINDOW", 300))
+LOGIN_THROTTLE_IP_HEADER = os.environ.get("LOGIN_THROTTLE_IP_HEADER", "")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -143,3 +269,81 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 LOGIN_URL = "/login/"
 LOGIN_REDIRECT_URL = "/overview/"
+
+# Number of bookings per page in the staff booking list
+
+BOOKING_PAGE_SIZE = int(os.environ.get("BOOKING_PAGE_SIZE", 50))
+
+# Bookings that ended more than this many days ago are moved to the archive
+# by manage.py archive_bookings
+
+BOOKING_ARCHIVE_AFTER_DAYS = int(os.environ.get("BOOKING_ARCHIVE_AFTER_DAYS", 180))
+
+# Background tasks (main.tasks)
+# "database" (the default) stores them in the QueuedTask table for
+# manage.py run_worker, "thread" runs them on a pool of TASKS_THREADS threads
+# in the web process once the request's transaction commits (development
+# only, they are lost if the process exits), "immediate" runs them inline
+# (tests and debugging). Durable tasks (usage rollups, account deletion)
+# always go to the database queue unless the backend is "immediate". A failed task is retried up to its max_attempts,
+# waiting TASKS_RETRY_DELAY seconds, then twice as long each time. A task a
+# worker has held for TASKS_LEASE_SECONDS is taken over by another one.
+
+TASKS_BACKEND = os.environ.get("TASKS_BACKEND", "database")
+TASKS_THREADS = int(os.environ.get("TASKS_THREADS", 2))
+TASKS_RETRY_DELAY = float(os.environ.get("TASKS_RETRY_DELAY", 5))
+TASKS_LEASE_SECONDS = int(os.environ.get("TASKS_LEASE_SECONDS", 600))
+
+# Booking limits per user group, checked by main.policies. A user gets the
+# first group listed here that they belong to; staff always get "staff" and
+# everyone else "default". Limits left out (or None) are unlimited:
+#   max_duration_hours     longest single booking
+#   max_bookings_per_room  bookings one user may hold in the same classroom
+#   max_weekly_hours       hours one user may book starting in one week
+
+BOOKING_POLICIES = {
+    "staff": {},
+    "default": {
+        "max_duration_hours": 1,
+        "max_bookings_per_room": 1,
+        "max_weekly_hours": None,
+    },
+}
+
+# Widest window (in days) the free-slot search accepts
+
+FREE_SLOT_MAX_DAYS = int(os.environ.get("FREE_SLOT_MAX_DAYS", 31))
+
+# Per-request timing and SQL accounting (Server-Timing header and /metrics/)
+# REQUEST_METRICS_SAMPLE_RATE is the share of requests measured, 0.0 to 1.0
+
+REQUEST_METRICS_ENABLED = os.environ.get("REQUEST_METRICS", "False") == "True"
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get("REQUEST_METRICS_SAMPLE_RATE", 1.0))
+REQUEST_METRICS_DUPLICATE_WARNING = int(
+    os.environ.get("REQUEST_METRICS_DUPLICATE_WARNING", 10)
+)
+
+# E-mail, used for booking notifications (main.notifications). Printed to the
+# console in DEBUG unless EMAIL_BACKEND says otherwise
+
+EMAIL_BACKEND = os.environ.get(
+    "EMAIL_BACKEND",
+    (
+        "django.core.mail.backends.console.EmailBackend"
+        if DEBUG
+        else "django.core.mail.backends.smtp.EmailBackend"
+    ),
+)
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", 25))
+EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS", "False") == "True"
+EMAIL_TIMEOUT = int(os.environ.get("EMAIL_TIMEOUT", 10))
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "webmaster@localhost")
+
+# Mail users when their booking is made, changed or cancelled. Reminders go
+# out BOOKING_REMINDER_MINUTES before the start, from manage.py send_reminders
+
+BOOKING_NOTIFICATIONS = os.environ.get("BOOKING_NOTIFICATIONS", "True") == "True"
+BOOKING_REMINDER_MINUTES = int(os.environ.get("BOOKING_REMINDER_MINUTES", 60))
@@ -0,0 +1,122 @@
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+UserModel = get_user_model()
+
+# Users loaded in this process, by id: (loaded at, version, user)
+_users = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version_key(user_id):
+    return f"auth:user:{user_id}:version"
+
+
+def _cached(user_id, version):
+    timeout = settings.AUTH_USER_CACHE_TIMEOUT
+    with _lock:
+        entry = _users.get(str(user_id))
+        if entry is None or time.monotonic() - entry[0] > timeout:
+            return None
+        if entry[1] != version:
+            # Changed by some process since it was loaded
+            return None
+        _users.move_to_end(str(user_id))
+    # Every request gets its own copy, views may set attributes on request.user
+    return copy.copy(entry[2])
+
+
+def _remember(user, version):
+    with _lock:
+        _users[str(user.pk)] = (time.monotonic(), version, copy.copy(user))
+        _users.move_to_end(str(user.pk))
+        while len(_users) > settings.AUTH_USER_CACHE_SIZE:
+            _users.popitem(last=False)
+
+
+def _bump(user_id):
+    # A new version in the shared cache makes every process load the user
+    # again. It only has to outlive the entries loaded before it.
+    cache.set(_version_key(user_id), time.time_ns(), settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def forget(user_id):
+    with _lock:
+        _users.pop(str(user_id), None)
+    if not settings.AUTH_USER_CACHE_TIMEOUT:
+        return
+    _bump(user_id)
+    if connection.in_atomic_block:
+        # Another process may load the old row before the commit
+        transaction.on_commit(lambda: _bump(user_id))
+
+
+def clear():
+    with _lock:
+        _users.clear()
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that keeps the users it loads for the session in memory.
+
+    Saves the User SELECT django.contrib.auth does on every authenticated
+    request. Saving, deleting or update()-ing a user bumps its version in the
+    shared cache, which every process checks, so the change shows on the next
+    request as long as CACHES is shared between them. Raw SQL changes show
+    after AUTH_USER_CACHE_TIMEOUT seconds at the latest (0 turns the cache off).
+    """
+
+    def get_user(self, user_id):
+        if not settings.AUTH_USER_CACHE_TIMEOUT:
+            return super().get_user(user_id)
+        # Read before loading, a change in between is seen next time
+        version = cache.get(_version_key(user_id))
+        user = _cached(user_id, version)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                _remember(user, version)
+        return user
+
+    async def aget_user(self, user_id):
+        if not settings.AUTH_USER_CACHE_TIMEOUT:
+            return await super().aget_user(user_id)
+        version = await cache.aget(_version_key(user_id))
+        user = _cached(user_id, version)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                _remember(user, version)
+        return user
+
+
+class _ForgettingQuerySet(UserModel._default_manager._queryset_class):
+    # QuerySet.update() (and bulk_update()) sends no signals
+    def update(self, **kwargs):
+        ids = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        for user_id in ids:
+            forget(user_id)
+        return rows
+
+
+UserModel._default_manager._queryset_class = _ForgettingQuerySet
+
+
+@receiver(post_save, sender=UserModel)
+@receiver(post_delete, sender=UserModel)
+def forget_changed_user(sender, instance, **kwargs):
+    # Password, is_active or is_staff may have changed, load it again next time
+    forget(instance.pk)
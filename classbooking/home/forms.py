@@ -2,8 +2,11 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.forms import AuthenticationForm
+from django.core.exceptions import ValidationError
 from crispy_forms.helper import FormHelper
 
+from . import throttle
+
 
 class SignInForm(AuthenticationForm):
     username = forms.CharField(max_length=150, required=True, label="ชื่อผู้เข้าใช้ของคุณ")
@@ -25,6 +28,24 @@ class SignInForm(AuthenticationForm):
         )
         self.fields["password"].widget.attrs.update({"placeholder": "กรอกรหัสผ่านของคุณ"})
 
+    def clean(self):
+        username = self.cleaned_data.get("username")
+
+        # Refuse before authenticate() hashes anything
+        if username is not None and throttle.blocked(self.request, username):
+            raise ValidationError(
+                "มีการพยายามเข้าสู่ระบบผิดพลาดหลายครั้งเกินไป กรุณารอสักครู่แล้วลองใหม่อีกครั้ง",
+                code="throttled",
+            )
+
+        try:
+            cleaned_data = super().clean()
+        except ValidationError:
+            throttle.failed(self.request, username)
+            raise
+        throttle.succeeded(username)
+        return cleaned_data
+
 
 class SignUpForm(UserCreationForm):
     username = forms.CharField(
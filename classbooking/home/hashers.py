@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+# The hashers below keep Django's algorithm names, so existing hashes still
+# verify. A stored hash made with other parameters than the configured ones is
+# rehashed with the new ones the next time that user logs in.
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or super().iterations
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR or super().work_factor
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    # Needs the argon2-cffi package
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST or super().time_cost
+
+    @property
+    def memory_cost(self):
+        # In KiB
+        return settings.PASSWORD_ARGON2_MEMORY_COST or super().memory_cost
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM or super().parallelism
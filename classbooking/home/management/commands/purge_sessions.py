@@ -0,0 +1,56 @@
+import time
+
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired sessions from the session table in small batches, so the "
+        "table doesn't grow forever and no single DELETE holds locks for long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Sessions deleted per query",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            metavar="SECONDS",
+            help="Sleep between batches to leave room for other writers",
+        )
+
+    def handle(self, *args, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        get_model_class = getattr(engine.SessionStore, "get_model_class", None)
+        if get_model_class is None:
+            # Cookie and cache sessions expire on their own
+            self.stdout.write(f"{settings.SESSION_ENGINE} keeps no session table")
+            return
+
+        sessions = get_model_class().objects
+        now = timezone.now()
+        purged = 0
+        while True:
+            keys = list(
+                sessions.filter(expire_date__lt=now).values_list(
+                    "session_key", flat=True
+                )[: options["batch_size"]]
+            )
+            if not keys:
+                break
+            purged += sessions.filter(session_key__in=keys).delete()[0]
+            if len(keys) < options["batch_size"]:
+                break
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(self.style.SUCCESS(f"{purged} expired sessions purged"))
@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+
+from main import ledger
+from main.tasks import task
+
+
+@task(durable=True)
+def delete_account(user_id):
+    """
+    Delete a user and everything they own, off the request path.
+
+    Durable: always stored in the database queue, a deactivated account
+    waiting for it must not be forgotten if the web process exits.
+
+    Bookings go first, in batches that give their hours back (see
+    ledger.delete_user_bookings), so the final delete only cascades
+    through the small per-user tables.
+    """
+    ledger.delete_user_bookings(user_id)
+    User.objects.filter(pk=user_id).delete()
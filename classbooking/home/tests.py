@@ -1,3 +1,114 @@
-from django.test import TestCase
+from collections import OrderedDict
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from home import backends
+from main import tasks
+from main.models import Booking, Classroom, QueuedTask
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("student", password="pw")
+        self.client.post(
+            reverse("auth_login"), {"username": "student", "password": "pw"}
+        )
+
+    def test_page_load_skips_session_and_user_queries(self):
+        self.client.get(reverse("overview"))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse("overview")).status_code, 200)
+
+    def test_deactivated_user_is_logged_out(self):
+        self.client.get(reverse("overview"))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("overview")).status_code, 302)
+
+    def test_queryset_update_logs_the_user_out(self):
+        self.client.get(reverse("overview"))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse("overview")).status_code, 302)
+
+    def test_change_made_by_another_process_is_seen(self):
+        self.client.get(reverse("overview"))
+        # The other process has its own users, this one keeps the old copy
+        with mock.patch.object(backends, "_users", OrderedDict()):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(reverse("overview")).status_code, 302)
+
+
+@override_settings(LOGIN_THROTTLE_USER=2)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user("student", password="pw")
+
+    def login(self, password):
+        return self.client.post(
+            reverse("auth_login"), {"username": "student", "password": password}
+        )
+
+    def test_refuses_without_checking_the_password(self):
+        for _ in range(2):
+            self.assertEqual(self.login("wrong").status_code, 200)
+        # Not even the user is looked up once the username is throttled
+        with self.assertNumQueries(0):
+            response = self.login("pw")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_success_clears_the_username_counter(self):
+        self.login("wrong")
+        self.assertEqual(self.login("pw").status_code, 302)
+        self.client.logout()
+        self.login("wrong")
+        self.assertEqual(self.login("pw").status_code, 302)
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class AccountDeletionTests(TestCase):
+    def test_deletion_gives_hours_back(self):
+        user = User.objects.create_user("student", password="pw")
+        classroom = Classroom.objects.create(
+            name="Lab", room_number=101, total_hours=10, capacity=30
+        )
+        start = timezone.now() + timedelta(days=1)
+        for n in range(3):
+            Booking.objects.create(
+                classroom=classroom,
+                user=user,
+                start_time=start + timedelta(hours=n),
+                end_time=start + timedelta(hours=n + 1),
+            )
+
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("auth_deletion"))
+        self.assertEqual(response.status_code, 302)
+
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        classroom.refresh_from_db()
+        self.assertEqual(classroom.hours_left, 10)
+
+    @override_settings(TASKS_BACKEND="thread")
+    def test_deletion_is_queued_in_the_database(self):
+        user = User.objects.create_user("student", password="pw")
+        self.client.force_login(user)
+        self.client.post(reverse("auth_deletion"))
+
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        queued = QueuedTask.objects.get()
+        self.assertEqual(
+            (queued.name, queued.args), ("home.tasks.delete_account", [user.pk])
+        )
+        self.assertTrue(tasks.execute(queued))
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+
+IP_KEY = "login:ip:{}"
+USER_KEY = "login:user:{}"
+
+
+def client_ip(request):
+    # Behind a reverse proxy set LOGIN_THROTTLE_IP_HEADER, e.g. HTTP_X_FORWARDED_FOR
+    header = settings.LOGIN_THROTTLE_IP_HEADER
+    if header and request.META.get(header):
+        return request.META[header].split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _keys(request, username):
+    keys = {USER_KEY.format((username or "").lower()): settings.LOGIN_THROTTLE_USER}
+    if request is not None:
+        keys[IP_KEY.format(client_ip(request))] = settings.LOGIN_THROTTLE_IP
+    return keys
+
+
+def blocked(request, username):
+    """
+    Whether too many logins failed recently for this username or client IP.
+
+    One cache read for both counters and no password hashing, so a flood of
+    guesses costs next to nothing.
+    """
+    keys = _keys(request, username)
+    counts = cache.get_many(list(keys))
+    return any(counts.get(key, 0) >= limit for key, limit in keys.items())
+
+
+def failed(request, username):
+    # Count a failed login, counters expire LOGIN_THROTTLE_WINDOW seconds after the first
+    for key in _keys(request, username):
+        if not cache.add(key, 1, settings.LOGIN_THROTTLE_WINDOW):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.add(key, 1, settings.LOGIN_THROTTLE_WINDOW)
+
+
+def succeeded(username):
+    # A correct password clears the username's counter, the IP keeps its own
+    cache.delete(USER_KEY.format((username or "").lower()))
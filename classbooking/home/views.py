@@ -1,11 +1,12 @@
 from .forms import SignUpForm
 from .forms import SignInForm
+from .tasks import delete_account
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import authenticate
 from django.contrib.auth import login
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.shortcuts import render
 from django.shortcuts import redirect
 from django.template import loader
@@ -36,9 +37,9 @@ def auth_login(request):
 
         # is_valid() already checks for correct username and password
         # it also checks if the form = None or not, so no need for double-checking it
+        # (and refuses throttled attempts before checking the password at all)
         if form.is_valid():
             username = form.cleaned_data.get("username")
-            password = form.cleaned_data.get("password")
 
             # if user doesn't check remember_me button -> make the session expires when the browser is closed
             # normally django will save session token for 14 days (2 weeks)
@@ -48,7 +49,8 @@ def auth_login(request):
                 )  # set session to expires in 30 days
             else:
                 request.session.set_expiry(0)  # set to expires after the browser closes
-            login(request, authenticate(username=username, password=password))
+            # The form already authenticated the user, don't hash the password twice
+            login(request, form.get_user())
 
             # login success
             messages.success(request, f"เข้าสู่ระบบสำเร็จ ยินดีต้อนรับครับ คุณ {username}")
@@ -108,7 +110,17 @@ def auth_deletion(request):
             messages.warning(request, "ไม่สามารถลบบัญชีผู้ดูแลระบบได้ที่นี่")
             return redirect("overview")  # redirect back to a safe page
 
-        user.delete()
+        # Locked out right away, the bookings and the account itself are
+        # deleted by a background task, queued in the same transaction so a
+        # deactivated account is never left without one
+        with transaction.atomic():
+            user.is_active = False
+            user.save(update_fields=["is_active"])
+            delete_account.using(dedup_key=f"delete_account:{user.pk}").enqueue(
+                user.pk
+            )
+        logout(request)
+
         messages.success(request, "บัญชีของคุณถูกลบเรียบร้อยแล้ว")
         return redirect("auth_login")  # redirect to login or homepage
 
@@ -1,7 +1,17 @@
 from django.contrib import admin
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from .models import Classroom, Booking
+from . import ledger
+from .models import (
+    Classroom,
+    Booking,
+    BookingArchive,
+    ClassroomDailyUsage,
+    HoursResetRun,
+    QueuedTask,
+    UserWeeklyUsage,
+)
 
 
 @admin.register(Classroom)
@@ -13,8 +23,10 @@ class ClassroomAdmin(admin.ModelAdmin):
         "hours_left",
         "capacity",
         "is_available",
+        "reset_policy",
+        "hours_reset_at",
     )
-    list_filter = ("is_available",)
+    list_filter = ("is_available", "reset_policy")
     search_fields = ("name", "room_number")
 
 
@@ -39,34 +51,79 @@ class BookingAdmin(admin.ModelAdmin):
             )
 
         # Check overlapping bookings
-        overlaps = Booking.objects.filter(
-            classroom=obj.classroom,
-            start_time__lt=obj.end_time,
-            end_time__gt=obj.start_time,
+        # exclude current booking when editing
+        overlaps = Booking.objects.overlapping(
+            obj.classroom, obj.start_time, obj.end_time, exclude_pk=obj.pk
         )
 
-        if obj.pk:  # exclude current booking when editing
-            overlaps = overlaps.exclude(pk=obj.pk)
-
         if overlaps.exists():
             raise ValidationError(
                 _(f"{obj.classroom.name} is already booked during the selected time.")
             )
 
-        # Save booking normally
+        # Save booking normally, Booking.save also deducts the classroom hours
         super().save_model(request, obj, form, change)
 
-        # Deduct hours
-        obj.classroom.update_hours(duration, obj.user)
-
     def delete_model(self, request, obj):
         # Restore classroom hours when a booking is removed
-        duration = (obj.end_time - obj.start_time).total_seconds() / 3600.0
-        classroom = obj.classroom
-        classroom.hours_left += duration
-        if classroom.hours_left > classroom.total_hours:
-            classroom.hours_left = classroom.total_hours
-        classroom.is_available = classroom.hours_left > 0
-        classroom.save()
-
-        super().delete_model(request, obj)
+        ledger.cancel_booking(obj)
+
+    def delete_queryset(self, request, queryset):
+        # Bulk delete action, one hours update per classroom
+        ledger.cancel_bookings(queryset)
+
+
+@admin.register(BookingArchive)
+class BookingArchiveAdmin(admin.ModelAdmin):
+    # Filled by manage.py archive_bookings, read-only history
+    list_display = ("classroom", "user", "start_time", "end_time", "archived_at")
+    list_filter = ("classroom",)
+    search_fields = ("classroom__name", "classroom__room_number", "user__username")
+    date_hierarchy = "start_time"
+    list_select_related = ("classroom", "user")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(HoursResetRun)
+class HoursResetRunAdmin(admin.ModelAdmin):
+    list_display = ("policy", "period_start", "ran_at", "classrooms_reset")
+    list_filter = ("policy",)
+    date_hierarchy = "period_start"
+
+
+@admin.register(ClassroomDailyUsage)
+class ClassroomDailyUsageAdmin(admin.ModelAdmin):
+    # Maintained by main.rollups, rebuild with manage.py rebuild_rollups
+    list_display = ("classroom", "day", "booked_hours", "bookings")
+    list_filter = ("classroom",)
+    date_hierarchy = "day"
+    list_select_related = ("classroom",)
+
+
+@admin.register(UserWeeklyUsage)
+class UserWeeklyUsageAdmin(admin.ModelAdmin):
+    list_display = ("user", "week", "booked_hours", "bookings")
+    search_fields = ("user__username",)
+    date_hierarchy = "week"
+    list_select_related = ("user",)
+
+
+@admin.register(QueuedTask)
+class QueuedTaskAdmin(admin.ModelAdmin):
+    # Written by main.tasks, failed tasks stay here until deleted or retried
+    list_display = ("name", "status", "attempts", "run_after", "created_at")
+    list_filter = ("status", "name")
+    search_fields = ("name", "dedup_key")
+    readonly_fields = ("locked_by", "locked_at", "last_error", "created_at")
+    actions = ["retry"]
+
+    @admin.action(description="Run selected tasks again")
+    def retry(self, request, queryset):
+        queryset.filter(status=QueuedTask.FAILED).update(
+            status=QueuedTask.QUEUED, attempts=0, run_after=timezone.now()
+        )
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import availability, ledger
+from .models import Booking, BookingArchive
+from .operations import ARCHIVE_TABLE
+
+# Columns copied from Booking to BookingArchive
+FIELDS = ("id", "classroom_id", "user_id", "start_time", "end_time", "updated_at")
+
+
+def cutoff(now=None):
+    # Bookings that ended before this are archived (BOOKING_ARCHIVE_AFTER_DAYS)
+    return (now or timezone.now()) - timedelta(days=settings.BOOKING_ARCHIVE_AFTER_DAYS)
+
+
+def may_reach_archive(start):
+    """
+    Whether a window starting at ``start`` can include archived bookings.
+
+    Windows before the cutoff usually do. Later ones only if bookings were
+    archived early (archive_bookings --days or before=), which the newest
+    archived end_time tells, one lookup on archive_end_idx.
+    """
+    if start < cutoff():
+        return True
+    newest = BookingArchive.objects.aggregate(newest=Max("end_time"))["newest"]
+    return newest is not None and newest > start
+
+
+async def amay_reach_archive(start):
+    # may_reach_archive() for async views
+    if start < cutoff():
+        return True
+    newest = (await BookingArchive.objects.aaggregate(newest=Max("end_time")))["newest"]
+    return newest is not None and newest > start
+
+
+def ensure_partitions(years):
+    # One partition per (UTC) year of start_time, PostgreSQL only
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for year in sorted(years):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}_{year} "
+                f"PARTITION OF {ARCHIVE_TABLE} "
+                f"FOR VALUES FROM ('{year}-01-01 00:00+00') TO ('{year + 1}-01-01 00:00+00')"
+            )
+
+
+def archive_bookings(before=None, batch_size=1000, dry_run=False):
+    """
+    Move bookings that ended before ``before`` (default: cutoff()) to the archive.
+
+    Each batch is copied and deleted in its own short transaction, so live
+    bookings are never locked for long. Moving a booking gives no hours back
+    and leaves the usage rollups alone, it still happened. Returns the
+    number of bookings moved (or that would be, with ``dry_run``).
+    """
+    before = before or cutoff()
+    due = Booking.objects.filter(end_time__lt=before)
+    if dry_run:
+        return due.count()
+
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                due.select_for_update().order_by("pk").values(*FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            ensure_partitions({row["start_time"].year for row in rows})
+            BookingArchive.objects.bulk_create(
+                [BookingArchive(**row) for row in rows], batch_size=batch_size
+            )
+            with ledger.archiving():
+                Booking.objects.filter(pk__in=[row["id"] for row in rows]).delete()
+        moved += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    if moved:
+        # The calendar lost these bookings
+        availability.invalidate()
+    return moved
@@ -0,0 +1,219 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AvailabilityStamp, Classroom
+
+VERSION_KEY = "availability:version"
+SNAPSHOT_KEY = "availability:snapshot:{version}"
+HITS_KEY = "availability:hits"
+MISSES_KEY = "availability:misses"
+# The AvailabilityStamp row
+STAMP_PK = 1
+
+
+def _incr(key):
+    # cache.incr fails on missing keys, so make sure the counter exists first
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(), start over
+        cache.set(key, 1, None)
+        return 1
+
+
+async def _aincr(key):
+    # _incr() for async callers
+    await cache.aadd(key, 0, None)
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, None)
+        return 1
+
+
+def version():
+    # Current snapshot version, bumped on every classroom or booking write
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        cache.add(VERSION_KEY, 1, None)
+        current = cache.get(VERSION_KEY, 1)
+    return current
+
+
+async def aversion():
+    current = await cache.aget(VERSION_KEY)
+    if current is None:
+        await cache.aadd(VERSION_KEY, 1, None)
+        current = await cache.aget(VERSION_KEY, 1)
+    return current
+
+
+def _bump():
+    _incr(VERSION_KEY)
+
+
+def _bump_stamp():
+    # Recreated if gone (e.g. a flushed database)
+    updated = AvailabilityStamp.objects.filter(pk=STAMP_PK).update(
+        version=F("version") + 1, changed_at=timezone.now()
+    )
+    if not updated:
+        AvailabilityStamp.objects.get_or_create(pk=STAMP_PK)
+
+
+def invalidate():
+    """
+    Retire the current snapshot after a classroom or booking write.
+
+    The version is bumped right away and, when inside a transaction, once more
+    after commit, so a snapshot rebuilt from uncommitted data can't be kept.
+    The AvailabilityStamp row read by stamp() is bumped in the writing
+    transaction, so it commits (or fails) together with the write and the
+    validators can never lag behind the data. It is bumped once per
+    savepoint level however many writes it makes.
+    """
+    _bump()
+    if not connection.in_atomic_block:
+        _bump_stamp()
+        return
+    # The marker callback is dropped with the savepoint if it rolls back,
+    # along with the bump itself
+    sids = set(connection.savepoint_ids)
+    if not any(
+        func is _bump and registered == sids
+        for registered, func, _ in connection.run_on_commit
+    ):
+        _bump_stamp()
+        transaction.on_commit(_bump)
+
+
+def _stamp(row):
+    # Without the row (not bumped since a flush) every request is a change
+    current, changed = row or (0, timezone.now())
+    return f"{current}-{changed.timestamp():.6f}", changed
+
+
+def _stamp_row():
+    return AvailabilityStamp.objects.filter(pk=STAMP_PK).values_list(
+        "version", "changed_at"
+    )
+
+
+def stamp():
+    """
+    Return (etag, last_modified) of the last booking or classroom change.
+
+    Used for conditional GETs. Read from the database, one primary key lookup,
+    so every process answers alike; the snapshot version in the cache may be
+    local to a process.
+    """
+    return _stamp(_stamp_row().first())
+
+
+async def astamp():
+    return _stamp(await _stamp_row().afirst())
+
+
+def _rows():
+    return Classroom.objects.order_by("pk").values(
+        "id",
+        "name",
+        "room_number",
+        "capacity",
+        "total_hours",
+        "hours_left",
+        "is_available",
+    )
+
+
+def _with_figures(room):
+    # The figures the pages need, precomputed once per snapshot
+    total, left = room["total_hours"], room["hours_left"]
+    room["percent_left"] = (left / total) * 100 if total else None
+    room["utilization"] = ((total - left) / total) * 100 if total else None
+    # Same text as str(Classroom), used by the booking form dropdown
+    room["label"] = f"{room['name']} (ห้อง {room['room_number']}) - เหลือ {left} ชม."
+    return room
+
+
+def build():
+    # One query for every room
+    return [_with_figures(room) for room in _rows()]
+
+
+async def abuild():
+    return [_with_figures(room) async for room in _rows().aiterator()]
+
+
+def snapshot():
+    """
+    Return {"version": ..., "rooms": [...]} from the cache, rebuilding it on a miss.
+
+    Entries are keyed by version so writers never have to delete anything, and
+    expire after AVAILABILITY_CACHE_TIMEOUT to bound staleness when each process
+    has its own cache.
+    """
+    current = version()
+    key = SNAPSHOT_KEY.format(version=current)
+    cached = cache.get(key)
+    if cached is not None:
+        _incr(HITS_KEY)
+        return cached
+
+    _incr(MISSES_KEY)
+    cached = {"version": current, "rooms": build()}
+    cache.set(key, cached, settings.AVAILABILITY_CACHE_TIMEOUT)
+    return cached
+
+
+async def asnapshot():
+    # snapshot() for async views, using the async cache and ORM APIs
+    current = await aversion()
+    key = SNAPSHOT_KEY.format(version=current)
+    cached = await cache.aget(key)
+    if cached is not None:
+        await _aincr(HITS_KEY)
+        return cached
+
+    await _aincr(MISSES_KEY)
+    cached = {"version": current, "rooms": await abuild()}
+    await cache.aset(key, cached, settings.AVAILABILITY_CACHE_TIMEOUT)
+    return cached
+
+
+def rooms():
+    return snapshot()["rooms"]
+
+
+async def arooms():
+    return (await asnapshot())["rooms"]
+
+
+def available_rooms():
+    return [room for room in rooms() if room["is_available"]]
+
+
+def _stats(current, hits, misses):
+    total = hits + misses
+    return {
+        "version": current,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else None,
+    }
+
+
+def stats():
+    return _stats(version(), cache.get(HITS_KEY, 0), cache.get(MISSES_KEY, 0))
+
+
+async def astats():
+    return _stats(
+        await aversion(),
+        await cache.aget(HITS_KEY, 0),
+        await cache.aget(MISSES_KEY, 0),
+    )
@@ -0,0 +1,379 @@
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from home import throttle
+
+from . import reconcile, rollups
+from .models import Booking, Classroom
+
+# Stored next to each run so results from different machines aren't compared blindly
+FORMAT_VERSION = 1
+
+
+def generate(classrooms=50, users=200, bookings=5000, seed=331):
+    """
+    Fill the database with ``classrooms`` rooms, ``users`` users and ``bookings`` bookings.
+
+    Bookings are spread round-robin over the rooms in consecutive one-hour slots
+    starting tomorrow, so they never overlap and are all still editable.
+    Everything is inserted with bulk_create, then hours_left is reconciled and
+    the usage rollups rebuilt once.
+    Returns (staff user, normal user).
+    """
+    rng = random.Random(seed)
+    password = make_password("benchmark")
+
+    Classroom.objects.bulk_create(
+        [
+            Classroom(
+                name=f"Benchmark {n}",
+                room_number=100000 + n,
+                total_hours=float(bookings),
+                hours_left=float(bookings),
+                capacity=rng.randint(10, 200),
+            )
+            for n in range(classrooms)
+        ],
+        batch_size=1000,
+    )
+    User.objects.bulk_create(
+        [User(username=f"bench{n}", password=password) for n in range(users)],
+        batch_size=1000,
+    )
+    staff = User.objects.create(
+        username="bench_staff", password=password, is_staff=True
+    )
+
+    room_ids = list(
+        Classroom.objects.filter(room_number__gte=100000)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith="bench", is_staff=False)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+    base = (timezone.now() + timedelta(days=1)).replace(
+        minute=0, second=0, microsecond=0
+    )
+    rows = []
+    for n in range(bookings):
+        start = base + timedelta(hours=n // len(room_ids))
+        rows.append(
+            Booking(
+                classroom_id=room_ids[n % len(room_ids)],
+                user_id=user_ids[n % len(user_ids)],
+                start_time=start,
+                end_time=start + timedelta(minutes=rng.choice([30, 45, 60])),
+            )
+        )
+    Booking.objects.bulk_create(rows, batch_size=1000)
+
+    reconcile.correct(reconcile.find_drift(room_ids))
+    rollups.rebuild()
+    return staff, User.objects.get(pk=user_ids[0])
+
+
+def _measure(client, method, url, data=None, expected_status=200):
+    # One request: (seconds, queries, peak traced memory in KiB)
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = getattr(client, method)(url, data or {})
+        elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if response.status_code != expected_status:
+        raise RuntimeError(
+            f"{method.upper()} {url} returned {response.status_code}, "
+            f"expected {expected_status}"
+        )
+    return elapsed, len(queries.captured_queries), peak / 1024
+
+
+def _summary(samples):
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        "requests": len(samples),
+        "latency_ms": {
+            "mean": statistics.fmean(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+        },
+        "queries": max(sample[1] for sample in samples),
+        "peak_memory_kib": max(sample[2] for sample in samples),
+    }
+
+
+def _form_time(value):
+    return timezone.localtime(value).strftime("%Y-%m-%dT%H:%M")
+
+
+def run_scenarios(staff, user, iterations=20):
+    """
+    Time the main pages with Django's test client.
+
+    Each scenario records latency percentiles, the query count and the peak
+    memory allocated while handling one request.
+    """
+    staff_client, user_client = Client(), Client()
+    staff_client.force_login(staff)
+    user_client.force_login(user)
+
+    first = Booking.objects.order_by("start_time").values_list("start_time", flat=True)
+    window_start = timezone.localtime(first.first() or timezone.now())
+    window = {
+        "start": window_start.date().isoformat(),
+        "end": (window_start + timedelta(days=31)).date().isoformat(),
+    }
+
+    # Bookings the edit and cancel scenarios work on, one per iteration
+    targets = list(Booking.objects.order_by("-start_time")[: iterations * 2])
+    edits, cancels = targets[:iterations], targets[iterations:]
+
+    scenarios = {
+        "overview": lambda n: (user_client, "get", reverse("overview")),
+        "overview_events": lambda n: (
+            user_client,
+            "get",
+            reverse("overview_events"),
+            window,
+        ),
+        "booking_staff": lambda n: (staff_client, "get", reverse("booking")),
+        "booking_user": lambda n: (user_client, "get", reverse("booking")),
+        "booking_edit": lambda n: (
+            staff_client,
+            "post",
+            reverse("booking_edit", args=[edits[n].pk]),
+            {
+                "start_time": _form_time(edits[n].start_time),
+                "end_time": _form_time(edits[n].start_time + timedelta(minutes=30)),
+            },
+            302,
+        ),
+        "booking_cancel": lambda n: (
+            staff_client,
+            "post",
+            reverse("booking_cancel", args=[cancels[n].pk]),
+            None,
+            302,
+        ),
+        "classroom": lambda n: (user_client, "get", reverse("classroom")),
+    }
+    # Edits and cancels need a fresh booking per request
+    runs = {"booking_edit": len(edits), "booking_cancel": len(cancels)}
+
+    results = {}
+    for name, request in scenarios.items():
+        samples = [_measure(*request(n)) for n in range(runs.get(name, iterations))]
+        if samples:
+            results[name] = _summary(samples)
+    return results
+
+
+def run_connections(user, iterations=20):
+    """
+    Time a short page with a new database connection per request and with one
+    kept open between requests (CONN_MAX_AGE).
+
+    Shows what connection setup costs each request. An in-memory SQLite test
+    database is never closed, so the difference only shows on a server database.
+    """
+    client = Client()
+    client.force_login(user)
+    url = reverse("overview")
+    settings_dict = connection.settings_dict
+    configured = settings_dict["CONN_MAX_AGE"]
+
+    results = {}
+    try:
+        for name, max_age in (("per_request", 0), ("persistent", configured or 60)):
+            # Takes effect when the next connection is opened
+            settings_dict["CONN_MAX_AGE"] = max_age
+            connection.close()
+            results[name] = _summary(
+                [_measure(client, "get", url) for _ in range(iterations)]
+            )
+    finally:
+        settings_dict["CONN_MAX_AGE"] = configured
+        connection.close()
+
+    per_request = results["per_request"]["latency_ms"]["p50"]
+    results["p50_saved_ms"] = per_request - results["persistent"]["latency_ms"]["p50"]
+    return results
+
+
+def run_logins(iterations=20):
+    """
+    Time sign-ins through the login form with the configured password hasher.
+
+    ``logins`` are successful sign-ins (one password hash each, throughput in
+    logins_per_second), ``throttled`` are attempts refused by the login
+    throttle once a username has failed too often, which hash nothing.
+    """
+    password = "benchmark-login"
+    User.objects.create_user("bench_login", password=password)
+    client = Client()
+    url = reverse("auth_login")
+
+    samples = []
+    for _ in range(iterations):
+        samples.append(
+            _measure(
+                client,
+                "post",
+                url,
+                {"username": "bench_login", "password": password},
+                302,
+            )
+        )
+        client.logout()
+
+    # Use up the username's failed attempts, then time the refusals
+    wrong = {"username": "bench_throttled", "password": "wrong"}
+    for _ in range(settings.LOGIN_THROTTLE_USER):
+        client.post(url, wrong)
+    refused = [_measure(client, "post", url, wrong) for _ in range(iterations)]
+    cache.delete_many(
+        [
+            throttle.USER_KEY.format("bench_throttled"),
+            throttle.IP_KEY.format("127.0.0.1"),
+        ]
+    )
+
+    logins = _summary(samples)
+    return {
+        "hasher": get_hasher().algorithm,
+        "logins": logins,
+        "logins_per_second": 1000 / logins["latency_ms"]["mean"],
+        "throttled": _summary(refused),
+    }
+
+
+def run_concurrent(threads=8, bookings_per_thread=10):
+    """
+    Book one room from many threads at once and check that no hours were lost.
+
+    Each thread uses its own database connection. Writers that hit a locked
+    database (SQLite) retry, and those retries are reported.
+    """
+    classroom = Classroom.objects.create(
+        name="Benchmark concurrent",
+        room_number=99999,
+        total_hours=float(threads * bookings_per_thread),
+        capacity=1,
+    )
+    users = [
+        User.objects.create(username=f"bench_concurrent{n}") for n in range(threads)
+    ]
+    base = (timezone.now() + timedelta(days=400)).replace(microsecond=0)
+    barrier = threading.Barrier(threads)
+    retries = [0] * threads
+
+    def worker(index):
+        try:
+            barrier.wait()
+            for n in range(bookings_per_thread):
+                start = base + timedelta(hours=index * bookings_per_thread + n)
+                while True:
+                    try:
+                        Booking.objects.create(
+                            classroom_id=classroom.pk,
+                            user=users[index],
+                            start_time=start,
+                            end_time=start + timedelta(minutes=30),
+                        )
+                        break
+                    except OperationalError:
+                        retries[index] += 1
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    classroom.refresh_from_db()
+    booked = Booking.objects.filter(classroom=classroom).count()
+    expected = classroom.total_hours - booked * 0.5
+    return {
+        "threads": threads,
+        "bookings": booked,
+        "seconds": elapsed,
+        "bookings_per_second": booked / elapsed if elapsed else None,
+        "retries": sum(retries),
+        "hours_left": classroom.hours_left,
+        "expected_hours_left": expected,
+        "lost_hours": expected - classroom.hours_left,
+    }
+
+
+def run(classrooms=50, users=200, bookings=5000, iterations=20, threads=8):
+    # Generate data and run every scenario, returning a JSON-serialisable dict
+    started = time.perf_counter()
+    staff, user = generate(classrooms, users, bookings)
+    generated = time.perf_counter() - started
+
+    return {
+        "format": FORMAT_VERSION,
+        "database": connection.vendor,
+        "conn_max_age": connection.settings_dict["CONN_MAX_AGE"],
+        "pool": "pool" in connection.settings_dict["OPTIONS"],
+        "sizes": {
+            "classrooms": classrooms,
+            "users": users,
+            "bookings": bookings,
+            "iterations": iterations,
+        },
+        "generate_seconds": generated,
+        "scenarios": run_scenarios(staff, user, iterations),
+        "connections": run_connections(user, iterations),
+        "logins": run_logins(iterations),
+        "concurrent": run_concurrent(threads) if threads else None,
+    }
+
+
+def compare(current, baseline, threshold=1.2):
+    """
+    List scenarios whose p50 latency grew by more than ``threshold`` times,
+    or that now run more queries than in ``baseline``.
+    """
+    regressions = []
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        ratio = result["latency_ms"]["p50"] / max(before["latency_ms"]["p50"], 1e-9)
+        if ratio > threshold or result["queries"] > before["queries"]:
+            regressions.append(
+                {
+                    "scenario": name,
+                    "p50_ratio": ratio,
+                    "queries": result["queries"],
+                    "baseline_queries": before["queries"],
+                }
+            )
+    return regressions
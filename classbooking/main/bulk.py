@@ -0,0 +1,294 @@
+import csv
+import io
+import json
+
+from bisect import bisect_right, insort
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import ledger, notifications, policies, rollups
+from .models import OVERLAP_ERROR, Booking, Classroom
+from .operations import is_overlap_violation
+
+# Upper bound on rows accepted by a single bulk request or recurrence rule
+MAX_ROWS = 1000
+
+FREQUENCIES = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+
+
+class BulkBookingError(ValueError):
+    # Raised when the input as a whole can't be read (bad format, bad rule)
+    pass
+
+
+def _aware(value, day_end=False):
+    """
+    Accept datetimes or ISO strings, naive values are in the current timezone.
+
+    A bare date means the start of that day, or its last moment with ``day_end``.
+    Anything unreadable gives None.
+    """
+    if isinstance(value, str):
+        try:
+            text = value.strip()
+            parsed = parse_datetime(text)
+            if parsed is None and parse_date(text) is not None:
+                parsed = datetime.combine(
+                    parse_date(text), time.max if day_end else time.min
+                )
+        except ValueError:
+            parsed = None
+        value = parsed
+    if not isinstance(value, datetime):
+        return None
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_current_timezone())
+    return value
+
+
+def expand_recurrence(rule):
+    """
+    Turn a recurrence rule into booking rows.
+
+    ``rule`` holds classroom (id) or room_number, start_time, end_time,
+    freq ("daily" or "weekly"), an optional interval, and count and/or until.
+    """
+    if not isinstance(rule, dict):
+        raise BulkBookingError("recurrence ต้องเป็น object")
+    start, end = _aware(rule.get("start_time")), _aware(rule.get("end_time"))
+    if start is None or end is None:
+        raise BulkBookingError("ต้องระบุ start_time และ end_time ให้ถูกต้อง")
+
+    freq = FREQUENCIES.get(rule.get("freq", "weekly"))
+    if freq is None:
+        raise BulkBookingError("freq ต้องเป็น daily หรือ weekly")
+
+    try:
+        step = freq * int(rule.get("interval", 1))
+        count = int(rule["count"]) if rule.get("count") else None
+    except (TypeError, ValueError, OverflowError):
+        # OverflowError: an interval longer than timedelta can hold
+        raise BulkBookingError("interval และ count ต้องเป็นจำนวนเต็ม")
+
+    until = _aware(rule["until"], day_end=True) if rule.get("until") else None
+    if step <= timedelta(0) or (count is None and until is None):
+        raise BulkBookingError("ต้องระบุ count หรือ until และ interval ต้องมากกว่า 0")
+
+    room = {k: rule[k] for k in ("classroom", "room_number") if rule.get(k)}
+    rows = []
+    while (count is None or len(rows) < count) and (until is None or start <= until):
+        if len(rows) >= MAX_ROWS:
+            raise BulkBookingError(f"กฎการจองซ้ำสร้างได้ไม่เกิน {MAX_ROWS} รายการ")
+        rows.append({**room, "start_time": start, "end_time": end})
+        if count is not None and len(rows) >= count:
+            break
+        try:
+            start, end = start + step, end + step
+        except OverflowError:
+            # Past the last representable date, so past any ``until`` too
+            if until is not None:
+                break
+            raise BulkBookingError("การจองซ้ำเกินช่วงวันที่ที่รองรับ")
+    return rows
+
+
+def parse_rows(content, fmt):
+    """
+    Read booking rows from CSV or JSON text.
+
+    JSON may be a list of rows, {"rows": [...]} or {"recurrence": {...}}.
+    CSV needs a header with classroom or room_number, start_time and end_time.
+    """
+    if fmt == "json":
+        try:
+            data = json.loads(content)
+        except ValueError:
+            raise BulkBookingError("ไฟล์ JSON ไม่ถูกต้อง")
+        if isinstance(data, dict) and "recurrence" in data:
+            return expand_recurrence(data["recurrence"])
+        if isinstance(data, dict):
+            data = data.get("rows")
+        if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+            raise BulkBookingError("ต้องส่งรายการการจองเป็น list ของ object")
+        rows = data
+    elif fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(content)))
+    else:
+        raise BulkBookingError("รองรับเฉพาะไฟล์ csv หรือ json")
+
+    if len(rows) > MAX_ROWS:
+        raise BulkBookingError(f"ส่งได้ไม่เกิน {MAX_ROWS} รายการต่อครั้ง")
+    return rows
+
+
+def _resolve_classrooms(rows):
+    # One query for every classroom referenced by id or room number, rows locked
+    ids, numbers = set(), set()
+    for row in rows:
+        # isdecimal(), not isdigit(): "²" is a digit int() can't read
+        if str(row.get("classroom") or "").strip().isdecimal():
+            ids.add(int(row["classroom"]))
+        elif str(row.get("room_number") or "").strip().isdecimal():
+            numbers.add(int(row["room_number"]))
+
+    rooms = Classroom.objects.select_for_update().filter(pk__in=ids) | (
+        Classroom.objects.select_for_update().filter(room_number__in=numbers)
+    )
+    by_id, by_number = {}, {}
+    for room in rooms:
+        by_id[room.pk] = by_number[room.room_number] = room
+    return by_id, by_number
+
+
+def _existing_spans(classroom_id, candidates):
+    # One query per classroom: bookings that touch the window covered by the batch
+    window_start = min(start for start, _ in candidates)
+    window_end = max(end for _, end in candidates)
+    spans = Booking.objects.filter(
+        classroom_id=classroom_id,
+        start_time__lt=window_end,
+        end_time__gt=window_start,
+    ).order_by("start_time")
+    return list(spans.values_list("start_time", "end_time"))
+
+
+def _conflicts(ends, starts, start, end):
+    # Bookings in one room never overlap, so sorted by start they are also sorted
+    # by end: the first span ending after ``start`` is the only one to check
+    i = bisect_right(ends, start)
+    return i < len(starts) and starts[i] < end
+
+
+def book_many(user, rows, commit=True):
+    """
+    Validate and create many bookings for ``user``.
+
+    Overlaps are checked with one query per classroom and a sweep over the
+    sorted spans (including rows accepted earlier in the same batch). The
+    user's booking limits (main.policies) cost one more query per row, and
+    are skipped for staff without limits. Accepted rows are inserted with
+    bulk_create and hours are deducted once per classroom. The user is
+    mailed one summary of the bookings made. Returns one report entry per
+    input row.
+    """
+    report = []
+    now = timezone.now()
+    limited = policies.has_limits(user)
+
+    with transaction.atomic():
+        by_id, by_number = _resolve_classrooms(rows)
+
+        parsed = []
+        for index, row in enumerate(rows, start=1):
+            entry = {"row": index, "status": "rejected"}
+            report.append(entry)
+
+            key = str(row.get("classroom") or "").strip()
+            number = str(row.get("room_number") or "").strip()
+            if key.isdecimal():
+                room = by_id.get(int(key))
+            else:
+                room = by_number.get(int(number)) if number.isdecimal() else None
+            start, end = _aware(row.get("start_time")), _aware(row.get("end_time"))
+
+            if room is None:
+                entry["error"] = "ไม่พบห้องเรียนที่ระบุ"
+            elif start is None or end is None:
+                entry["error"] = "รูปแบบวันเวลาไม่ถูกต้อง"
+            elif end <= start:
+                entry["error"] = "เวลาสิ้นสุดต้องอยู่หลังเวลาเริ่มต้น"
+            elif start < now:
+                entry["error"] = "คุณไม่สามารถจองห้องเรียนในอดีตได้"
+            else:
+                entry.update(
+                    classroom=room.pk,
+                    start_time=timezone.localtime(start).isoformat(),
+                    end_time=timezone.localtime(end).isoformat(),
+                )
+                parsed.append((entry, room, start, end))
+
+        grouped = defaultdict(list)
+        for item in parsed:
+            grouped[item[1].pk].append(item)
+
+        accepted = []
+        # (classroom_id, start, end) accepted so far, for the per-user quotas
+        pending = []
+        for classroom_id, items in grouped.items():
+            room = items[0][1]
+            spans = _existing_spans(classroom_id, [(s, e) for _, _, s, e in items])
+            starts = [s for s, _ in spans]
+            ends = [e for _, e in spans]
+            hours_left = room.hours_left
+
+            for entry, _, start, end in sorted(items, key=lambda item: item[2]):
+                hours = ledger.booked_hours(start, end)
+                error = None
+                if _conflicts(ends, starts, start, end):
+                    error = OVERLAP_ERROR
+                elif hours > hours_left:
+                    error = f"ห้องเรียนนี้เหลือเวลาอีกเพียง {hours_left:.2f} ชั่วโมงเท่านั้น"
+                elif limited:
+                    error = policies.check(room, start, end, user, pending=pending)
+                if error:
+                    entry["error"] = error
+                    continue
+
+                insort(starts, start)
+                insort(ends, end)
+                hours_left -= hours
+                pending.append((classroom_id, start, end))
+                accepted.append(
+                    (
+                        entry,
+                        Booking(
+                            classroom=room, user=user, start_time=start, end_time=end
+                        ),
+                    )
+                )
+
+        if not commit:
+            for entry, _ in accepted:
+                entry.update(status="ok")
+            return report
+
+        try:
+            with transaction.atomic():
+                created = Booking.objects.bulk_create([b for _, b in accepted])
+                ledger.adjust_booked(
+                    (
+                        b.classroom_id,
+                        b.start_time,
+                        -ledger.booked_hours(b.start_time, b.end_time),
+                    )
+                    for b in created
+                )
+                # bulk_create skips Booking.save, so the rollups are updated here
+                ledger.track_usage(
+                    rollups.collect(
+                        (b.classroom_id, b.user_id, b.start_time, b.end_time)
+                        for b in created
+                    )
+                )
+        except IntegrityError as e:
+            # Someone else booked one of the slots after our check
+            if not is_overlap_violation(e):
+                raise
+            for entry, _ in accepted:
+                entry["error"] = OVERLAP_ERROR
+            return report
+
+    for (entry, _), booking in zip(accepted, created):
+        entry.update(status="created", id=booking.pk)
+    notifications.bookings_created(user, created)
+    return report
+
+
+def summarize(report):
+    # Counts shown next to the per-row report
+    created = sum(1 for entry in report if entry["status"] in ("created", "ok"))
+    return {"accepted": created, "rejected": len(report) - created, "rows": report}
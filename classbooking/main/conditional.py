@@ -0,0 +1,72 @@
+import hashlib
+
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib import messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import availability
+
+
+def _validators(request, user, stamp):
+    # The page also depends on who is looking (staff buttons, CSRF token), so the
+    # session is part of the ETag; it changes on every log in and log out
+    etag, last_modified = stamp
+    raw = f"{etag}:{user.pk}:{user.is_staff}:{request.session.session_key}"
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest()), int(
+        last_modified.timestamp()
+    )
+
+
+def _conditional_response(request, etag, last_modified):
+    # A 304 would leave pending flash messages unshown, render the page instead
+    if len(messages.get_messages(request)):
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def _finish(request, response, etag, last_modified):
+    if request.method in ("GET", "HEAD"):
+        response.headers.setdefault("ETag", etag)
+        response.headers.setdefault("Last-Modified", http_date(last_modified))
+    # Let browsers keep the page but ask every time, so a refresh is a cheap 304
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def unless_changed(view):
+    """
+    Answer 304 Not Modified while no booking or classroom changed.
+
+    Like Django's condition decorator, with the ETag and Last-Modified taken
+    from availability.stamp(), so checking costs one primary key lookup.
+    Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            user = await request.auser()
+            etag, last_modified = _validators(
+                request, user, await availability.astamp()
+            )
+            response = _conditional_response(request, etag, last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+
+    else:
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            etag, last_modified = _validators(
+                request, request.user, availability.stamp()
+            )
+            response = _conditional_response(request, etag, last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+
+    return inner
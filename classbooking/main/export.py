@@ -0,0 +1,169 @@
+import csv
+import hashlib
+import heapq
+
+from datetime import timezone as dt_timezone
+
+from django.core import signing
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import ledger
+
+# Rows fetched per round trip, the export never holds more than this in memory
+CHUNK_SIZE = 2000
+
+CSV_HEADER = [
+    "id",
+    "classroom",
+    "room_number",
+    "username",
+    "start_time",
+    "end_time",
+    "hours",
+]
+
+FEED_SALT = "main.export.feed"
+
+
+class Echo:
+    # File-like object whose write() hands the line back to the csv writer
+    def write(self, value):
+        return value
+
+
+def _chunks(bookings):
+    return (
+        bookings.select_related("classroom", "user")
+        .order_by("start_time", "pk")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def export_rows(bookings, archived=None):
+    """
+    Bookings with their classroom and user, streamed in chunks.
+
+    ``archived`` is a BookingArchive queryset filtered like ``bookings``; the
+    two are merged into one sequence ordered by start time.
+    """
+    if archived is None:
+        return _chunks(bookings)
+    return heapq.merge(
+        _chunks(bookings),
+        _chunks(archived),
+        key=lambda booking: (booking.start_time, booking.pk),
+    )
+
+
+def csv_lines(bookings, archived=None):
+    """
+    Yield the bookings (and ``archived``, see export_rows) as CSV, one line at a time.
+
+    Times are in the current timezone. Meant to feed a StreamingHttpResponse.
+    """
+    writer = csv.writer(Echo())
+    # BOM so Excel opens the Thai room names as UTF-8
+    yield "\ufeff" + writer.writerow(CSV_HEADER)
+    for booking in export_rows(bookings, archived):
+        yield writer.writerow(
+            [
+                booking.pk,
+                booking.classroom.name,
+                booking.classroom.room_number,
+                booking.user.username,
+                timezone.localtime(booking.start_time).isoformat(),
+                timezone.localtime(booking.end_time).isoformat(),
+                f"{ledger.booked_hours(booking.start_time, booking.end_time):.2f}",
+            ]
+        )
+
+
+def _ics_time(value):
+    return value.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _ics_text(value):
+    # TEXT escaping from RFC 5545 section 3.3.11
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def _ics_line(line):
+    # Fold lines longer than 75 octets, continuation lines start with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Don't split a multi-byte character (Thai is 3 bytes in UTF-8)
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode())
+        start, limit = end, 74
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_lines(bookings, name, host, archived=None):
+    """
+    Yield the bookings as an iCalendar (RFC 5545) calendar, one line at a time.
+
+    ``host`` makes the event UIDs globally unique, so calendar clients update
+    events in place when the feed is polled again.
+    """
+    yield _ics_line("BEGIN:VCALENDAR")
+    yield _ics_line("VERSION:2.0")
+    yield _ics_line("PRODID:-//classbooking//bookings//TH")
+    yield _ics_line("CALSCALE:GREGORIAN")
+    yield _ics_line(f"X-WR-CALNAME:{_ics_text(name)}")
+    for booking in export_rows(bookings, archived):
+        room = booking.classroom
+        yield _ics_line("BEGIN:VEVENT")
+        yield _ics_line(f"UID:booking-{booking.pk}@{host}")
+        yield _ics_line(f"DTSTAMP:{_ics_time(booking.updated_at)}")
+        yield _ics_line(f"LAST-MODIFIED:{_ics_time(booking.updated_at)}")
+        yield _ics_line(f"DTSTART:{_ics_time(booking.start_time)}")
+        yield _ics_line(f"DTEND:{_ics_time(booking.end_time)}")
+        yield _ics_line(
+            f"SUMMARY:{_ics_text(f'{room.name} (ห้อง {room.room_number})')}"
+        )
+        yield _ics_line(f"LOCATION:{_ics_text(f'ห้อง {room.room_number}')}")
+        yield _ics_line(f"DESCRIPTION:{_ics_text(f'จองโดย {booking.user.username}')}")
+        yield _ics_line("END:VEVENT")
+    yield _ics_line("END:VCALENDAR")
+
+
+def feed_token(user):
+    # Signed user id for the subscribable feed URL, calendar clients can't log in
+    return signing.dumps(user.pk, salt=FEED_SALT, compress=True)
+
+
+def feed_user_id(token):
+    # User id from a feed token, or None when it was tampered with
+    try:
+        return signing.loads(token, salt=FEED_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def feed_state(bookings):
+    """
+    Return (etag, last_modified) for a set of bookings with a single aggregate.
+
+    Creates and edits move the latest updated_at, deletions change the count,
+    so the ETag changes whenever the feed would. Last-Modified can't see
+    deletions; clients that send If-None-Match (which takes precedence) are
+    never served a stale feed.
+    """
+    state = bookings.aggregate(
+        count=Count("pk"), last_id=Max("pk"), last_modified=Max("updated_at")
+    )
+    raw = f"{state['count']}:{state['last_id']}:{state['last_modified']}"
+    return hashlib.md5(raw.encode()).hexdigest(), state["last_modified"]
@@ -1,7 +1,8 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, time, timedelta
+from . import availability, policies
 from .models import Booking, Classroom
 
 
@@ -40,6 +41,11 @@ class BookingForm(forms.ModelForm):
             self.fields["classroom"].queryset = Classroom.objects.filter(
                 is_available=True
             )
+            # Render the dropdown from the cached snapshot, the queryset above
+            # is only evaluated when a submitted choice is validated
+            self.fields["classroom"].choices = [
+                ("", self.fields["classroom"].empty_label)
+            ] + [(room["id"], room["label"]) for room in availability.available_rooms()]
 
         # Current time localized
         now = timezone.localtime()
@@ -86,48 +92,22 @@ class BookingForm(forms.ModelForm):
                 if duration <= 0:
                     raise ValidationError("เวลาสิ้นสุดต้องอยู่หลังเวลาเริ่มต้น")
 
-                # Check if booking exceeds remaining hours
-                if duration > classroom.hours_left:
-                    raise ValidationError(
-                        f"ห้องเรียนนี้เหลือเวลาอีกเพียง {classroom.hours_left:.2f} ชั่วโมงเท่านั้น"
-                    )
-
-                # Check for overlapping bookings
-                overlaps = Booking.objects.filter(
-                    classroom=classroom,
-                    start_time__lt=end,  # booking starts before this one ends
-                    end_time__gt=start,  # booking ends after this one starts
+                # Hours left, overlaps and the user's group limits, all read
+                # in one query (see main.policies)
+                owner = self.instance.user_id if self.instance.pk else user
+                error = policies.check(
+                    classroom,
+                    start,
+                    end,
+                    user,
+                    owner=owner,
+                    exclude_pk=self.instance.pk,
                 )
+                if error:
+                    raise ValidationError(error)
 
-                # If editing an existing booking, exclude itself
-                if self.instance.pk:
-                    overlaps = overlaps.exclude(pk=self.instance.pk)
-
-                if overlaps.exists():
-                    raise ValidationError(
-                        f"ห้องเรียน {classroom.name} ถูกจองแล้วในช่วงเวลาที่เลือกไปแล้ว"
-                    )
-
-                # --- ADMIN PERMISSION ---
-
-                # Enforce maximum 1 hour booking for normal users
-                # Assuming superusers/staff are allowed longer bookings
-                if user and not user.is_staff and (end - start) > timedelta(hours=1):
-                    raise ValidationError(
-                        "คุณไม่สามารถจองห้องเรียนได้นานกว่า 1 ชั่วโมง ถ้าคุณไม่ใช่ผู้ดูแลระบบ"
-                    )
-
-                # Only one booking per classroom per user (unless staff)
-                if self.user and not self.user.is_staff:
-                    existing = Booking.objects.filter(
-                        user=self.user, classroom=classroom
-                    )
-                    if self.instance.pk:
-                        existing = existing.exclude(pk=self.instance.pk)
-                    if existing.exists():
-                        raise ValidationError(
-                            "คุณได้จองห้องเรียนนี้แล้ว ผู้ใช้ทั่วไปสามารถจองห้องเรียนแต่ละห้องได้เพียงครั้งเดียวเท่านั้น"
-                        )
+                # Booking.clean needn't check this span for overlaps again
+                self.instance._checked_span = (classroom.pk, start, end)
 
                 # # OLD: End must be after start
                 # if end <= start:
@@ -157,6 +137,7 @@ class ClassroomForm(forms.ModelForm):
             "total_hours",
             "capacity",
             "is_available",
+            "reset_policy",
         ]
         labels = {
             "name": "ชื่อห้องเรียน",
@@ -164,6 +145,7 @@ class ClassroomForm(forms.ModelForm):
             "total_hours": "จำนวนชั่วโมงรวมที่สามารถใช้งานได้",
             "capacity": "ขนาดนักเรียนที่รับได้",
             "is_available": "เปิดให้จองหรือไม่",
+            "reset_policy": "รีเซ็ตชั่วโมงที่เหลือให้เต็มอัตโนมัติ",
         }
 
     def __init__(self, *args, **kwargs):
@@ -181,3 +163,89 @@ class ClassroomForm(forms.ModelForm):
         self.fields["capacity"].widget.attrs.update(
             {"placeholder": "กรุณากำหนดขนาดนักเรียนที่รับได้"}
         )
+
+
+class ClassroomImportForm(ClassroomForm):
+    # One row of a classroom import (main.importer), validated without queries
+    class Meta(ClassroomForm.Meta):
+        fields = ["name", "room_number", "total_hours", "capacity", "reset_policy"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["reset_policy"].required = False
+
+    def clean_reset_policy(self):
+        return self.cleaned_data["reset_policy"] or Classroom.RESET_NONE
+
+    def validate_unique(self):
+        # Existing room numbers are updated, not rejected
+        pass
+
+
+class BookingFilterForm(forms.Form):
+    # Filters for the staff booking list, each one backed by a Booking index
+    classroom = forms.ModelChoiceField(
+        queryset=Classroom.objects.order_by("room_number"),
+        required=False,
+        empty_label="ทุกห้องเรียน",
+        label="ห้องเรียน",
+    )
+    user = forms.CharField(max_length=150, required=False, label="ชื่อผู้จอง")
+    date_from = forms.DateField(
+        required=False,
+        label="ตั้งแต่วันที่",
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    date_to = forms.DateField(
+        required=False,
+        label="ถึงวันที่",
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+
+    def filter(self, bookings):
+        # Apply the cleaned filters to a Booking queryset
+        if not self.is_valid():
+            return bookings
+
+        classroom = self.cleaned_data.get("classroom")
+        username = self.cleaned_data.get("user")
+        date_from = self.cleaned_data.get("date_from")
+        date_to = self.cleaned_data.get("date_to")
+        tz = timezone.get_current_timezone()
+
+        if classroom:
+            bookings = bookings.filter(classroom=classroom)
+        if username:
+            bookings = bookings.filter(user__username=username)
+        if date_from:
+            start = datetime.combine(date_from, time.min)
+            bookings = bookings.filter(start_time__gte=timezone.make_aware(start, tz))
+        if date_to:
+            # Whole days, so the end bound is midnight after date_to
+            end = datetime.combine(date_to + timedelta(days=1), time.min)
+            bookings = bookings.filter(start_time__lt=timezone.make_aware(end, tz))
+        return bookings
+
+
+class UsageFilterForm(BookingFilterForm):
+    # Same filters as the booking list, applied to the usage rollups instead
+    DEFAULT_DAYS = 30
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # date_to defaults to today, see window()
+        date_from = cleaned_data.get("date_from")
+        date_to = cleaned_data.get("date_to") or timezone.localdate()
+        if date_from and date_from > date_to:
+            raise ValidationError("วันที่เริ่มต้นต้องไม่อยู่หลังวันที่สิ้นสุด")
+        return cleaned_data
+
+    def window(self):
+        # (date_from, date_to), the last DEFAULT_DAYS days unless given
+        today = timezone.localdate()
+        data = self.cleaned_data if self.is_valid() else {}
+        date_to = data.get("date_to") or today
+        date_from = data.get("date_from") or date_to - timedelta(
+            days=self.DEFAULT_DAYS - 1
+        )
+        return date_from, date_to
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+
+from itertools import islice
+
+from django.db import transaction
+
+from . import availability, reconcile
+from .forms import ClassroomImportForm
+from .models import Classroom
+
+# Rows validated and upserted per round trip
+BATCH_SIZE = 500
+
+UPDATE_FIELDS = [
+    "name",
+    "total_hours",
+    "capacity",
+    "reset_policy",
+    "hours_left",
+    "is_available",
+]
+
+
+class ClassroomImportError(ValueError):
+    # Raised when the input as a whole can't be read
+    pass
+
+
+def read_rows(stream, fmt):
+    """
+    Yield classroom rows (dicts) from a text stream.
+
+    CSV is read one line at a time, so files of any size are fine. JSON is a
+    list of rows or {"rows": [...]}, and is loaded whole.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "json":
+        try:
+            data = json.load(stream)
+        except ValueError:
+            raise ClassroomImportError("ไฟล์ JSON ไม่ถูกต้อง")
+        if isinstance(data, dict):
+            data = data.get("rows")
+        if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+            raise ClassroomImportError("ต้องส่งรายการห้องเรียนเป็น list ของ object")
+        yield from data
+    else:
+        raise ClassroomImportError("รองรับเฉพาะไฟล์ csv หรือ json")
+
+
+def open_upload(upload):
+    # Text stream over an uploaded file, decoded lazily
+    return io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+
+
+def _errors(form):
+    return "; ".join(
+        f"{field}: {' '.join(messages)}" if field != "__all__" else " ".join(messages)
+        for field, messages in form.errors.items()
+    )
+
+
+def _upsert(batch, commit):
+    """
+    Upsert one batch of validated rooms.
+
+    One grouped query reads the booked hours of the rooms that already exist,
+    so hours_left is written consistent with their bookings by the same
+    bulk_create(update_conflicts=True). A room can't shrink below what is
+    already booked, same as on the classroom form.
+    """
+    numbers = [room.room_number for _, room in batch]
+    existing = {
+        room.room_number: room
+        for room in Classroom.objects.with_booked_time()
+        .filter(room_number__in=numbers)
+        .only("room_number", "hours_reset_at")
+    }
+
+    accepted = []
+    for entry, room in batch:
+        current = existing.get(room.room_number)
+        booked = current.booked_hours if current else 0.0
+        if room.total_hours < booked:
+            entry["error"] = (
+                "จำนวนชั่วโมงรวมจะต้องไม่ต่ำกว่าจำนวนชั่วโมงรวมที่จองจากการจองทั้งหมด"
+            )
+            continue
+        room.hours_left = max(room.total_hours - booked, 0)
+        room.is_available = room.hours_left > 0
+        entry["status"] = "updated" if current else "created"
+        accepted.append(room)
+
+    if not commit or not accepted:
+        return
+
+    Classroom.objects.bulk_create(
+        accepted,
+        update_conflicts=True,
+        unique_fields=["room_number"],
+        update_fields=UPDATE_FIELDS,
+    )
+    ids = [room.pk for room in accepted]
+    if None in ids:
+        # Backends that can't return ids from an upsert
+        ids = Classroom.objects.filter(room_number__in=numbers).values_list(
+            "pk", flat=True
+        )
+    # Only changes anything if a booking was made between the read and the upsert
+    reconcile.correct(reconcile.find_drift(list(ids)))
+
+
+def import_classrooms(rows, commit=True):
+    """
+    Validate and upsert classrooms on room_number, returning one report entry per row.
+
+    Rows are consumed lazily in batches of BATCH_SIZE and the whole import runs
+    in one transaction, so a file that turns out to be unreadable halfway
+    changes nothing.
+    """
+    report = []
+    seen = set()
+    rows = enumerate(rows, start=1)
+
+    with transaction.atomic():
+        while chunk := list(islice(rows, BATCH_SIZE)):
+            batch = []
+            for index, row in chunk:
+                entry = {"row": index, "status": "rejected"}
+                report.append(entry)
+
+                form = ClassroomImportForm(row)
+                if not form.is_valid():
+                    entry["error"] = _errors(form)
+                    continue
+
+                room = form.save(commit=False)
+                entry["room_number"] = room.room_number
+                if room.room_number in seen:
+                    entry["error"] = "หมายเลขห้องซ้ำกับแถวก่อนหน้าในไฟล์"
+                    continue
+                seen.add(room.room_number)
+                batch.append((entry, room))
+
+            _upsert(batch, commit)
+
+        if commit:
+            # bulk_create sends no signals
+            availability.invalidate()
+
+    if not commit:
+        for entry in report:
+            if entry["status"] != "rejected":
+                entry["status"] = "ok"
+    return report
+
+
+def summarize(report):
+    counts = {"created": 0, "updated": 0, "ok": 0, "rejected": 0}
+    for entry in report:
+        counts[entry["status"]] += 1
+    return {**counts, "rows": report}
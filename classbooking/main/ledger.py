@@ -0,0 +1,305 @@
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from . import availability, rollups
+from .models import Booking, BookingArchive, Classroom
+
+# Classroom writes collected while a deferred() block is active on this thread
+_local = threading.local()
+
+
+def booked_hours(start, end):
+    # Length of a booking in hours
+    return (end - start).total_seconds() / 3600.0
+
+
+def counts(start, reset_at):
+    # Whether a booking starting at ``start`` is held against hours_left: the
+    # same rule as Classroom.objects.with_booked_time, earlier bookings were
+    # settled by the room's last reset
+    return reset_at is None or start >= reset_at
+
+
+def adjust_hours(classroom_id, delta):
+    """
+    Add ``delta`` hours (negative to deduct) to a classroom in a single UPDATE.
+
+    The new value is computed by the database from the current row, so concurrent
+    bookings can't overwrite each other, and it is clamped to [0, total_hours]
+    the same way Classroom.save does. Only hours_left and is_available are written.
+    Inside deferred() the change is added to the batch instead.
+    """
+    if not delta:
+        return 0
+
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending["hours"][classroom_id] += delta
+        return 0
+
+    # Every right-hand side sees the old row, so availability is derived from
+    # the old hours_left plus delta rather than the freshly clamped value
+    updated = Classroom.objects.filter(pk=classroom_id).update(
+        hours_left=Greatest(
+            Least(F("hours_left") + delta, F("total_hours")), Value(0.0)
+        ),
+        is_available=Case(
+            When(Q(hours_left__gt=-delta) & Q(total_hours__gt=0), then=Value(True)),
+            default=Value(False),
+        ),
+    )
+    if updated:
+        availability.invalidate()
+    return updated
+
+
+def _net_hours(spans):
+    # Sum (classroom_id, start_time, delta) spans per classroom, leaving out
+    # bookings that don't count. A reset never lies in the future, so only
+    # rooms with past bookings have their hours_reset_at looked up.
+    now = timezone.now()
+    unsure = {classroom_id for classroom_id, start, _ in spans if start < now}
+    resets = dict(
+        Classroom.objects.filter(pk__in=unsure).values_list("pk", "hours_reset_at")
+        if unsure
+        else []
+    )
+    net = defaultdict(float)
+    for classroom_id, start, delta in spans:
+        net[classroom_id] += delta if counts(start, resets.get(classroom_id)) else 0
+    return net
+
+
+def adjust_booked(spans):
+    """
+    Apply the hours of bookings, given as (classroom_id, start_time, delta).
+
+    Like adjust_hours, but a booking only moves hours_left while it counts
+    against it (see counts()), so giving back a booking from before the last
+    reset changes nothing, and reconcile agrees with the result. Changes are
+    summed to one UPDATE per classroom; inside deferred() they join the batch.
+    Rooms whose hours end up unchanged still get the change stamp bumped.
+    """
+    spans = list(spans)
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending["spans"].extend(spans)
+        return
+
+    net = _net_hours(spans)
+    for classroom_id, delta in net.items():
+        adjust_hours(classroom_id, delta)
+    if spans and not any(net.values()):
+        # Moved without changing its length, the calendar still changed
+        availability.invalidate()
+
+
+def refresh_availability(classroom_ids):
+    # Fix is_available where it disagrees with hours_left, one UPDATE for all rooms.
+    # Bookings changed either way, so the change stamp is always bumped.
+    updated = (
+        Classroom.objects.filter(pk__in=classroom_ids)
+        .filter(
+            Q(is_available=True, hours_left__lte=0)
+            | Q(is_available=False, hours_left__gt=0)
+        )
+        .update(
+            is_available=Case(
+                When(hours_left__gt=0, then=Value(True)), default=Value(False)
+            )
+        )
+    )
+    availability.invalidate()
+    return updated
+
+
+def track_usage(changes):
+    # Apply rollups.deltas() changes, merged into the batch when inside deferred()
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        rollups.merge(pending["usage"], changes)
+    else:
+        rollups.apply_later(changes)
+
+
+def booking_deleted(booking):
+    # Called by the post_delete signals of Booking and BookingArchive, however
+    # the row was deleted (the ledger, the admin, a cascade from its user):
+    # gives its hours back and takes it out of the usage rollups
+    if getattr(_local, "archiving", False):
+        # Moved to the archive, it still counts as used hours and usage
+        return
+    start, end = booking.start_time, booking.end_time
+    with deferred():
+        track_usage(
+            rollups.deltas(booking.classroom_id, booking.user_id, start, end, sign=-1)
+        )
+        adjust_booked([(booking.classroom_id, start, booked_hours(start, end))])
+        availability_changed(booking.classroom_id)
+
+
+def availability_changed(classroom_id):
+    # Called by the booking signals, coalesced when inside deferred()
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending["availability"].add(classroom_id)
+    else:
+        refresh_availability([classroom_id])
+
+
+@contextmanager
+def deferred():
+    """
+    Batch classroom writes made by bookings inside the block.
+
+    Hour changes are summed per classroom, usage rollup changes per row and
+    signal-driven availability refreshes are coalesced, then written on exit
+    with one UPDATE per classroom, and the rollup changes are handed to one
+    background task. Nested blocks join the outermost one. Nothing is written if
+    the block raises, the surrounding transaction is expected to roll back.
+    """
+    if getattr(_local, "pending", None) is not None:
+        yield
+        return
+
+    pending = _local.pending = {
+        "hours": defaultdict(float),
+        "spans": [],
+        "availability": set(),
+        "usage": defaultdict(lambda: [0.0, 0]),
+    }
+    try:
+        yield
+    finally:
+        _local.pending = None
+
+    for classroom_id, delta in _net_hours(pending["spans"]).items():
+        pending["hours"][classroom_id] += delta
+    for classroom_id, delta in pending["hours"].items():
+        adjust_hours(classroom_id, delta)
+
+    # Rooms whose hours changed already had availability recomputed above
+    adjusted = {
+        classroom_id for classroom_id, delta in pending["hours"].items() if delta
+    }
+    stale = pending["availability"] - adjusted
+    if stale:
+        refresh_availability(stale)
+    elif pending["spans"] and not adjusted:
+        availability.invalidate()
+    rollups.apply_later(pending["usage"])
+
+
+@contextmanager
+def archiving():
+    """
+    Delete bookings inside the block without touching hours or usage rollups.
+
+    For main.archive, which copies the bookings elsewhere before deleting them.
+    """
+    _local.archiving = True
+    try:
+        yield
+    finally:
+        _local.archiving = False
+
+
+def lock_previous(booking):
+    # Lock and return (classroom_id, user_id, start_time, end_time) as stored before an edit
+    if booking._state.adding or booking.pk is None:
+        return None
+    return (
+        Booking.objects.select_for_update()
+        .filter(pk=booking.pk)
+        .values_list("classroom_id", "user_id", "start_time", "end_time")
+        .first()
+    )
+
+
+def settle(booking, previous=None):
+    """
+    Charge a freshly saved booking against its classroom.
+
+    ``previous`` is what lock_previous returned before the save. When editing,
+    the old span is given back and the new one deducted as one net change,
+    so each affected classroom gets exactly one UPDATE. The usage rollups
+    are moved the same way.
+    """
+    spans = [
+        (
+            booking.classroom_id,
+            booking.start_time,
+            -booked_hours(booking.start_time, booking.end_time),
+        )
+    ]
+    usage = rollups.deltas(
+        booking.classroom_id, booking.user_id, booking.start_time, booking.end_time
+    )
+
+    if previous is not None:
+        classroom_id, user_id, start, end = previous
+        spans.append((classroom_id, start, booked_hours(start, end)))
+        rollups.merge(usage, rollups.deltas(classroom_id, user_id, start, end, -1))
+
+    track_usage(usage)
+    adjust_booked(spans)
+
+
+def cancel_bookings(bookings):
+    """
+    Delete the given bookings and give their hours back to the classrooms.
+
+    Runs in one transaction with the rows locked. The post_delete signal gives
+    each booking's hours back (see booking_deleted), batched here into a
+    single UPDATE per classroom however many bookings are removed.
+    """
+    with transaction.atomic():
+        rows = list(
+            bookings.select_for_update().order_by().values_list("pk", flat=True)
+        )
+        if not rows:
+            return 0
+
+        with deferred():
+            Booking.objects.filter(pk__in=rows).delete()
+
+    return len(rows)
+
+
+def delete_user_bookings(user_id, batch_size=500):
+    """
+    Delete every booking of a user, live and archived, in batches.
+
+    Each batch is one transaction; the post_delete signals give the hours
+    back and take the bookings out of the usage rollups, batched into one
+    UPDATE per classroom. Returns the number of bookings deleted.
+    """
+    deleted = 0
+    for model in (Booking, BookingArchive):
+        while True:
+            with transaction.atomic(), deferred():
+                rows = list(
+                    model.objects.filter(user_id=user_id)
+                    .select_for_update()
+                    .order_by("pk")
+                    .values_list("pk", flat=True)[:batch_size]
+                )
+                if not rows:
+                    break
+                model.objects.filter(pk__in=rows).delete()
+            deleted += len(rows)
+            if len(rows) < batch_size:
+                break
+    return deleted
+
+
+def cancel_booking(booking):
+    # Cancel a single booking, see cancel_bookings
+    return cancel_bookings(Booking.objects.filter(pk=booking.pk))
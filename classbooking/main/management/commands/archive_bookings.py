@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move bookings that ended more than BOOKING_ARCHIVE_AFTER_DAYS days ago "
+        "to the booking archive, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Archive bookings that ended more than DAYS days ago instead",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Bookings moved per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the bookings that would be archived",
+        )
+
+    def handle(self, *args, **options):
+        before = None
+        if options["days"] is not None:
+            before = timezone.now() - timedelta(days=options["days"])
+
+        moved = archive.archive_bookings(
+            before=before,
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        verb = "would be archived" if options["dry_run"] else "archived"
+        self.stdout.write(self.style.SUCCESS(f"{moved} bookings {verb}"))
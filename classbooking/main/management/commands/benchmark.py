@@ -0,0 +1,80 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from main import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate N classrooms, M users and K bookings in a throwaway test database, "
+        "measure latency, query counts and memory of the main pages plus a "
+        "concurrent booking run, and print the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--classrooms", type=int, default=50)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--bookings", type=int, default=5000)
+        parser.add_argument(
+            "--iterations", type=int, default=20, help="Requests per scenario"
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="Threads in the concurrent booking run, 0 to skip it",
+        )
+        parser.add_argument("--output", help="Write the JSON results to this file")
+        parser.add_argument(
+            "--baseline", help="Compare against an earlier results file"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.2,
+            help="p50 latency ratio over the baseline that counts as a regression",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read baseline: {e}")
+
+        # Never touch real data: run against a fresh test database, the same
+        # one the test runner would create for the configured backend
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = benchmark.run(
+                classrooms=options["classrooms"],
+                users=options["users"],
+                bookings=options["bookings"],
+                iterations=options["iterations"],
+                threads=options["threads"],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if baseline is not None:
+            results["regressions"] = benchmark.compare(
+                results, baseline, options["threshold"]
+            )
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+        if results.get("regressions"):
+            raise CommandError(
+                f"{len(results['regressions'])} scenarios regressed against the baseline"
+            )
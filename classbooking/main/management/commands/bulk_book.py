@@ -0,0 +1,74 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        "Create many bookings at once from a CSV/JSON file or a recurrence rule, "
+        "printing a per-row JSON report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", required=True, help="Username the bookings belong to"
+        )
+        parser.add_argument(
+            "file", nargs="?", help="CSV or JSON file with booking rows"
+        )
+        parser.add_argument(
+            "--format", choices=["csv", "json"], help="Defaults to the file extension"
+        )
+
+        rule = parser.add_argument_group("recurrence rule (instead of a file)")
+        rule.add_argument("--classroom", type=int, help="Classroom id")
+        rule.add_argument("--room-number", type=int)
+        rule.add_argument("--start", help="First start time, ISO 8601")
+        rule.add_argument("--end", help="First end time, ISO 8601")
+        rule.add_argument("--freq", choices=sorted(bulk.FREQUENCIES), default="weekly")
+        rule.add_argument("--interval", type=int, default=1)
+        rule.add_argument("--count", type=int)
+        rule.add_argument("--until", help="Last date (inclusive), ISO 8601")
+
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Validate only, create nothing"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']!r} does not exist")
+
+        try:
+            if options["file"]:
+                fmt = options["format"] or (
+                    "csv" if options["file"].lower().endswith(".csv") else "json"
+                )
+                with open(options["file"], encoding="utf-8-sig") as f:
+                    rows = bulk.parse_rows(f.read(), fmt)
+            else:
+                rows = bulk.expand_recurrence(
+                    {
+                        "classroom": options["classroom"],
+                        "room_number": options["room_number"],
+                        "start_time": options["start"],
+                        "end_time": options["end"],
+                        "freq": options["freq"],
+                        "interval": options["interval"],
+                        "count": options["count"],
+                        "until": options["until"],
+                    }
+                )
+        except (OSError, bulk.BulkBookingError) as e:
+            raise CommandError(str(e))
+
+        report = bulk.book_many(user, rows, commit=not options["dry_run"])
+        summary = bulk.summarize(report)
+        self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+        self.stderr.write(
+            f"{summary['accepted']} accepted, {summary['rejected']} rejected"
+        )
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update many classrooms at once from a CSV/JSON file, matched "
+        "on room_number, printing a per-row JSON report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "file",
+            help="CSV or JSON file with name, room_number, total_hours, capacity "
+            "and optionally reset_policy",
+        )
+        parser.add_argument(
+            "--format", choices=["csv", "json"], help="Defaults to the file extension"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Validate only, save nothing"
+        )
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or (
+            "csv" if options["file"].lower().endswith(".csv") else "json"
+        )
+        try:
+            with open(options["file"], encoding="utf-8-sig", newline="") as f:
+                report = importer.import_classrooms(
+                    importer.read_rows(f, fmt), commit=not options["dry_run"]
+                )
+        except (OSError, UnicodeDecodeError, importer.ClassroomImportError) as e:
+            raise CommandError(str(e))
+
+        summary = importer.summarize(report)
+        self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+        self.stderr.write(
+            f"{summary['created']} created, {summary['updated']} updated, "
+            f"{summary['ok']} valid (dry run), {summary['rejected']} rejected"
+        )
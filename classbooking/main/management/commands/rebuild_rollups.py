@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from main import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the usage rollups (booked hours per classroom per day and per "
+        "user per week) from all bookings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Bookings read and rollup rows written per query",
+        )
+
+    def handle(self, *args, **options):
+        result = rollups.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{result['classroom_days']} classroom days, "
+                f"{result['user_weeks']} user weeks"
+            )
+        )
@@ -0,0 +1,41 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute each classroom's hours_left from its bookings with one grouped "
+        "query, fix any drift in bulk and print drift metrics as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report drift without fixing it"
+        )
+        parser.add_argument(
+            "--every",
+            type=int,
+            metavar="SECONDS",
+            help="Keep running, checking again every SECONDS",
+        )
+        parser.add_argument(
+            "--fail-on-drift",
+            action="store_true",
+            help="Exit with an error when drift is found (for monitoring)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            metrics = reconcile.reconcile(dry_run=options["dry_run"])
+            self.stdout.write(json.dumps(metrics, ensure_ascii=False))
+
+            if options["every"] is None:
+                break
+            time.sleep(options["every"])
+
+        if options["fail_on_drift"] and metrics["drifted"]:
+            raise CommandError(f"{metrics['drifted']} classrooms had drifted")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from main import resets
+
+
+class Command(BaseCommand):
+    help = (
+        "Reset hours_left to total_hours for rooms whose daily/weekly period has "
+        "started. Safe to run from several workers or as often as you like."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--policy",
+            choices=resets.POLICIES,
+            action="append",
+            help="Only reset this policy (repeatable), defaults to all",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Reset again even if this period has already run",
+        )
+
+    def handle(self, *args, **options):
+        results = resets.reset_due(
+            options["policy"] or resets.POLICIES, force=options["force"]
+        )
+        for policy, count in results.items():
+            if count is None:
+                self.stdout.write(f"{policy}: already reset for this period")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{policy}: {count} rooms reset"))
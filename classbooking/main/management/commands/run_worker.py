@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from main import tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background tasks stored with TASKS_BACKEND=database, "
+        "on a pool of threads, until stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads",
+            type=int,
+            help="Tasks run at the same time (default: TASKS_THREADS)",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=20,
+            help="Tasks claimed from the queue at once",
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when no task is due",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Stop as soon as the queue has no due task",
+        )
+
+    def handle(self, *args, **options):
+        succeeded, failed = tasks.work(
+            threads=options["threads"],
+            batch_size=options["batch"],
+            once=options["once"],
+            poll=options["poll"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"{succeeded} tasks done, {failed} failed")
+        )
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "E-mail a reminder for bookings starting within "
+        "BOOKING_REMINDER_MINUTES minutes that haven't had one yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minutes",
+            type=int,
+            help="Remind about bookings starting within MINUTES instead",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Bookings read per query",
+        )
+        parser.add_argument(
+            "--every",
+            type=int,
+            metavar="SECONDS",
+            help="Keep running, checking again every SECONDS",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = notifications.send_reminders(
+                minutes=options["minutes"], batch_size=options["batch_size"]
+            )
+            self.stdout.write(self.style.SUCCESS(f"{sent} reminders sent"))
+
+            if options["every"] is None:
+                break
+            time.sleep(options["every"])
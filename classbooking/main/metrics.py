@@ -0,0 +1,142 @@
+import threading
+
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+
+# Metrics of the request being handled, None when it isn't sampled
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Timings collected while handling one sampled request.
+
+    Queries are recorded through the module level record_query wrapper, the
+    template backend adds to template_seconds.
+    """
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.queries = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_seconds += perf_counter() - started
+            # Same SQL with different parameters is still the same statement,
+            # repeating it is what an N+1 looks like
+            self.queries[sql] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_queries(self):
+        return sum(count - 1 for count in self.queries.values() if count > 1)
+
+    def most_repeated(self):
+        # (sql, count) of the statement repeated the most, or None
+        if not self.duplicate_queries:
+            return None
+        return self.queries.most_common(1)[0]
+
+    def server_timing(self):
+        # Value for the Server-Timing response header (durations in ms)
+        parts = [
+            f"app;dur={self.wall_seconds * 1000:.1f}",
+            f'db;dur={self.query_seconds * 1000:.1f};desc="{self.query_count} queries"',
+            f"tpl;dur={self.template_seconds * 1000:.1f}",
+        ]
+        if self.duplicate_queries:
+            parts.append(f'dup;desc="{self.duplicate_queries} duplicate queries"')
+        return ", ".join(parts)
+
+
+def current():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    # Execute wrapper installed on every connection, records into the current request
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    return request_metrics.record_query(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    # connection_created receiver, safe to call again for the same connection
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def start():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def finish(token):
+    _current.reset(token)
+
+
+class Registry:
+    """
+    Per-process totals by view, rendered in the Prometheus text format.
+    Each worker process keeps its own totals.
+    """
+
+    FIELDS = [
+        ("requests", "counter", "Sampled requests handled"),
+        ("request_seconds", "counter", "Wall time spent in the view and middleware"),
+        ("queries", "counter", "SQL queries executed"),
+        ("query_seconds", "counter", "Time spent executing SQL queries"),
+        ("duplicate_queries", "counter", "Queries repeating an earlier statement"),
+        ("template_seconds", "counter", "Time spent rendering templates"),
+    ]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: dict.fromkeys(self.fields(), 0))
+
+    @classmethod
+    def fields(cls):
+        return [name for name, _, _ in cls.FIELDS]
+
+    def record(self, view, metrics):
+        with self._lock:
+            totals = self._totals[view]
+            totals["requests"] += 1
+            totals["request_seconds"] += metrics.wall_seconds
+            totals["queries"] += metrics.query_count
+            totals["query_seconds"] += metrics.query_seconds
+            totals["duplicate_queries"] += metrics.duplicate_queries
+            totals["template_seconds"] += metrics.template_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {view: dict(totals) for view, totals in self._totals.items()}
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+    def prometheus(self):
+        totals = self.snapshot()
+        lines = []
+        for name, kind, help_text in self.FIELDS:
+            metric = f"classbooking_{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for view in sorted(totals):
+                label = view.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{metric}{{view="{label}"}} {totals[view][name]}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
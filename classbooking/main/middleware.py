@@ -0,0 +1,128 @@
+import logging
+import random
+
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Opt-in per-request timing and SQL accounting.
+
+    Enabled with REQUEST_METRICS_ENABLED. A REQUEST_METRICS_SAMPLE_RATE share of
+    requests is measured: wall time, number and time of SQL queries, repeated
+    statements (a likely N+1) and template render time. Sampled responses get a
+    Server-Timing header, and totals per view are served to staff by the
+    metrics view in the Prometheus text format.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        self.duplicate_warning = settings.REQUEST_METRICS_DUPLICATE_WARNING
+        # Queries are recorded by a wrapper on every connection, so ORM calls made
+        # from async views (which run in another thread) are counted too
+        connection_created.connect(metrics.install, dispatch_uid="request_metrics")
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        self.install_on_open_connections()
+        current, token = metrics.start()
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.wall_seconds = perf_counter() - started
+            metrics.finish(token)
+        return self.process_metrics(request, response, current)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        # Async views run their queries in the sync thread, where connections live
+        await sync_to_async(self.install_on_open_connections)()
+        current, token = metrics.start()
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.wall_seconds = perf_counter() - started
+            metrics.finish(token)
+        return self.process_metrics(request, response, current)
+
+    @staticmethod
+    def install_on_open_connections():
+        # Connections opened before the middleware was loaded
+        for connection in connections.all(initialized_only=True):
+            metrics.install(connection)
+
+    def process_metrics(self, request, response, current):
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        metrics.registry.record(view, current)
+        response["Server-Timing"] = current.server_timing()
+
+        repeated = current.most_repeated()
+        if repeated and current.duplicate_queries >= self.duplicate_warning:
+            logger.warning(
+                "%s ran %d duplicate queries, most repeated (%dx): %s",
+                view,
+                current.duplicate_queries,
+                repeated[1],
+                repeated[0],
+            )
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also run in an async middleware chain.
+
+    WhiteNoiseMiddleware is sync only, which under ASGI would push every
+    request, including the async views, through a thread. Here only the static
+    files themselves are served from a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
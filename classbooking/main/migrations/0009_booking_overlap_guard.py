@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+import main.operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_alter_classroom_capacity_alter_classroom_hours_left_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['classroom', 'start_time', 'end_time'], name='booking_room_span_idx'),
+        ),
+        main.operations.InstallOverlapGuard(),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_booking_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classroom',
+            name='hours_reset_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='reset_policy',
+            field=models.CharField(choices=[('none', 'ไม่รีเซ็ตอัตโนมัติ'), ('daily', 'รีเซ็ตทุกวัน'), ('weekly', 'รีเซ็ตทุกสัปดาห์')], default='none', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='HoursResetRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('policy', models.CharField(choices=[('none', 'ไม่รีเซ็ตอัตโนมัติ'), ('daily', 'รีเซ็ตทุกวัน'), ('weekly', 'รีเซ็ตทุกสัปดาห์')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('ran_at', models.DateTimeField(auto_now_add=True)),
+                ('classrooms_reset', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('policy', 'period_start'), name='unique_reset_per_period')],
+            },
+        ),
+    ]
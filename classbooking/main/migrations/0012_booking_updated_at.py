@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+import main.operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_classroom_reset_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        # SQLite rebuilds main_booking to add the column, dropping its triggers
+        main.operations.InstallOverlapGuard(),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    from main import rollups
+
+    rollups.rebuild(
+        booking_model=apps.get_model('main', 'Booking'),
+        room_model=apps.get_model('main', 'ClassroomDailyUsage'),
+        user_model=apps.get_model('main', 'UserWeeklyUsage'),
+        # Created by a later migration
+        archive_model=None,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_booking_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassroomDailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('booked_hours', models.FloatField(default=0)),
+                ('bookings', models.IntegerField(default=0)),
+                ('classroom', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_usage', to='main.classroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='classroom_usage_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('classroom', 'day'), name='unique_classroom_day_usage')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserWeeklyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField()),
+                ('booked_hours', models.FloatField(default=0)),
+                ('bookings', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['week'], name='user_usage_week_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'week'), name='unique_user_week_usage')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_stamp(apps, schema_editor):
+    # The single row main.availability reads and bumps
+    apps.get_model('main', 'AvailabilityStamp').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_booking_reminder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityStamp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_stamp, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_availability_stamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookingarchive',
+            index=models.Index(fields=['end_time'], name='archive_end_idx'),
+        ),
+    ]
@@ -1,9 +1,63 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .operations import is_overlap_violation
+
+# Message shown whenever a booking collides with another one in the same room
+OVERLAP_ERROR = "ห้องเรียนนี้ถูกจองตามเวลาที่เลือกไปแล้ว"
+
+
+class ClassroomQuerySet(models.QuerySet):
+    def with_booked_time(self):
+        # Annotate booked_time: total length of the bookings counted against
+        # hours_left, i.e. those starting after the room's last reset
+        counted = Q(hours_reset_at__isnull=True) | Q(
+            bookings__start_time__gte=F("hours_reset_at")
+        )
+        # Archived bookings still count, summed in a subquery so the two
+        # joins don't multiply each other's rows
+        archived = (
+            BookingArchive.objects.filter(classroom=OuterRef("pk"))
+            .filter(
+                Q(classroom__hours_reset_at__isnull=True)
+                | Q(start_time__gte=F("classroom__hours_reset_at"))
+            )
+            .order_by()
+            .values("classroom")
+            .annotate(total=Sum(F("end_time") - F("start_time")))
+            .values("total")
+        )
+        return self.annotate(
+            booked_time=Coalesce(
+                Sum(
+                    F("bookings__end_time") - F("bookings__start_time"),
+                    filter=counted,
+                ),
+                Value(timedelta(0)),
+            )
+            + Coalesce(
+                Subquery(archived, output_field=models.DurationField()),
+                Value(timedelta(0)),
+            )
+        )
 
 
 class Classroom(models.Model):
+    RESET_NONE = "none"
+    RESET_DAILY = "daily"
+    RESET_WEEKLY = "weekly"
+    RESET_POLICIES = [
+        (RESET_NONE, "ไม่รีเซ็ตอัตโนมัติ"),
+        (RESET_DAILY, "รีเซ็ตทุกวัน"),
+        (RESET_WEEKLY, "รีเซ็ตทุกสัปดาห์"),
+    ]
+
     # Default the name to "Generic Classroom" to make existing rows populatable
     name = models.CharField(max_length=100)
     # Make the room number unique
@@ -16,22 +70,48 @@ class Classroom(models.Model):
     hours_left = models.FloatField(default=None, editable=False)
     # Class room availability
     is_available = models.BooleanField(default=True)
+    # How often hours_left goes back to total_hours (see manage.py reset_hours)
+    reset_policy = models.CharField(
+        max_length=10, choices=RESET_POLICIES, default=RESET_NONE
+    )
+    # When hours_left was last reset
+    hours_reset_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ClassroomQuerySet.as_manager()
+
+    @property
+    def booked_hours(self):
+        # Needs a queryset annotated with with_booked_time()
+        return self.booked_time.total_seconds() / 3600.0
+
+    @property
+    def live_hours_left(self):
+        # hours_left derived from the bookings instead of the stored counter
+        return max(min(self.total_hours - self.booked_hours, self.total_hours), 0)
 
     def update_hours(self, duration_hours, user):
-        # Deduct hours when booked
-        if self.hours_left - duration_hours <= 0:
-            self.hours_left = 0
-            self.is_available = False
-        else:
-            self.hours_left -= duration_hours
-            self.is_available = True
-        self.save()
+        # Deduct hours when booked, the database does the arithmetic atomically
+        from . import ledger
+
+        ledger.adjust_hours(self.pk, -duration_hours)
+
+        # Mirror the same clamping on this instance so callers see the new values
+        self.hours_left = max(
+            min(self.hours_left - duration_hours, self.total_hours), 0
+        )
+        self.is_available = self.hours_left > 0
 
     def reset_hours(self):
-        # Reset daily or weekly depending on rules
-        self.hours_left = self.total_hours
-        self.is_available = True
-        self.save()
+        # Reset a single room, main.resets does all rooms of a policy at once.
+        # Bookings that haven't started yet keep their hours.
+        now = timezone.now()
+        held = self.bookings.filter(start_time__gte=now).aggregate(
+            total=Sum(F("end_time") - F("start_time"))
+        )["total"] or timedelta(0)
+        self.hours_left = max(self.total_hours - held.total_seconds() / 3600.0, 0)
+        self.is_available = self.hours_left > 0
+        self.hours_reset_at = now
+        super().save(update_fields=["hours_left", "is_available", "hours_reset_at"])
 
     def clean(self):
         # If hours_left is null then set it to equal total_hours
@@ -61,6 +141,20 @@ class Classroom(models.Model):
         return f"{self.name} (ห้อง {self.room_number}) - เหลือ {self.hours_left} ชม."
 
 
+class BookingQuerySet(models.QuerySet):
+    def overlapping(self, classroom, start, end, exclude_pk=None):
+        # Bookings in the same classroom whose [start, end) span intersects this one,
+        # served by the (classroom, start_time, end_time) index
+        overlaps = self.filter(
+            classroom=classroom,
+            start_time__lt=end,  # booking starts before this one ends
+            end_time__gt=start,  # booking ends after this one starts
+        )
+        if exclude_pk is not None:
+            overlaps = overlaps.exclude(pk=exclude_pk)
+        return overlaps
+
+
 class Booking(models.Model):
     classroom = models.ForeignKey(
         Classroom, on_delete=models.CASCADE, related_name="bookings"
@@ -68,6 +162,29 @@ class Booking(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bookings")
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
+    # Change stamp for the calendar feed's Last-Modified and ETag
+    updated_at = models.DateTimeField(auto_now=True)
+    # Set by manage.py send_reminders, cleared when the start time moves
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["classroom", "start_time", "end_time"],
+                name="booking_room_span_idx",
+            ),
+            # Keyset pagination of the staff booking list
+            models.Index(fields=["start_time", "id"], name="booking_start_idx"),
+            models.Index(fields=["user", "start_time"], name="booking_user_start_idx"),
+            # Bookings still waiting for their reminder, see main.notifications
+            models.Index(
+                fields=["start_time"],
+                condition=Q(reminder_sent_at__isnull=True),
+                name="booking_reminder_due_idx",
+            ),
+        ]
 
     def clean(self):
         # If classroom is None then raise error
@@ -77,25 +194,189 @@ class Booking(models.Model):
             # raise ValidationError("Please select a classroom.")
             return
 
-        # Check for overlapping bookings
-        overlapping = Booking.objects.filter(
-            classroom=self.classroom,
-            start_time__lt=self.end_time,
-            end_time__gt=self.start_time,
-        ).exclude(pk=self.pk)
+        # BookingForm already checked this exact span (main.policies)
+        if getattr(self, "_checked_span", None) == (
+            classroom.pk,
+            self.start_time,
+            self.end_time,
+        ):
+            return
 
-        if overlapping.exists():
-            raise ValidationError("ห้องเรียนนี้ถูกจองตามเวลาที่เลือกไปแล้ว")
+        # Check for overlapping bookings
+        if Booking.objects.overlapping(
+            classroom, self.start_time, self.end_time, exclude_pk=self.pk
+        ).exists():
+            raise ValidationError(OVERLAP_ERROR)
 
     def save(self, *args, **kwargs):
-        duration = (
-            self.end_time - self.start_time
-        ).total_seconds() / 3600.0  # in hours
+        from . import ledger
 
-        super().save(*args, **kwargs)
+        # The database rejects overlaps even if two requests pass clean() at once,
+        # report that the same way as the application-level check
+        try:
+            # Insert the booking and deduct classroom hours in one short transaction
+            with transaction.atomic():
+                previous = ledger.lock_previous(self)
+                if previous is not None and previous[2] != self.start_time:
+                    # Moved, remind again before the new start
+                    self.reminder_sent_at = None
+                super().save(*args, **kwargs)
+                ledger.settle(self, previous)
+        except IntegrityError as e:
+            if is_overlap_violation(e):
+                raise ValidationError(OVERLAP_ERROR) from e
+            raise
+
+    def __str__(self):
+        return f"{self.classroom} จองโดย {self.user} ตั้งแต่ {self.start_time} ถึง {self.end_time}"
+
+
+class BookingArchive(models.Model):
+    # Bookings moved out of Booking by main.archive once they are long over.
+    # The id is the original booking's, so exports keep showing the same ids.
+    id = models.BigIntegerField(primary_key=True)
+    # Covered by the composite indexes below
+    classroom = models.ForeignKey(
+        Classroom,
+        on_delete=models.CASCADE,
+        related_name="archived_bookings",
+        db_index=False,
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="archived_bookings",
+        db_index=False,
+    )
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
 
-        # Deduct classroom hours
-        self.classroom.update_hours(duration, self.user)
+    class Meta:
+        indexes = [
+            models.Index(fields=["start_time", "id"], name="archive_start_idx"),
+            models.Index(
+                fields=["classroom", "start_time"], name="archive_room_start_idx"
+            ),
+            models.Index(fields=["user", "start_time"], name="archive_user_start_idx"),
+            # Newest archived booking, see archive.may_reach_archive
+            models.Index(fields=["end_time"], name="archive_end_idx"),
+        ]
 
     def __str__(self):
         return f"{self.classroom} จองโดย {self.user} ตั้งแต่ {self.start_time} ถึง {self.end_time}"
+
+
+class HoursResetRun(models.Model):
+    # One row per policy and period, so a reset runs once however many workers try
+    policy = models.CharField(max_length=10, choices=Classroom.RESET_POLICIES)
+    period_start = models.DateField()
+    ran_at = models.DateTimeField(auto_now_add=True)
+    classrooms_reset = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["policy", "period_start"], name="unique_reset_per_period"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_policy_display()} {self.period_start} ({self.classrooms_reset} ห้อง)"
+
+
+class ClassroomDailyUsage(models.Model):
+    # Booked hours per classroom per local day, kept up to date by main.rollups
+    classroom = models.ForeignKey(
+        Classroom, on_delete=models.CASCADE, related_name="daily_usage"
+    )
+    day = models.DateField()
+    booked_hours = models.FloatField(default=0)
+    # Bookings starting on this day
+    bookings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["classroom", "day"], name="unique_classroom_day_usage"
+            ),
+        ]
+        indexes = [models.Index(fields=["day"], name="classroom_usage_day_idx")]
+
+    def __str__(self):
+        return f"{self.classroom_id} {self.day}: {self.booked_hours:.2f} ชม."
+
+
+class UserWeeklyUsage(models.Model):
+    # Booked hours per user per week (starting Monday), kept up to date by main.rollups
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="weekly_usage"
+    )
+    week = models.DateField()
+    booked_hours = models.FloatField(default=0)
+    # Bookings starting in this week
+    bookings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "week"], name="unique_user_week_usage"
+            ),
+        ]
+        indexes = [models.Index(fields=["week"], name="user_usage_week_idx")]
+
+    def __str__(self):
+        return f"{self.user_id} {self.week}: {self.booked_hours:.2f} ชม."
+
+
+class QueuedTask(models.Model):
+    # A background task waiting for manage.py run_worker (TASKS_BACKEND=database)
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUSES = [
+        (QUEUED, "รอดำเนินการ"),
+        (RUNNING, "กำลังดำเนินการ"),
+        (FAILED, "ล้มเหลว"),
+    ]
+
+    # Dotted path of the main.tasks.Task
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # At most one queued task per key, enqueueing another one is a no-op
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # Which worker claimed it and when, a stale claim is taken over
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedup_key"],
+                condition=Q(status="queued"),
+                name="unique_queued_task_dedup_key",
+            ),
+        ]
+        indexes = [models.Index(fields=["status", "run_after"], name="task_due_idx")]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()}, ครั้งที่ {self.attempts})"
+
+
+class AvailabilityStamp(models.Model):
+    # A single row bumped after every classroom or booking write. The ETag and
+    # Last-Modified of the availability pages come from it rather than from
+    # the cache, which may be local to each process (see main.availability)
+    version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.version} ({self.changed_at})"
@@ -0,0 +1,169 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection, send_mail, send_mass_mail
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Booking
+from .tasks import task
+
+CREATED = "created"
+UPDATED = "updated"
+CANCELLED = "cancelled"
+REMINDER = "reminder"
+
+SUBJECTS = {
+    CREATED: "ยืนยันการจองห้องเรียน {classroom}",
+    UPDATED: "การจองห้องเรียน {classroom} ถูกแก้ไข",
+    CANCELLED: "การจองห้องเรียน {classroom} ถูกยกเลิก",
+    REMINDER: "เตือนความจำ: ห้องเรียน {classroom} เวลา {start}",
+}
+
+INTROS = {
+    CREATED: "การจองห้องเรียนของคุณเสร็จสมบูรณ์แล้ว",
+    UPDATED: "การจองห้องเรียนของคุณถูกแก้ไขเป็น",
+    CANCELLED: "การจองห้องเรียนต่อไปนี้ถูกยกเลิกแล้ว",
+    REMINDER: "การจองห้องเรียนของคุณกำลังจะเริ่มในอีกไม่นาน",
+}
+
+CANCEL_HINT = "หากไม่ใช้ห้องแล้ว กรุณายกเลิกการจองเพื่อให้ผู้อื่นใช้ห้องได้"
+
+TIME_FORMAT = "%d/%m/%Y %H:%M"
+
+
+def details(booking):
+    # What a message says about a booking, JSON-friendly so tasks can carry it
+    return {
+        "username": booking.user.username,
+        "classroom": booking.classroom.name,
+        "room_number": booking.classroom.room_number,
+        "start": timezone.localtime(booking.start_time).strftime(TIME_FORMAT),
+        "end": timezone.localtime(booking.end_time).strftime(TIME_FORMAT),
+    }
+
+
+def message(kind, details):
+    # (subject, body) for one booking
+    lines = [
+        f"สวัสดีคุณ {details['username']}",
+        "",
+        INTROS[kind],
+        f"ห้องเรียน: {details['classroom']} (ห้อง {details['room_number']})",
+        f"เวลา: {details['start']} - {details['end']}",
+    ]
+    if kind != CANCELLED:
+        lines += ["", CANCEL_HINT]
+    return SUBJECTS[kind].format(**details), "\n".join(lines)
+
+
+@task
+def send_booking_mail(kind, to, details):
+    subject, body = message(kind, details)
+    send_mail(subject, body, None, [to])
+
+
+def booking_changed(kind, booking):
+    """
+    Mail the booking's owner that it was created, updated or cancelled.
+
+    Sent by a background task once the transaction commits; the details are
+    taken now, a cancelled booking is gone by then.
+    """
+    if not settings.BOOKING_NOTIFICATIONS or not booking.user.email:
+        return
+    send_booking_mail.enqueue(kind, booking.user.email, details(booking))
+
+
+@task
+def send_bookings_mail(to, username, bookings):
+    # One confirmation for a batch of bookings, ``bookings`` are details() dicts
+    lines = [
+        f"สวัสดีคุณ {username}",
+        "",
+        f"การจองห้องเรียน {len(bookings)} รายการของคุณเสร็จสมบูรณ์แล้ว",
+    ]
+    lines += [
+        f"- {b['classroom']} (ห้อง {b['room_number']}) {b['start']} - {b['end']}"
+        for b in bookings
+    ]
+    lines += ["", CANCEL_HINT]
+    subject = f"ยืนยันการจองห้องเรียน {len(bookings)} รายการ"
+    send_mail(subject, "\n".join(lines), None, [to])
+
+
+def bookings_created(user, bookings):
+    # Mail one confirmation for bookings made together (main.bulk)
+    if not settings.BOOKING_NOTIFICATIONS or not user.email or not bookings:
+        return
+    if len(bookings) == 1:
+        booking_changed(CREATED, bookings[0])
+        return
+    send_bookings_mail.enqueue(
+        user.email, user.username, [details(booking) for booking in bookings]
+    )
+
+
+def due_reminders(now, minutes):
+    # Bookings starting within the next ``minutes`` not reminded yet,
+    # a range scan of booking_reminder_due_idx
+    return Booking.objects.filter(
+        reminder_sent_at__isnull=True,
+        start_time__gt=now,
+        start_time__lte=now + timedelta(minutes=minutes),
+    )
+
+
+def _due_batch(now, minutes, batch_size):
+    # Lock a batch of due bookings, a second scheduler skips them (or waits,
+    # where rows can't be skipped) until this transaction ends
+    due = (
+        due_reminders(now, minutes)
+        .select_related("classroom", "user")
+        .order_by("start_time", "pk")
+    )
+    if connection.features.has_select_for_update_skip_locked:
+        due = due.select_for_update(skip_locked=True, of=("self",))
+    return list(due[:batch_size])
+
+
+def send_reminders(now=None, minutes=None, batch_size=500):
+    """
+    Mail a reminder for every booking starting within ``minutes``
+    (default BOOKING_REMINDER_MINUTES) that hasn't had one.
+
+    Each batch of due bookings is read with one query, sent over one mail
+    connection shared by all batches and marked as reminded in the same
+    transaction, only once the mails went out. If sending fails or the
+    process dies, nothing is marked and the next run sends them. Returns the
+    number of reminders sent.
+    """
+    now = now or timezone.now()
+    minutes = settings.BOOKING_REMINDER_MINUTES if minutes is None else minutes
+
+    sent = 0
+    mail = get_connection()
+    try:
+        while True:
+            with transaction.atomic():
+                bookings = _due_batch(now, minutes, batch_size)
+                if not bookings:
+                    break
+                # Users without an address are marked too, nothing to send them
+                messages = [
+                    (*message(REMINDER, details(b)), None, [b.user.email])
+                    for b in bookings
+                    if b.user.email
+                ]
+                if messages:
+                    # Connects on the first batch, later ones reuse the connection
+                    mail.open()
+                    sent += send_mass_mail(messages, connection=mail)
+                Booking.objects.filter(pk__in=[b.pk for b in bookings]).update(
+                    reminder_sent_at=now
+                )
+            if len(bookings) < batch_size:
+                break
+    finally:
+        mail.close()
+    return sent
@@ -0,0 +1,173 @@
+from django.db.migrations.operations.base import Operation
+
+# Name shared by the PostgreSQL exclusion constraint and the SQLite triggers,
+# so an IntegrityError can be recognised no matter which backend raised it.
+OVERLAP_CONSTRAINT = "main_booking_no_overlap"
+
+POSTGRES_INSTALL = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conname = '{OVERLAP_CONSTRAINT}'
+        ) THEN
+            ALTER TABLE main_booking ADD CONSTRAINT {OVERLAP_CONSTRAINT}
+            EXCLUDE USING gist (
+                classroom_id WITH =,
+                tstzrange(start_time, end_time, '[)') WITH &&
+            );
+        END IF;
+    END
+    $$
+    """,
+]
+
+POSTGRES_UNINSTALL = [
+    f"ALTER TABLE main_booking DROP CONSTRAINT IF EXISTS {OVERLAP_CONSTRAINT}",
+]
+
+# SQLite has no exclusion constraints, so the same rule is enforced with
+# triggers. Datetimes are stored as UTC ISO strings and compare correctly as text.
+SQLITE_INSTALL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {OVERLAP_CONSTRAINT}_insert
+    BEFORE INSERT ON main_booking
+    FOR EACH ROW WHEN EXISTS (
+        SELECT 1 FROM main_booking
+        WHERE classroom_id = NEW.classroom_id
+        AND start_time < NEW.end_time
+        AND end_time > NEW.start_time
+    )
+    BEGIN
+        SELECT RAISE(ABORT, '{OVERLAP_CONSTRAINT}');
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {OVERLAP_CONSTRAINT}_update
+    BEFORE UPDATE OF classroom_id, start_time, end_time ON main_booking
+    FOR EACH ROW WHEN EXISTS (
+        SELECT 1 FROM main_booking
+        WHERE classroom_id = NEW.classroom_id
+        AND start_time < NEW.end_time
+        AND end_time > NEW.start_time
+        AND id <> NEW.id
+    )
+    BEGIN
+        SELECT RAISE(ABORT, '{OVERLAP_CONSTRAINT}');
+    END
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {OVERLAP_CONSTRAINT}_insert",
+    f"DROP TRIGGER IF EXISTS {OVERLAP_CONSTRAINT}_update",
+]
+
+
+class InstallOverlapGuard(Operation):
+    """
+    Enforce "no overlapping bookings per classroom" inside the database.
+
+    PostgreSQL gets a GiST exclusion constraint over tstzrange, SQLite gets
+    BEFORE INSERT/UPDATE triggers. Other backends keep the application checks only.
+    The statements are idempotent, so migrations that rebuild main_booking on
+    SQLite (which drops its triggers) can simply run this operation again.
+    """
+
+    reduces_to_sql = True
+    reversible = True
+
+    def state_forwards(self, app_label, state):
+        # Nothing to change in the model state, this lives purely in the database
+        pass
+
+    def _run(self, schema_editor, statements):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._run(
+            schema_editor,
+            {"postgresql": POSTGRES_INSTALL, "sqlite": SQLITE_INSTALL},
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._run(
+            schema_editor,
+            {"postgresql": POSTGRES_UNINSTALL, "sqlite": SQLITE_UNINSTALL},
+        )
+
+    def describe(self):
+        return "Install database-level guard against overlapping bookings"
+
+    @property
+    def migration_name_fragment(self):
+        return "booking_overlap_guard"
+
+
+def is_overlap_violation(error):
+    # Both the exclusion constraint and the triggers report OVERLAP_CONSTRAINT
+    return OVERLAP_CONSTRAINT in str(error)
+
+
+ARCHIVE_TABLE = "main_bookingarchive"
+
+# PostgreSQL can't turn an existing table into a partitioned one, so the fresh
+# (still empty) table is swapped for a partitioned copy. The primary key of a
+# partitioned table has to include the partition key.
+POSTGRES_PARTITION_ARCHIVE = [
+    f"ALTER TABLE {ARCHIVE_TABLE} RENAME TO {ARCHIVE_TABLE}_plain",
+    f"""
+    CREATE TABLE {ARCHIVE_TABLE} (LIKE {ARCHIVE_TABLE}_plain INCLUDING DEFAULTS)
+    PARTITION BY RANGE (start_time)
+    """,
+    # Frees the index names for the partitioned table
+    f"DROP TABLE {ARCHIVE_TABLE}_plain",
+    f"ALTER TABLE {ARCHIVE_TABLE} ADD PRIMARY KEY (id, start_time)",
+    f"""
+    ALTER TABLE {ARCHIVE_TABLE} ADD CONSTRAINT {ARCHIVE_TABLE}_classroom_fk
+    FOREIGN KEY (classroom_id) REFERENCES main_classroom (id)
+    DEFERRABLE INITIALLY DEFERRED
+    """,
+    f"""
+    ALTER TABLE {ARCHIVE_TABLE} ADD CONSTRAINT {ARCHIVE_TABLE}_user_fk
+    FOREIGN KEY (user_id) REFERENCES auth_user (id)
+    DEFERRABLE INITIALLY DEFERRED
+    """,
+    f"CREATE INDEX archive_start_idx ON {ARCHIVE_TABLE} (start_time, id)",
+    f"CREATE INDEX archive_room_start_idx ON {ARCHIVE_TABLE} (classroom_id, start_time)",
+    f"CREATE INDEX archive_user_start_idx ON {ARCHIVE_TABLE} (user_id, start_time)",
+]
+
+
+class PartitionBookingArchive(Operation):
+    """
+    Range-partition the booking archive on start_time, on PostgreSQL only.
+
+    Must run right after the archive table is created, while it is empty.
+    Partitions (one per year) are added by main.archive as bookings are moved.
+    Other backends keep the plain table. Reversing is left to the DeleteModel,
+    dropping the parent table drops its partitions too.
+    """
+
+    reduces_to_sql = True
+    reversible = True
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            for sql in POSTGRES_PARTITION_ARCHIVE:
+                schema_editor.execute(sql)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def describe(self):
+        return "Partition the booking archive by start_time (PostgreSQL)"
+
+    @property
+    def migration_name_fragment(self):
+        return "partition_booking_archive"
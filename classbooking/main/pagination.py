@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Q
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(start_time, pk):
+    # "<microseconds since epoch>-<id>", exact and safe to put in a URL
+    micros = (start_time - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}-{pk}"
+
+
+def decode_cursor(cursor):
+    # Returns (start_time, pk) or None when the cursor is missing or malformed
+    try:
+        micros, pk = cursor.split("-", 1)
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def keyset_page(bookings, cursor=None, page_size=50):
+    """
+    Return one page of bookings ordered by (start_time, id) and the cursor of the next page.
+
+    Rows are located by seeking past the last (start_time, id) of the previous
+    page instead of using OFFSET, so every page costs the same however deep it is.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        start_time, pk = position
+        bookings = bookings.filter(
+            Q(start_time__gt=start_time) | Q(start_time=start_time, pk__gt=pk)
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    rows = list(bookings.order_by("start_time", "pk")[: page_size + 1])
+    page, extra = rows[:page_size], rows[page_size:]
+
+    next_cursor = None
+    if extra:
+        last = page[-1]
+        next_cursor = encode_cursor(last.start_time, last.pk)
+    return page, next_cursor
@@ -0,0 +1,232 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import (
+    Case,
+    CharField,
+    Count,
+    DurationField,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import ledger, rollups
+from .models import Booking, Classroom
+
+STAFF = "staff"
+DEFAULT = "default"
+
+# Limits a group can set in settings.BOOKING_POLICIES, None means unlimited
+LIMITS = ("max_duration_hours", "max_bookings_per_room", "max_weekly_hours")
+
+
+def _configured_groups():
+    # Group names from BOOKING_POLICIES in priority order
+    return [name for name in settings.BOOKING_POLICIES if name not in (STAFF, DEFAULT)]
+
+
+def limits_for(name):
+    policy = settings.BOOKING_POLICIES.get(name) or {}
+    return {limit: policy.get(limit) for limit in LIMITS}
+
+
+def _group(user):
+    # Name of the first configured group the user is in, as a subquery
+    names = _configured_groups()
+    if not names:
+        return Value(None, output_field=CharField())
+    memberships = (
+        User.groups.through.objects.filter(user_id=user.pk, group__name__in=names)
+        .annotate(
+            rank=Case(
+                *[
+                    When(group__name=name, then=Value(n))
+                    for n, name in enumerate(names)
+                ],
+                output_field=IntegerField(),
+            )
+        )
+        .order_by("rank")
+        .values("group__name")[:1]
+    )
+    return Subquery(memberships)
+
+
+def _count(bookings):
+    counted = bookings.order_by().values("user").annotate(n=Count("pk")).values("n")
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def _booked_time(bookings):
+    booked = (
+        bookings.order_by()
+        .values("user")
+        .annotate(total=Sum(F("end_time") - F("start_time")))
+        .values("total")
+    )
+    return Coalesce(Subquery(booked, output_field=DurationField()), Value(timedelta(0)))
+
+
+def week_bounds(start):
+    # Aware [monday, next monday) around start, weeks as in main.rollups
+    tz = timezone.get_current_timezone()
+    monday = rollups.week_start(timezone.localtime(start, tz).date())
+    begin = timezone.make_aware(datetime.combine(monday, time.min), tz)
+    end = timezone.make_aware(
+        datetime.combine(monday + timedelta(days=7), time.min), tz
+    )
+    return begin, end
+
+
+def gather(classroom, start, end, user, owner, exclude_pk=None):
+    """
+    Read everything the rules need about one booking request in a single query.
+
+    ``user`` is who submits the form (their group picks the limits) and
+    ``owner`` whose quota the booking counts against; they differ when staff
+    edit someone else's booking. ``exclude_pk`` leaves out the booking being
+    edited. Returns a dict.
+    """
+    mine = Booking.objects.filter(user=owner)
+    if exclude_pk is not None:
+        mine = mine.exclude(pk=exclude_pk)
+    week_from, week_to = week_bounds(start)
+
+    facts = {
+        # Re-read instead of trusting the instance the form field loaded
+        "hours_left": F("hours_left"),
+        "overlaps": Exists(
+            Booking.objects.overlapping(OuterRef("pk"), start, end, exclude_pk)
+        ),
+        "room_bookings": _count(mine.filter(classroom=OuterRef("pk"))),
+        # Bookings starting in the same week, served by booking_user_start_idx
+        "week_time": _booked_time(
+            mine.filter(start_time__gte=week_from, start_time__lt=week_to)
+        ),
+        "group": (
+            _group(user)
+            if user and not user.is_staff
+            else Value(None, output_field=CharField())
+        ),
+    }
+    row = (
+        Classroom.objects.filter(pk=classroom.pk)
+        .annotate(**{f"fact_{name}": value for name, value in facts.items()})
+        .values(*[f"fact_{name}" for name in facts])
+        .get()
+    )
+    facts = {name: row[f"fact_{name}"] for name in facts}
+    facts["week_hours"] = facts.pop("week_time").total_seconds() / 3600.0
+    return facts
+
+
+def policy_name(user, facts):
+    # Staff, then the first configured group of the user, then "default"
+    if user is None:
+        return None
+    if user.is_staff:
+        return STAFF
+    return facts["group"] or DEFAULT
+
+
+# --- Rules ---
+# Each rule gets (booking, facts, limits) and returns an error message or None.
+# booking holds classroom, start, end and hours; facts come from gather().
+# A new rule reads what it needs from facts, so adding one to gather()
+# adds a column to the same query rather than another round trip.
+
+
+def within_hours_left(booking, facts, limits):
+    if booking["hours"] > facts["hours_left"]:
+        return (
+            f"ห้องเรียนนี้เหลือเวลาอีกเพียง {facts['hours_left']:.2f} ชั่วโมงเท่านั้น"
+        )
+
+
+def no_overlap(booking, facts, limits):
+    if facts["overlaps"]:
+        return (
+            f"ห้องเรียน {booking['classroom'].name} ถูกจองแล้วในช่วงเวลาที่เลือกไปแล้ว"
+        )
+
+
+def max_duration(booking, facts, limits):
+    allowed = limits["max_duration_hours"]
+    if allowed is not None and booking["hours"] > allowed:
+        return f"คุณไม่สามารถจองห้องเรียนได้นานกว่า {allowed:g} ชั่วโมงต่อครั้ง"
+
+
+def per_room_quota(booking, facts, limits):
+    allowed = limits["max_bookings_per_room"]
+    if allowed is None or facts["room_bookings"] < allowed:
+        return None
+    if allowed == 1:
+        return "คุณได้จองห้องเรียนนี้แล้ว ผู้ใช้ทั่วไปสามารถจองห้องเรียนแต่ละห้องได้เพียงครั้งเดียวเท่านั้น"
+    return f"คุณได้จองห้องเรียนนี้ครบ {allowed} ครั้งแล้ว"
+
+
+def weekly_cap(booking, facts, limits):
+    allowed = limits["max_weekly_hours"]
+    if allowed is not None and facts["week_hours"] + booking["hours"] > allowed:
+        left = max(allowed - facts["week_hours"], 0)
+        return (
+            f"คุณจองห้องเรียนได้ไม่เกิน {allowed:g} ชั่วโมงต่อสัปดาห์ "
+            f"(สัปดาห์นี้เหลืออีก {left:.2f} ชั่วโมง)"
+        )
+
+
+# Checked in this order, the first failure is reported
+RULES = [within_hours_left, no_overlap, max_duration, per_room_quota, weekly_cap]
+
+
+def has_limits(user):
+    # Whether checking ``user``'s bookings can find anything beyond the room rules
+    if user.is_staff:
+        return any(value is not None for value in limits_for(STAFF).values())
+    return True
+
+
+def _add_pending(facts, classroom, start, pending):
+    # Count bookings accepted earlier in the same batch but not saved yet
+    week_from, week_to = week_bounds(start)
+    for classroom_id, other_start, other_end in pending:
+        if classroom_id == classroom.pk:
+            facts["room_bookings"] += 1
+        if week_from <= other_start < week_to:
+            facts["week_hours"] += ledger.booked_hours(other_start, other_end)
+
+
+def check(classroom, start, end, user, owner=None, exclude_pk=None, pending=()):
+    """
+    Run every rule against one booking request, returning the first error or None.
+
+    ``start`` and ``end`` must be aware and end after start. ``pending`` lists
+    (classroom_id, start, end) of the owner's bookings accepted earlier in the
+    same batch (see main.bulk), which count towards the quotas. Costs one query
+    however many rules there are.
+    """
+    facts = gather(classroom, start, end, user, owner or user, exclude_pk)
+    _add_pending(facts, classroom, start, pending)
+    name = policy_name(user, facts)
+    # Without a user (no one to hold to a quota) only the room rules apply
+    limits = limits_for(name) if name else dict.fromkeys(LIMITS)
+    booking = {
+        "classroom": classroom,
+        "start": start,
+        "end": end,
+        "hours": ledger.booked_hours(start, end),
+    }
+    for rule in RULES:
+        error = rule(booking, facts, limits)
+        if error:
+            return error
+    return None
@@ -0,0 +1,97 @@
+import logging
+
+from django.db.models import Case, F, Q, Value, When
+
+from . import availability
+from .models import Classroom
+
+logger = logging.getLogger(__name__)
+
+# Differences below this many hours are float noise, not drift
+TOLERANCE = 1e-6
+
+
+def find_drift(classroom_ids=None):
+    """
+    Compare the stored hours_left of every room with the value derived from its bookings.
+
+    One grouped query covers all classrooms (or just ``classroom_ids``).
+    Returns a list of dicts for the rooms that drifted.
+    """
+    rooms = Classroom.objects.with_booked_time().order_by("pk")
+    if classroom_ids is not None:
+        rooms = rooms.filter(pk__in=classroom_ids)
+
+    drifted = []
+    for room in rooms.only("room_number", "total_hours", "hours_left", "is_available"):
+        expected = room.live_hours_left
+        if abs(room.hours_left - expected) > TOLERANCE or room.is_available != (
+            expected > 0
+        ):
+            drifted.append(
+                {
+                    "id": room.pk,
+                    "room_number": room.room_number,
+                    "recorded": room.hours_left,
+                    "expected": expected,
+                    "drift": room.hours_left - expected,
+                }
+            )
+    return drifted
+
+
+def correct(drifted):
+    """
+    Write the expected values for drifted rooms in a single UPDATE.
+
+    Each row only changes if hours_left still holds the value that was read,
+    so a booking made while reconciling is never overwritten. Returns the number
+    of rows fixed; the rest will be picked up by the next run.
+    """
+    if not drifted:
+        return 0
+
+    matches = [Q(pk=room["id"], hours_left=room["recorded"]) for room in drifted]
+    fixed = Classroom.objects.filter(pk__in=[room["id"] for room in drifted]).update(
+        hours_left=Case(
+            *[
+                When(match, then=Value(room["expected"]))
+                for match, room in zip(matches, drifted)
+            ],
+            default=F("hours_left"),
+        ),
+        is_available=Case(
+            *[
+                When(match, then=Value(room["expected"] > 0))
+                for match, room in zip(matches, drifted)
+            ],
+            default=F("is_available"),
+        ),
+    )
+    if fixed:
+        availability.invalidate()
+    return fixed
+
+
+def reconcile(classroom_ids=None, dry_run=False):
+    """
+    Find and (unless ``dry_run``) fix hours_left drift, returning drift metrics.
+    """
+    drifted = find_drift(classroom_ids)
+    fixed = 0 if dry_run else correct(drifted)
+
+    metrics = {
+        "drifted": len(drifted),
+        "fixed": fixed,
+        "total_drift_hours": sum(abs(room["drift"]) for room in drifted),
+        "max_drift_hours": max((abs(room["drift"]) for room in drifted), default=0),
+        "rooms": drifted,
+    }
+    if drifted:
+        logger.warning(
+            "hours_left drift in %d classrooms (%.2f hours total), %d fixed",
+            metrics["drifted"],
+            metrics["total_drift_hours"],
+            fixed,
+        )
+    return metrics
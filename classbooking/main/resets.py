@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+from . import availability
+from .models import Booking, Classroom, HoursResetRun
+
+POLICIES = [Classroom.RESET_DAILY, Classroom.RESET_WEEKLY]
+
+
+def period_start(policy, now=None):
+    # First day of the period that ``now`` falls in, in local time
+    today = timezone.localdate(now)
+    if policy == Classroom.RESET_WEEKLY:
+        return today - timedelta(days=today.weekday())
+    return today
+
+
+def _held_hours(policy, now):
+    # {classroom_id: hours} of bookings starting from ``now`` on, they keep
+    # counting against hours_left after the reset (see with_booked_time)
+    held = (
+        Booking.objects.filter(classroom__reset_policy=policy, start_time__gte=now)
+        .order_by()
+        .values("classroom")
+        .annotate(total=Sum(F("end_time") - F("start_time")))
+        .values_list("classroom", "total")
+    )
+    return {
+        classroom_id: total.total_seconds() / 3600.0 for classroom_id, total in held
+    }
+
+
+def reset_policy(policy, now=None, force=False):
+    """
+    Reset hours_left of every room on ``policy`` for the current period.
+
+    Rooms get total_hours back minus the hours of bookings that haven't
+    started yet, which still count against the new period. The run is
+    recorded in HoursResetRun in the same transaction as a single set-based
+    UPDATE, so concurrent workers reset each period exactly once. Returns the
+    number of rooms reset, or None when the period was already done.
+    """
+    now = now or timezone.now()
+    start = period_start(policy, now)
+    rooms = Classroom.objects.filter(reset_policy=policy)
+
+    try:
+        with transaction.atomic():
+            if force:
+                HoursResetRun.objects.filter(policy=policy, period_start=start).delete()
+            run = HoursResetRun.objects.create(policy=policy, period_start=start)
+            # Bookings made meanwhile wait for their classroom UPDATE until we
+            # commit, and then deduct from the reset value
+            list(rooms.select_for_update().values_list("pk", flat=True))
+            held = _held_hours(policy, now)
+            held_hours = Case(
+                *[When(pk=pk, then=Value(hours)) for pk, hours in held.items()],
+                default=Value(0.0),
+            )
+            count = rooms.update(
+                hours_left=Greatest(F("total_hours") - held_hours, Value(0.0)),
+                is_available=Case(
+                    When(GreaterThan(F("total_hours"), held_hours), then=Value(True)),
+                    default=Value(False),
+                ),
+                hours_reset_at=now,
+            )
+            run.classrooms_reset = count
+            run.save(update_fields=["classrooms_reset"])
+    except IntegrityError:
+        # Another worker already holds this period
+        return None
+
+    if count:
+        availability.invalidate()
+    return count
+
+
+def reset_due(policies=POLICIES, now=None, force=False):
+    # Run every policy, {policy: rooms reset or None if already done}
+    return {policy: reset_policy(policy, now, force) for policy in policies}
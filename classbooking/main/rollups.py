@@ -0,0 +1,241 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Booking, BookingArchive, ClassroomDailyUsage, UserWeeklyUsage
+from .tasks import task
+
+ROOM = "classroom"
+USER = "user"
+
+
+def week_start(day):
+    # Weeks start on Monday
+    return day - timedelta(days=day.weekday())
+
+
+def _midnight_after(local):
+    next_day = local.date() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(next_day, time.min), local.tzinfo)
+
+
+def split_by_day(start, end):
+    """
+    Yield (local day, hours) for the part of [start, end) falling on each day.
+
+    Days are in the project timezone (TIME_ZONE), so a booking running past
+    midnight counts towards both days.
+    """
+    tz = timezone.get_default_timezone()
+    current, end = timezone.localtime(start, tz), timezone.localtime(end, tz)
+    while current < end:
+        boundary = min(_midnight_after(current), end)
+        yield current.date(), (boundary - current).total_seconds() / 3600.0
+        current = boundary
+
+
+def deltas(classroom_id, user_id, start, end, sign=1):
+    """
+    Usage changes caused by adding (sign=1) or removing (sign=-1) one booking.
+
+    Returns {(ROOM, classroom_id, day) or (USER, user_id, week): [hours, bookings]}.
+    The booking itself counts towards the day (and week) it starts on.
+    """
+    changes = defaultdict(lambda: [0.0, 0])
+    for index, (day, hours) in enumerate(split_by_day(start, end)):
+        count = sign if index == 0 else 0
+        for key in ((ROOM, classroom_id, day), (USER, user_id, week_start(day))):
+            changes[key][0] += sign * hours
+            changes[key][1] += count
+    return changes
+
+
+def merge(into, changes):
+    # Add one deltas() result to another, in place
+    for key, (hours, count) in changes.items():
+        into[key][0] += hours
+        into[key][1] += count
+    return into
+
+
+def _model_and_filter(key):
+    kind, owner_id, period = key
+    if kind == ROOM:
+        return ClassroomDailyUsage, {"classroom_id": owner_id, "day": period}
+    return UserWeeklyUsage, {"user_id": owner_id, "week": period}
+
+
+def apply(changes):
+    """
+    Write usage changes, one UPDATE per (classroom, day) and (user, week).
+
+    Rows are incremented in the database so concurrent bookings add up. A
+    missing row is inserted, and if another transaction inserted it first
+    the increment is retried. Removals from a missing row are dropped, it was
+    deleted along with its classroom or user (a cascade deletes the rollups
+    before the bookings).
+    """
+    for key, (hours, count) in changes.items():
+        if not hours and not count:
+            continue
+        model, lookup = _model_and_filter(key)
+        increment = {
+            "booked_hours": F("booked_hours") + hours,
+            "bookings": F("bookings") + count,
+        }
+        if model.objects.filter(**lookup).update(**increment):
+            continue
+        if hours <= 0 and count <= 0:
+            # Nothing to take away from, the row went with its classroom or user
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(**lookup, booked_hours=hours, bookings=count)
+        except IntegrityError:
+            model.objects.filter(**lookup).update(**increment)
+
+
+def encode(changes):
+    # deltas() changes as JSON-friendly rows, for apply_later
+    return [
+        [kind, owner_id, period.isoformat(), hours, count]
+        for (kind, owner_id, period), (hours, count) in changes.items()
+        if hours or count
+    ]
+
+
+def decode(rows):
+    return {
+        (kind, owner_id, date.fromisoformat(period)): [hours, count]
+        for kind, owner_id, period, hours, count in rows
+    }
+
+
+@task(atomic=True, durable=True)
+def apply_encoded(rows):
+    # All rows or none, so a retried run can't count anything twice
+    apply(decode(rows))
+
+
+def apply_later(changes):
+    """
+    Write usage changes in the background, see main.tasks.
+
+    The rollups only feed reports, so a booking request need not wait for
+    them. Nothing is enqueued when nothing changed.
+    """
+    rows = encode(changes)
+    if rows:
+        apply_encoded.enqueue(rows)
+
+
+def collect(rows):
+    # Totals for (classroom_id, user_id, start_time, end_time) rows, see deltas()
+    totals = defaultdict(lambda: [0.0, 0])
+    for classroom_id, user_id, start, end in rows:
+        merge(totals, deltas(classroom_id, user_id, start, end))
+    return totals
+
+
+def _totals_to_rows(totals, room_model, user_model):
+    rooms, users = [], []
+    for (kind, owner_id, period), (hours, count) in totals.items():
+        if kind == ROOM:
+            rooms.append(
+                room_model(
+                    classroom_id=owner_id,
+                    day=period,
+                    booked_hours=hours,
+                    bookings=count,
+                )
+            )
+        else:
+            users.append(
+                user_model(
+                    user_id=owner_id, week=period, booked_hours=hours, bookings=count
+                )
+            )
+    return rooms, users
+
+
+def rebuild(
+    batch_size=1000,
+    booking_model=Booking,
+    room_model=None,
+    user_model=None,
+    archive_model=BookingArchive,
+):
+    """
+    Recompute every rollup row from the bookings table.
+
+    Bookings are streamed, and only the totals (days x rooms and weeks x users)
+    are held in memory. Archived bookings count too. Runs in one transaction
+    that keeps bookings from being written meanwhile, readers see the old rows
+    until it commits. The model arguments let the initial data migration pass
+    its historical models.
+    """
+    room_model = room_model or ClassroomDailyUsage
+    user_model = user_model or UserWeeklyUsage
+
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"LOCK TABLE {booking_model._meta.db_table} IN SHARE MODE"
+                )
+        # On SQLite the first write takes the database write lock
+        room_model.objects.all().delete()
+        user_model.objects.all().delete()
+
+        sources = [booking_model] + ([archive_model] if archive_model else [])
+        rows = chain.from_iterable(
+            model.objects.order_by()
+            .values_list("classroom_id", "user_id", "start_time", "end_time")
+            .iterator(chunk_size=batch_size)
+            for model in sources
+        )
+        rooms, users = _totals_to_rows(collect(rows), room_model, user_model)
+        room_model.objects.bulk_create(rooms, batch_size=batch_size)
+        user_model.objects.bulk_create(users, batch_size=batch_size)
+    return {"classroom_days": len(rooms), "user_weeks": len(users)}
+
+
+def classroom_usage(date_from, date_to, classroom=None):
+    # Daily rows for [date_from, date_to], read from the rollup only
+    rows = ClassroomDailyUsage.objects.filter(day__range=(date_from, date_to))
+    if classroom is not None:
+        rows = rows.filter(classroom=classroom)
+    return rows.order_by("day", "classroom_id").values(
+        "classroom_id",
+        "classroom__name",
+        "classroom__room_number",
+        "day",
+        "booked_hours",
+        "bookings",
+    )
+
+
+def classroom_totals(date_from, date_to, classroom=None):
+    # One row per classroom with the hours and bookings summed over the window
+    rows = ClassroomDailyUsage.objects.filter(day__range=(date_from, date_to))
+    if classroom is not None:
+        rows = rows.filter(classroom=classroom)
+    return (
+        rows.values("classroom_id", "classroom__name", "classroom__room_number")
+        .annotate(booked_hours=Sum("booked_hours"), bookings=Sum("bookings"))
+        .order_by("-booked_hours")
+    )
+
+
+def user_usage(date_from, date_to, username=None):
+    # Weekly rows for the weeks overlapping [date_from, date_to]
+    rows = UserWeeklyUsage.objects.filter(week__range=(week_start(date_from), date_to))
+    if username:
+        rows = rows.filter(user__username=username)
+    return rows.order_by("week", "-booked_hours").values(
+        "user_id", "user__username", "week", "booked_hours", "bookings"
+    )
@@ -1,19 +1,24 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Booking, Classroom
+from . import availability, ledger
+from .models import Booking, BookingArchive, Classroom
 
-
-@receiver(post_save, sender=Booking)
-def update_classroom_on_booking(sender, instance, created, **kwargs):
-    # Mark classroom as unavailable when a booking is created or updated.
-    classroom = instance.classroom
-    classroom.is_available = False
-    classroom.save()
+# Booking.save settles hours and availability through the ledger in a single
+# UPDATE, so there is no post_save handler writing the classroom again.
 
 
 @receiver(post_delete, sender=Booking)
+@receiver(post_delete, sender=BookingArchive)
 def update_classroom_on_booking_delete(sender, instance, **kwargs):
-    # Mark classroom as available again when a booking is deleted.
-    classroom = instance.classroom
-    classroom.is_available = True
-    classroom.save()
+    # Give the booking's hours back and take it out of the usage rollups, also
+    # for deletes that bypass the ledger (cascades from a deleted user,
+    # querysets). Inside ledger.deferred() this is coalesced into one update
+    # per classroom.
+    ledger.booking_deleted(instance)
+
+
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def invalidate_availability_on_classroom_change(sender, **kwargs):
+    # Ledger UPDATEs invalidate on their own, this covers saves from forms and the admin
+    availability.invalidate()
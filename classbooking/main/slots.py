@@ -0,0 +1,71 @@
+from itertools import groupby
+
+from django.utils import timezone
+
+from .models import Booking, Classroom
+
+
+def free_intervals(busy, window_start, window_end, min_duration):
+    """
+    Sweep busy spans (sorted by start) and return the gaps inside the window.
+
+    Only gaps of at least ``min_duration`` are kept. Spans may overlap or stick
+    out of the window, the sweep clips them.
+    """
+    free = []
+    cursor = window_start
+    for start, end in busy:
+        if start >= window_end:
+            break
+        if start - cursor >= min_duration:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+    if window_end - cursor >= min_duration:
+        free.append((cursor, window_end))
+    return free
+
+
+def find_free_rooms(window_start, window_end, min_duration, capacity=0):
+    """
+    Free intervals of every bookable classroom that fits ``capacity`` people.
+
+    Two queries whatever the window or the number of rooms: one for the
+    candidate rooms and one for their bookings in the window, ordered by
+    (classroom, start_time) so each room's spans are swept in a single pass.
+    """
+    # Nothing can be booked in the past
+    window_start = max(window_start, timezone.now())
+    if window_end - window_start < min_duration:
+        return []
+
+    needed_hours = min_duration.total_seconds() / 3600.0
+    rooms = Classroom.objects.filter(
+        is_available=True,
+        capacity__gte=capacity,
+        hours_left__gte=needed_hours,
+    )
+
+    busy = (
+        Booking.objects.filter(
+            classroom__in=rooms,
+            start_time__lt=window_end,
+            end_time__gt=window_start,
+        )
+        .order_by("classroom_id", "start_time")
+        .values_list("classroom_id", "start_time", "end_time")
+    )
+    busy_by_room = {
+        classroom_id: [(start, end) for _, start, end in spans]
+        for classroom_id, spans in groupby(busy, key=lambda row: row[0])
+    }
+
+    results = []
+    for room in rooms.order_by("room_number").values(
+        "id", "name", "room_number", "capacity", "hours_left"
+    ):
+        free = free_intervals(
+            busy_by_room.get(room["id"], []), window_start, window_end, min_duration
+        )
+        if free:
+            results.append({**room, "free": free})
+    return results
@@ -0,0 +1,273 @@
+import logging
+import threading
+import time
+import traceback
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    close_old_connections,
+    connection,
+    connections,
+    transaction,
+)
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import QueuedTask
+
+logger = logging.getLogger(__name__)
+
+# Created on first use, so processes that never enqueue start no threads
+_executor = None
+
+# Dedup keys submitted to the thread pool and not finished yet
+_pending_keys = set()
+_pending_lock = threading.Lock()
+
+
+class Task:
+    """
+    A function that can run in the background, made with the @task decorator.
+
+    Call it to run it right away, or enqueue() it. Arguments must be
+    JSON-serialisable (ids, not model instances): the task may run in another
+    thread or process, and must look its data up again. Failed runs are
+    retried up to ``max_attempts`` times with a growing delay, so tasks
+    should be safe to run again, or ``atomic`` so a failed run leaves nothing
+    behind (with the database backend an atomic task also runs exactly once,
+    its queue row is deleted in the same transaction).
+
+    ``durable`` tasks are always stored in the database queue (unless the
+    backend is "immediate"), for work that must not be lost with the web
+    process, whatever TASKS_BACKEND says for the rest.
+
+    using() returns a copy with per-call options, like Django 6's tasks:
+    ``dedup_key`` drops the enqueue while a task with the same key is still
+    waiting, ``run_after`` delays it.
+    """
+
+    def __init__(
+        self,
+        func,
+        max_attempts=3,
+        atomic=False,
+        durable=False,
+        dedup_key=None,
+        run_after=None,
+    ):
+        self.func = func
+        # Dotted path the task is found by again, see execute()
+        self.name = f"{func.__module__}.{func.__name__}"
+        self.max_attempts = max_attempts
+        self.atomic = atomic
+        self.durable = durable
+        self.dedup_key = dedup_key
+        self.run_after = run_after
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def using(self, dedup_key=None, run_after=None):
+        return Task(
+            self.func,
+            max_attempts=self.max_attempts,
+            atomic=self.atomic,
+            durable=self.durable,
+            dedup_key=dedup_key or self.dedup_key,
+            run_after=run_after or self.run_after,
+        )
+
+    def enqueue(self, *args, **kwargs):
+        backend = settings.TASKS_BACKEND
+        if backend == "immediate":
+            # Inline, in the caller's transaction; for tests and debugging
+            return self.func(*args, **kwargs)
+        if backend == "database" or self.durable:
+            # Stored in the caller's transaction, a rollback drops it too
+            return _store(self, args, kwargs)
+        transaction.on_commit(lambda: _submit(self, args, kwargs))
+
+    def __repr__(self):
+        return f"<Task {self.name}>"
+
+
+def task(func=None, **options):
+    # @task or @task(max_attempts=5, atomic=True, durable=True)
+    if func is None:
+        return lambda func: Task(func, **options)
+    return Task(func, **options)
+
+
+def retry_delay(attempts):
+    # Seconds to wait before the next attempt: base, 2x, 4x, ...
+    return settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def _call(task, args, kwargs):
+    if task.atomic:
+        with transaction.atomic():
+            return task.func(*args, **kwargs)
+    return task.func(*args, **kwargs)
+
+
+# --- In-process thread pool (TASKS_BACKEND=thread) ---
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.TASKS_THREADS, thread_name_prefix="task"
+        )
+    return _executor
+
+
+def _run_in_thread(task, args, kwargs):
+    if task.run_after:
+        # Not worth a scheduler, the thread just waits
+        time.sleep(max((task.run_after - timezone.now()).total_seconds(), 0))
+    close_old_connections()
+    try:
+        for attempt in range(1, task.max_attempts + 1):
+            try:
+                _call(task, args, kwargs)
+                return
+            except Exception:
+                if attempt == task.max_attempts:
+                    logger.exception("Task %s%r failed", task.name, args)
+                    return
+                time.sleep(retry_delay(attempt))
+    finally:
+        with _pending_lock:
+            _pending_keys.discard(task.dedup_key)
+        connections.close_all()
+
+
+def _submit(task, args, kwargs):
+    if task.dedup_key:
+        with _pending_lock:
+            if task.dedup_key in _pending_keys:
+                return
+            _pending_keys.add(task.dedup_key)
+    _get_executor().submit(_run_in_thread, task, args, kwargs)
+
+
+# --- Database queue (TASKS_BACKEND=database, run by manage.py run_worker) ---
+
+
+def _store(task, args, kwargs):
+    try:
+        with transaction.atomic():
+            return QueuedTask.objects.create(
+                name=task.name,
+                args=list(args),
+                kwargs=kwargs,
+                dedup_key=task.dedup_key,
+                max_attempts=task.max_attempts,
+                run_after=task.run_after or timezone.now(),
+            )
+    except IntegrityError:
+        if task.dedup_key is None:
+            raise
+        # The same work is already waiting
+        return None
+
+
+def claim(worker, limit):
+    """
+    Mark up to ``limit`` due tasks as running for ``worker`` and return them.
+
+    Tasks claimed by a worker that has not finished them within
+    TASKS_LEASE_SECONDS are taken over, it probably died.
+    """
+    now = timezone.now()
+    due = Q(status=QueuedTask.QUEUED, run_after__lte=now) | Q(
+        status=QueuedTask.RUNNING,
+        locked_at__lt=now - timedelta(seconds=settings.TASKS_LEASE_SECONDS),
+    )
+    with transaction.atomic():
+        candidates = QueuedTask.objects.filter(due).order_by("run_after", "pk")
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list("pk", flat=True)[:limit])
+        # Re-checking "due" keeps two workers from claiming the same row
+        # where rows can't be locked (SQLite)
+        QueuedTask.objects.filter(due, pk__in=ids).update(
+            status=QueuedTask.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+    return list(QueuedTask.objects.filter(pk__in=ids, locked_by=worker))
+
+
+def execute(queued):
+    """
+    Run one claimed task and delete its row, or schedule the next attempt.
+
+    Returns True when the task succeeded.
+    """
+    close_old_connections()
+    try:
+        task = import_string(queued.name)
+        if task.atomic:
+            with transaction.atomic():
+                task.func(*queued.args, **queued.kwargs)
+                queued.delete()
+        else:
+            task.func(*queued.args, **queued.kwargs)
+            queued.delete()
+        return True
+    except Exception:
+        logger.exception("Task %s%r failed", queued.name, queued.args)
+        queued.last_error = traceback.format_exc()
+        queued.locked_by, queued.locked_at = "", None
+        if queued.attempts >= queued.max_attempts:
+            queued.status = QueuedTask.FAILED
+        else:
+            queued.status = QueuedTask.QUEUED
+            queued.run_after = timezone.now() + timedelta(
+                seconds=retry_delay(queued.attempts)
+            )
+        # A failed task with the same dedup key must not block new ones
+        if queued.status == QueuedTask.FAILED:
+            queued.dedup_key = None
+        try:
+            queued.save()
+        except IntegrityError:
+            # A fresh task with the same key was queued meanwhile, it covers this one
+            queued.delete()
+        return False
+    finally:
+        connections.close_all()
+
+
+def work(threads=None, batch_size=20, once=False, poll=1.0):
+    """
+    Claim and run due tasks on a thread pool until stopped.
+
+    With ``once``, stop as soon as no task is due. Returns (succeeded, failed).
+    """
+    worker = uuid.uuid4().hex
+    succeeded = failed = 0
+    with ThreadPoolExecutor(
+        max_workers=threads or settings.TASKS_THREADS, thread_name_prefix="worker"
+    ) as executor:
+        while True:
+            claimed = claim(worker, batch_size)
+            if not claimed:
+                if once:
+                    break
+                time.sleep(poll)
+                continue
+            for ok in executor.map(execute, claimed):
+                succeeded += ok
+                failed += not ok
+    return succeeded, failed
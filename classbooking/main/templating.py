@@ -0,0 +1,36 @@
+from time import perf_counter
+
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+from . import metrics
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        # Only time renders of requests sampled by RequestMetricsMiddleware
+        current = metrics.current()
+        if current is None:
+            return super().render(context, request)
+
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            current.template_seconds += perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """
+    The stock Django template backend, timing each top-level render.
+    Includes and extends are rendered inside it, so nothing is counted twice.
+    """
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
@@ -1,3 +1,1094 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    archive,
+    availability,
+    benchmark,
+    bulk,
+    export,
+    importer,
+    ledger,
+    metrics,
+    notifications,
+    policies,
+    reconcile,
+    resets,
+    rollups,
+    tasks,
+)
+from .models import (
+    OVERLAP_ERROR,
+    Booking,
+    BookingArchive,
+    Classroom,
+    ClassroomDailyUsage,
+    HoursResetRun,
+    QueuedTask,
+    UserWeeklyUsage,
+)
+from .forms import BookingFilterForm, UsageFilterForm
+from .operations import is_overlap_violation
+from .pagination import keyset_page
+from .slots import find_free_rooms, free_intervals
+
+
+class BookingFixtures:
+    # One student and one 10 hour classroom, booked from tomorrow on
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("student", password="pw")
+        self.classroom = Classroom.objects.create(
+            name="Lab", room_number=101, total_hours=10, capacity=30
+        )
+        self.start = timezone.now() + timedelta(days=1)
+
+    def book(self, hours, offset=0):
+        start = self.start + timedelta(hours=offset)
+        return Booking.objects.create(
+            classroom=self.classroom,
+            user=self.user,
+            start_time=start,
+            end_time=start + timedelta(hours=hours),
+        )
+
+    def rollup_rows(self):
+        rooms = ClassroomDailyUsage.objects.values_list(
+            "classroom_id", "day", "booked_hours", "bookings"
+        )
+        users = UserWeeklyUsage.objects.values_list(
+            "user_id", "week", "booked_hours", "bookings"
+        )
+        # Rows emptied by cancellations are kept, a rebuild drops them
+        return sorted(r for r in rooms if r[3]), sorted(r for r in users if r[3])
+
+
+class BookingLedgerTests(BookingFixtures, TestCase):
+    def test_booking_deducts_hours_with_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.book(2)
+        classroom_updates = [
+            q["sql"]
+            for q in queries.captured_queries
+            if q["sql"].startswith('UPDATE "main_classroom"')
+        ]
+        self.assertEqual(len(classroom_updates), 1)
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 8)
+
+    def test_edit_applies_net_change(self):
+        booking = self.book(2)
+        booking.end_time = booking.start_time + timedelta(hours=3)
+        booking.save()
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 7)
+
+    def test_cancel_restores_hours(self):
+        booking = self.book(4)
+        ledger.cancel_booking(booking)
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 10)
+        self.assertTrue(self.classroom.is_available)
+
+    def test_deferred_updates_each_classroom_once(self):
+        bookings = [self.book(1, offset=n) for n in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            with ledger.deferred():
+                for booking in bookings:
+                    booking.delete()
+        classroom_updates = [
+            q["sql"]
+            for q in queries.captured_queries
+            if q["sql"].startswith('UPDATE "main_classroom"')
+        ]
+        self.assertEqual(len(classroom_updates), 1)
+
+    def test_hours_are_clamped(self):
+        self.book(12)
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 0)
+        self.assertFalse(self.classroom.is_available)
+
+
+class OverlapGuardTests(BookingFixtures, TestCase):
+    def overlapping(self, offset=0.5):
+        start = self.start + timedelta(hours=offset)
+        return Booking(
+            classroom=self.classroom,
+            user=self.user,
+            start_time=start,
+            end_time=start + timedelta(hours=1),
+        )
+
+    def test_database_rejects_bulk_create_and_update(self):
+        self.book(1)
+        with self.assertRaises(IntegrityError) as raised, transaction.atomic():
+            Booking.objects.bulk_create([self.overlapping()])
+        self.assertTrue(is_overlap_violation(raised.exception))
+
+        later = self.book(1, offset=2)
+        with self.assertRaises(IntegrityError) as raised, transaction.atomic():
+            Booking.objects.filter(pk=later.pk).update(start_time=self.start)
+        self.assertTrue(is_overlap_violation(raised.exception))
+
+    def test_save_reports_the_overlap_message(self):
+        self.book(1)
+        # Skips clean(), as if another request had passed the check first
+        with self.assertRaisesMessage(ValidationError, OVERLAP_ERROR):
+            self.overlapping().save()
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_back_to_back_bookings_are_allowed(self):
+        self.book(1)
+        self.book(1, offset=1)
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class BookingListTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Tomorrow morning, so every booking here falls on the same local day
+        self.start = timezone.localtime(self.start).replace(
+            hour=8, minute=0, second=0, microsecond=0
+        )
+        self.other = Classroom.objects.create(
+            name="Hall", room_number=202, total_hours=10, capacity=80
+        )
+        self.bookings = [self.book(1, offset=n * 2) for n in range(4)]
+        # Same start as the first booking, only the id breaks the tie
+        self.bookings.insert(
+            1,
+            Booking.objects.create(
+                classroom=self.other,
+                user=self.user,
+                start_time=self.start,
+                end_time=self.start + timedelta(hours=1),
+            ),
+        )
+
+    def test_cursor_walks_every_booking_once(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(Booking.objects.all(), cursor, page_size=2)
+            seen += [booking.pk for booking in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [booking.pk for booking in self.bookings])
+
+    def test_bad_cursor_starts_from_the_first_page(self):
+        for cursor in ("garbage", "1-x", "99999999999999999999999-1"):
+            page, _ = keyset_page(Booking.objects.all(), cursor, page_size=2)
+            self.assertEqual(page, self.bookings[:2])
+
+    def test_filters(self):
+        day = timezone.localtime(self.start).date()
+        cases = [
+            ({"classroom": self.other.pk}, 1),
+            ({"user": "student"}, 5),
+            ({"user": "nobody"}, 0),
+            ({"date_from": day, "date_to": day}, 5),
+            ({"date_from": day + timedelta(days=1)}, 0),
+        ]
+        for data, expected in cases:
+            form = BookingFilterForm(data)
+            self.assertEqual(form.filter(Booking.objects.all()).count(), expected)
+
+    def test_staff_list_query_count_does_not_grow(self):
+        staff = User.objects.create_user("admin", password="pw", is_staff=True)
+        self.client.force_login(staff)
+
+        def count():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse("booking")).status_code, 200)
+            return len(queries)
+
+        count()  # Loads the session user into the auth cache
+        before = count()
+        for n in range(10):
+            self.book(1, offset=20 + n * 2)
+        count()  # The bookings invalidated the cached classroom choices
+        self.assertEqual(count(), before)
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class BulkBookingTests(BookingFixtures, TestCase):
+    def rows(self, hours, count):
+        return [
+            {
+                "classroom": self.classroom.pk,
+                "start_time": self.start + timedelta(hours=n * 2),
+                "end_time": self.start + timedelta(hours=n * 2 + hours),
+            }
+            for n in range(count)
+        ]
+
+    def statuses(self, report):
+        return [entry["status"] for entry in report]
+
+    def test_student_is_held_to_the_form_limits(self):
+        # The default policy allows one booking per room, one hour at most
+        report = bulk.book_many(self.user, self.rows(1, 3))
+        self.assertEqual(self.statuses(report), ["created", "rejected", "rejected"])
+        report = bulk.book_many(self.user, self.rows(2, 1))
+        self.assertEqual(self.statuses(report), ["rejected"])
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_unreadable_room_is_a_row_error(self):
+        rows = [{**self.rows(1, 1)[0], "classroom": "²"}]
+        rows.append({"room_number": "²", **self.rows(1, 1)[0]})
+        del rows[1]["classroom"]
+        report = bulk.book_many(self.user, rows)
+        self.assertEqual(
+            [entry["error"] for entry in report], ["ไม่พบห้องเรียนที่ระบุ"] * 2
+        )
+
+    def test_bad_recurrence_rules_are_rejected(self):
+        start = self.start.isoformat()
+        end = (self.start + timedelta(hours=1)).isoformat()
+        rules = [
+            "weekly",
+            [{"start_time": start}],
+            # Too long for timedelta
+            {"start_time": start, "end_time": end, "interval": 10**30, "count": 2},
+            # Fits timedelta, but the second booking is past year 9999
+            {"start_time": start, "end_time": end, "interval": 500000, "count": 2},
+        ]
+        for rule in rules:
+            with self.assertRaises(bulk.BulkBookingError):
+                bulk.parse_rows(json.dumps({"recurrence": rule}), "json")
+
+        # The same step is fine when the rule stops before it
+        rule = {"start_time": start, "end_time": end, "interval": 500000, "count": 1}
+        self.assertEqual(len(bulk.expand_recurrence(rule)), 1)
+
+    def test_bad_recurrence_is_a_400(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("booking_bulk"),
+            json.dumps({"recurrence": {"interval": 10**30}}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_books_without_limits_and_gets_one_mail(self):
+        staff = User.objects.create_user(
+            "admin", email="admin@example.com", password="pw", is_staff=True
+        )
+        with CaptureQueriesContext(connection) as queries:
+            report = bulk.book_many(staff, self.rows(2, 3))
+        self.assertEqual(self.statuses(report), ["created"] * 3)
+        # Staff have no limits configured, so no policy query is made
+        self.assertFalse(any("fact_" in q["sql"] for q in queries))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("3 รายการ", mail.outbox[0].subject)
+
+
+class AvailabilitySnapshotTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def hours_left(self, snapshot):
+        return [room["hours_left"] for room in snapshot["rooms"]]
+
+    def test_repeated_reads_hit_the_cache(self):
+        first = availability.snapshot()
+        self.assertEqual(availability.snapshot(), first)
+        stats = availability.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_booking_write_retires_the_snapshot(self):
+        before = availability.snapshot()
+        self.book(2)
+        after = availability.snapshot()
+        self.assertNotEqual(after["version"], before["version"])
+        self.assertEqual(self.hours_left(before), [10])
+        self.assertEqual(self.hours_left(after), [8])
+        self.assertEqual(availability.stats()["misses"], 2)
+
+
+class FreeSlotTests(BookingFixtures, TestCase):
+    def test_sweep_merges_overlapping_and_clips_to_the_window(self):
+        t = self.start
+        hour = timedelta(hours=1)
+        busy = [
+            (t - hour, t + hour),  # sticks out of the window
+            (t + 2 * hour, t + 4 * hour),
+            (t + 3 * hour, t + 5 * hour),  # overlaps the previous span
+            (t + 9 * hour, t + 10 * hour),  # after the window
+        ]
+        self.assertEqual(
+            free_intervals(busy, t, t + 8 * hour, hour),
+            [(t + hour, t + 2 * hour), (t + 5 * hour, t + 8 * hour)],
+        )
+        # Gaps shorter than the duration are dropped
+        self.assertEqual(
+            free_intervals(busy, t, t + 8 * hour, 2 * hour),
+            [(t + 5 * hour, t + 8 * hour)],
+        )
+
+    def test_rooms_are_found_in_two_queries(self):
+        self.book(2)
+        Classroom.objects.create(
+            name="Small", room_number=102, total_hours=10, capacity=5
+        )
+        with self.assertNumQueries(2):
+            rooms = find_free_rooms(
+                self.start, self.start + timedelta(hours=3), timedelta(hours=1), 10
+            )
+        self.assertEqual(
+            [(room["room_number"], room["free"]) for room in rooms],
+            [
+                (
+                    101,
+                    [
+                        (
+                            self.start + timedelta(hours=2),
+                            self.start + timedelta(hours=3),
+                        )
+                    ],
+                )
+            ],
+        )
+
+    def test_absurd_duration_is_rejected(self):
+        self.client.force_login(self.user)
+        day = timezone.localtime(self.start).date()
+        response = self.client.get(
+            reverse("classroom_free"),
+            {
+                "start": day.isoformat(),
+                "end": (day + timedelta(days=1)).isoformat(),
+                "duration": "99999999999999",
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class ConditionalGetTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def get(self, etag=None):
+        headers = {"if_none_match": etag} if etag else {}
+        return self.client.get(reverse("classroom"), headers=headers)
+
+    def test_not_modified_until_a_booking_is_written(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        # Validators come from the database, a process with an empty (or its
+        # own) cache answers the same
+        cache.clear()
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(1)
+        after = self.get(etag)
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after["ETag"], etag)
+        self.assertEqual(self.get(after["ETag"]).status_code, 304)
+
+    def test_failed_stamp_bump_fails_the_write(self):
+        etag = self.get()["ETag"]
+        with mock.patch.object(
+            availability,
+            "_bump_stamp",
+            side_effect=OperationalError("database table is locked"),
+        ):
+            with self.assertRaises(OperationalError):
+                self.book(1)
+        # Nothing changed, and nothing is left behind to serve stale pages
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        self.book(1)
+        self.assertEqual(self.get(etag).status_code, 200)
+
+    def test_overview_shell_is_not_conditional(self):
+        response = self.client.get(reverse("overview"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+
+
+class OverviewEventsTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def events(self, start, end):
+        return self.client.get(reverse("overview_events"), {"start": start, "end": end})
+
+    def test_only_bookings_in_the_window_are_sent(self):
+        self.book(1)
+        self.book(1, offset=24 * 10)
+        day = timezone.localtime(self.start).date()
+        response = self.events(day.isoformat(), (day + timedelta(days=1)).isoformat())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_bookings_archived_early_are_still_sent(self):
+        # archive_bookings --days 0 moves bookings newer than the cutoff
+        self.start = timezone.now() - timedelta(days=2)
+        self.book(1)
+        self.assertEqual(archive.archive_bookings(before=timezone.now()), 1)
+        day = timezone.localtime(self.start).date()
+        response = self.events(day.isoformat(), (day + timedelta(days=1)).isoformat())
+        self.assertEqual(len(response.json()), 1)
+
+        # Windows after the newest archived booking skip the archive: the
+        # validators, the bookings and the newest archived end_time
+        with self.assertNumQueries(3):
+            response = self.events(
+                (day + timedelta(days=1)).isoformat(),
+                (day + timedelta(days=2)).isoformat(),
+            )
+        self.assertEqual(response.json(), [])
+
+    def test_invalid_window_is_rejected(self):
+        for start, end in [
+            ("2024-13-01", "2024-12-31"),
+            ("2024-02-30T10:00:00", "2024-03-01"),
+            ("2024-03-02", "2024-03-01"),
+            ("", "2024-03-01"),
+        ]:
+            self.assertEqual(self.events(start, end).status_code, 400)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SAMPLE_RATE=1.0)
+class RequestMetricsTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def test_sampled_requests_are_timed_and_totalled(self):
+        for _ in range(2):
+            response = self.client.get(reverse("booking"))
+        self.assertIn('desc="', response["Server-Timing"])
+        totals = metrics.registry.snapshot()["booking"]
+        self.assertEqual(totals["requests"], 2)
+        self.assertGreater(totals["queries"], 0)
+
+        response = self.client.get(reverse("request_metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'classbooking_requests_total{view="booking"} 2', response.content.decode()
+        )
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_left_alone(self):
+        response = self.client.get(reverse("booking"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(metrics.registry.snapshot(), {})
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_endpoint_is_gone_when_disabled(self):
+        response = self.client.get(reverse("booking"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get(reverse("request_metrics")).status_code, 404)
+
+    async def test_async_views_are_timed_with_their_queries(self):
+        await self.async_client.aforce_login(self.user)
+        day = timezone.localtime(self.start).date()
+        response = await self.async_client.get(
+            reverse("overview_events"),
+            {"start": day.isoformat(), "end": (day + timedelta(days=1)).isoformat()},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("db;dur=", response["Server-Timing"])
+        totals = metrics.registry.snapshot()["overview_events"]
+        self.assertEqual(totals["requests"], 1)
+        self.assertGreater(totals["queries"], 0)
+        self.assertGreater(totals["query_seconds"], 0)
+
+    def test_repeated_statements_count_as_duplicates(self):
+        request_metrics = metrics.RequestMetrics()
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 2", "SELECT 2"):
+            request_metrics.record_query(lambda *args: None, sql, (), False, {})
+        self.assertEqual(request_metrics.query_count, 4)
+        self.assertEqual(request_metrics.duplicate_queries, 2)
+        self.assertEqual(request_metrics.most_repeated(), ("SELECT 2", 3))
+        self.assertIn('dup;desc="2 duplicate queries"', request_metrics.server_timing())
+
+
+class AsyncViewTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.book(1)
+        self.day = timezone.localtime(self.start).date()
+
+    async def test_events_feed(self):
+        url = reverse("overview_events")
+        window = {
+            "start": self.day.isoformat(),
+            "end": (self.day + timedelta(days=1)).isoformat(),
+        }
+        response = await self.async_client.get(url, window)
+        self.assertEqual(response.status_code, 302)
+
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(url, window)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [event["title"] for event in response.json()], ["Lab (ห้อง 101) - student"]
+        )
+        response = await self.async_client.get(url, {"start": window["start"]})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_classroom_list(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("classroom"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Lab")
+        self.assertEqual(response.context["classrooms"][0]["hours_left"], 9)
+
+        again = await self.async_client.get(
+            reverse("classroom"), headers={"if_none_match": response["ETag"]}
+        )
+        self.assertEqual(again.status_code, 304)
+
+    async def test_availability_json(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("classroom_availability"))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [(room["room_number"], room["hours_left"]) for room in data["rooms"]],
+            [(101, 9)],
+        )
+        # The cache counters are for staff only
+        self.assertNotIn("cache", data)
+
+
+class ExportTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.live = self.book(2)
+        self.start = timezone.now() - timedelta(days=400)
+        self.old = self.book(1)
+        archive.archive_bookings()
+
+    def download(self, fmt, **params):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("booking_export", args=[fmt]), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_merges_live_and_archived_bookings(self):
+        lines = self.download("csv").splitlines()
+        self.assertEqual(lines[0], "\ufeff" + ",".join(export.CSV_HEADER))
+        rows = [line.split(",") for line in lines[1:]]
+        self.assertEqual(
+            [(int(row[0]), row[1], row[3], row[6]) for row in rows],
+            [
+                (self.old.pk, "Lab", "student", "1.00"),
+                (self.live.pk, "Lab", "student", "2.00"),
+            ],
+        )
+        self.assertEqual(
+            rows[1][4], timezone.localtime(self.live.start_time).isoformat()
+        )
+
+        # The booking list filters apply
+        day = timezone.localtime(self.live.start_time).date()
+        lines = self.download("csv", date_from=day).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_ics_has_one_event_per_booking(self):
+        text = self.download("ics")
+        self.assertTrue(text.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(text.endswith("END:VCALENDAR\r\n"))
+        self.assertEqual(text.count("BEGIN:VEVENT"), 2)
+        self.assertIn(f"UID:booking-{self.live.pk}@testserver\r\n", text)
+        start = self.live.start_time.astimezone(dt_timezone.utc)
+        self.assertIn(f"DTSTART:{start:%Y%m%dT%H%M%SZ}\r\n", text)
+        self.assertIn("SUMMARY:Lab (ห้อง 101)\r\n", text)
+
+    def test_long_ics_lines_are_folded_between_characters(self):
+        line = "SUMMARY:" + "ห้องเรียน" * 20
+        folded = export._ics_line(line)
+        parts = folded[:-2].split("\r\n ")
+        self.assertTrue(all(len(part.encode()) <= 75 for part in parts))
+        self.assertEqual("".join(parts), line)
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("booking_export", args=["csv"]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_feed_answers_304_until_the_bookings_change(self):
+        url = reverse("booking_feed", args=[export.feed_token(self.user)])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("BEGIN:VEVENT", b"".join(first.streaming_content).decode())
+
+        # The user and one aggregate, no feed rendered
+        with self.assertNumQueries(2):
+            again = self.client.get(url, headers={"if_none_match": first["ETag"]})
+        self.assertEqual(again.status_code, 304)
+
+        ledger.cancel_booking(self.live)
+        changed = self.client.get(url, headers={"if_none_match": first["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+
+    def test_tampered_feed_token_is_not_found(self):
+        url = reverse("booking_feed", args=[export.feed_token(self.user) + "x"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ClassroomImportTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.book(2)
+
+    def row(self, room_number, total_hours, name="Lab"):
+        return {
+            "name": name,
+            "room_number": str(room_number),
+            "total_hours": str(total_hours),
+            "capacity": "30",
+        }
+
+    def test_upsert_updates_rooms_against_their_bookings(self):
+        report = importer.import_classrooms(
+            [self.row(101, 20, name="Lab A"), self.row(102, 5, name="Hall")]
+        )
+        self.assertEqual([entry["status"] for entry in report], ["updated", "created"])
+
+        self.classroom.refresh_from_db()
+        self.assertEqual(
+            (
+                self.classroom.name,
+                self.classroom.total_hours,
+                self.classroom.hours_left,
+            ),
+            ("Lab A", 20, 18),
+        )
+        hall = Classroom.objects.get(room_number=102)
+        self.assertEqual((hall.hours_left, hall.is_available), (5, True))
+        self.assertEqual(reconcile.find_drift(), [])
+
+    def test_room_cannot_shrink_below_its_bookings(self):
+        report = importer.import_classrooms([self.row(101, 1), self.row(101, 12)])
+        self.assertEqual(
+            [entry["status"] for entry in report], ["rejected", "rejected"]
+        )
+        self.assertIn("ไม่ต่ำกว่า", report[0]["error"])
+        # The second row repeats the room number, even though it was rejected
+        self.assertIn("ซ้ำ", report[1]["error"])
+        self.classroom.refresh_from_db()
+        self.assertEqual(
+            (self.classroom.total_hours, self.classroom.hours_left), (10, 8)
+        )
+
+    def test_dry_run_changes_nothing(self):
+        report = importer.import_classrooms(
+            [self.row(101, 20), self.row(102, 5)], commit=False
+        )
+        self.assertEqual([entry["status"] for entry in report], ["ok", "ok"])
+        self.assertEqual(Classroom.objects.count(), 1)
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.total_hours, 10)
+
+
+class HoursResetTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.classroom.reset_policy = Classroom.RESET_DAILY
+        self.classroom.save()
+
+    def hours_left(self):
+        self.classroom.refresh_from_db()
+        return self.classroom.hours_left
+
+    def test_reset_keeps_hours_of_upcoming_bookings(self):
+        self.book(2)
+        Classroom.objects.filter(pk=self.classroom.pk).update(hours_left=3)
+        results = resets.reset_due()
+        self.assertEqual(results[Classroom.RESET_DAILY], 1)
+        self.assertEqual(self.hours_left(), 8)
+
+        run = HoursResetRun.objects.get(policy=Classroom.RESET_DAILY)
+        self.assertEqual(
+            (run.policy, run.period_start, run.classrooms_reset),
+            (Classroom.RESET_DAILY, timezone.localdate(), 1),
+        )
+
+    def test_no_drift_after_reset(self):
+        past = self.book(1, offset=-30)
+        self.book(2)
+        resets.reset_due()
+        self.assertEqual(reconcile.find_drift(), [])
+
+        # Held since before the reset, cancelling it gives nothing back
+        ledger.cancel_booking(past)
+        self.assertEqual(self.hours_left(), 8)
+        self.assertEqual(reconcile.find_drift(), [])
+
+    def test_single_room_reset_keeps_upcoming_bookings(self):
+        self.book(2)
+        self.classroom.reset_hours()
+        self.assertEqual(self.hours_left(), 8)
+        self.assertEqual(reconcile.find_drift(), [])
+
+    def test_second_run_in_a_period_changes_nothing(self):
+        resets.reset_due()
+        Classroom.objects.filter(pk=self.classroom.pk).update(hours_left=5)
+        self.assertIsNone(resets.reset_due()[Classroom.RESET_DAILY])
+        self.assertEqual(self.hours_left(), 5)
+        self.assertEqual(HoursResetRun.objects.count(), 2)  # daily and weekly
+        self.assertEqual(
+            HoursResetRun.objects.get(policy=Classroom.RESET_DAILY).classrooms_reset,
+            1,
+        )
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class UsageRollupTests(BookingFixtures, TestCase):
+    def test_incremental_rollups_match_rebuild(self):
+        kept = self.book(2)
+        moved = self.book(1, offset=3)
+        moved.start_time += timedelta(days=8)
+        moved.end_time += timedelta(days=8, hours=1)
+        moved.save()
+        ledger.cancel_booking(self.book(1, offset=30))
+
+        incremental = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup_rows())
+        self.assertEqual(
+            sum(r[2] for r in incremental[0]),
+            ledger.booked_hours(kept.start_time, kept.end_time) + 2,
+        )
+
+    def test_reversed_window_is_rejected_by_page_and_api(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        today = timezone.localdate()
+        for params in (
+            {"date_from": today, "date_to": today - timedelta(days=1)},
+            # date_to defaults to today
+            {"date_from": today + timedelta(days=1)},
+        ):
+            response = self.client.get(reverse("usage"), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "วันที่เริ่มต้นต้องไม่อยู่หลังวันที่สิ้นสุด")
+            self.assertNotIn("rooms", response.context)
+
+            response = self.client.get(reverse("usage_api"), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.json()["error"], "วันที่เริ่มต้นต้องไม่อยู่หลังวันที่สิ้นสุด"
+            )
+
+        response = self.client.get(reverse("usage_api"), {"date_to": today})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["date_from"],
+            (today - timedelta(days=UsageFilterForm.DEFAULT_DAYS - 1)).isoformat(),
+        )
+
+    def test_user_delete_drops_rollups(self):
+        self.book(2)
+        self.user.delete()
+        self.assertFalse(UserWeeklyUsage.objects.exists())
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class BookingArchiveTests(BookingFixtures, TestCase):
+    def test_archiving_keeps_hours_and_usage(self):
+        self.start = timezone.now() - timedelta(days=400)
+        for n in range(3):
+            self.book(1, offset=n * 2)
+        self.classroom.refresh_from_db()
+        hours_left, usage = self.classroom.hours_left, self.rollup_rows()
+
+        self.assertEqual(archive.archive_bookings(batch_size=2), 3)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(BookingArchive.objects.count(), 3)
+
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, hours_left)
+        self.assertEqual(self.rollup_rows(), usage)
+        self.assertEqual(reconcile.find_drift(), [])
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), usage)
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class UserDeletionTests(BookingFixtures, TestCase):
+    def test_deleting_user_in_admin_gives_hours_back(self):
+        self.book(2)
+        self.start = timezone.now() - timedelta(days=400)
+        self.book(1)
+        self.assertEqual(archive.archive_bookings(), 1)
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 7)
+
+        admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse("admin:auth_user_delete", args=[self.user.pk]), {"post": "yes"}
+        )
+        self.assertRedirects(response, reverse("admin:auth_user_changelist"))
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+        # Live and archived bookings went with the user, both give hours back
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 10)
+        self.assertTrue(self.classroom.is_available)
+        self.assertEqual(reconcile.find_drift(), [])
+        self.assertEqual(self.rollup_rows(), ([], []))
+
+    def test_deleting_booking_through_the_orm_gives_hours_back(self):
+        self.book(2)
+        Booking.objects.all().delete()
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.hours_left, 10)
+
+
+@override_settings(
+    BOOKING_POLICIES={
+        "staff": {},
+        "heavy": {"max_duration_hours": 3, "max_weekly_hours": 4},
+        "default": {"max_duration_hours": 1, "max_bookings_per_room": 1},
+    }
+)
+class BookingPolicyTests(BookingFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Monday morning next week, so every booking here falls in one week
+        monday, _ = policies.week_bounds(timezone.now() + timedelta(days=7))
+        self.start = monday + timedelta(hours=8)
+
+    def check(self, hours, offset=0, user=None):
+        start = self.start + timedelta(hours=offset)
+        return policies.check(
+            self.classroom, start, start + timedelta(hours=hours), user or self.user
+        )
+
+    def test_all_rules_cost_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.check(1))
+        self.book(1)
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(self.check(1, offset=2))
+
+    def test_limits_follow_the_users_group(self):
+        self.assertIsNotNone(self.check(2))
+        self.user.groups.add(Group.objects.create(name="heavy"))
+        self.assertIsNone(self.check(3))
+        self.book(3)
+        # 3 of the 4 weekly hours are used, and no per-room quota for this group
+        self.assertIsNotNone(self.check(2, offset=4))
+        self.assertIsNone(self.check(1, offset=4))
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class ConcurrentBookingTests(TransactionTestCase):
+    threads = 8
+    bookings_per_thread = 5
+
+    def test_concurrent_bookings_do_not_lose_hours(self):
+        classroom = Classroom.objects.create(
+            name="Hall", room_number=1, total_hours=1000, capacity=200
+        )
+        users = [
+            User.objects.create_user(f"user{i}", password="pw")
+            for i in range(self.threads)
+        ]
+        start = timezone.now() + timedelta(days=1)
+        barrier = threading.Barrier(self.threads)
+
+        def worker(index):
+            try:
+                barrier.wait()
+                for n in range(self.bookings_per_thread):
+                    slot = start + timedelta(hours=index * self.bookings_per_thread + n)
+                    # SQLite allows one writer at a time, retry until it's our turn
+                    while True:
+                        try:
+                            Booking.objects.create(
+                                classroom_id=classroom.pk,
+                                user=users[index],
+                                start_time=slot,
+                                end_time=slot + timedelta(minutes=30),
+                            )
+                            break
+                        except OperationalError:
+                            continue
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=worker, args=(i,)) for i in range(self.threads)
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        classroom.refresh_from_db()
+        booked = Booking.objects.filter(classroom=classroom).count()
+        self.assertEqual(booked, self.threads * self.bookings_per_thread)
+        self.assertEqual(classroom.hours_left, 1000 - booked * 0.5)
+
+
+@override_settings(TASKS_BACKEND="immediate")
+class BenchmarkTests(TransactionTestCase):
+    def test_small_run_reports_every_scenario(self):
+        results = benchmark.run(
+            classrooms=2, users=3, bookings=20, iterations=2, threads=2
+        )
+        self.assertEqual(
+            set(results["scenarios"]),
+            {
+                "overview",
+                "overview_events",
+                "booking_staff",
+                "booking_user",
+                "booking_edit",
+                "booking_cancel",
+                "classroom",
+            },
+        )
+        self.assertEqual(results["concurrent"]["lost_hours"], 0)
+        self.assertEqual(benchmark.compare(results, results), [])
+
+
+@tasks.task(max_attempts=2)
+def always_fails():
+    raise ValueError("boom")
+
+
+@override_settings(TASKS_BACKEND="database", TASKS_RETRY_DELAY=0)
+class QueuedTaskTests(BookingFixtures, TransactionTestCase):
+    def test_worker_applies_deferred_rollups(self):
+        self.book(2)
+        ledger.cancel_booking(self.book(1, offset=3))
+        self.assertEqual(self.rollup_rows(), ([], []))
+
+        self.assertEqual(tasks.work(threads=1, once=True), (3, 0))
+        self.assertFalse(QueuedTask.objects.exists())
+        usage = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), usage)
+
+    def test_dedup_key_skips_waiting_duplicates(self):
+        for _ in range(2):
+            always_fails.using(dedup_key="once").enqueue()
+        self.assertEqual(QueuedTask.objects.count(), 1)
+
+    def test_failed_task_is_retried_then_kept(self):
+        always_fails.enqueue()
+        self.assertEqual(tasks.work(once=True), (0, 2))
+        failed = QueuedTask.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (QueuedTask.FAILED, 2))
+        self.assertIn("ValueError: boom", failed.last_error)
+
+    @override_settings(TASKS_BACKEND="thread")
+    def test_durable_tasks_are_queued_under_the_thread_backend(self):
+        self.book(2)
+        self.assertEqual(
+            list(QueuedTask.objects.values_list("name", flat=True)),
+            ["main.rollups.apply_encoded"],
+        )
+        self.assertEqual(tasks.work(threads=1, once=True), (1, 0))
+        self.assertNotEqual(self.rollup_rows(), ([], []))
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    # Mail server down
+    def send_messages(self, messages):
+        raise ConnectionError("SMTP unavailable")
+
+
+@override_settings(TASKS_BACKEND="immediate", BOOKING_REMINDER_MINUTES=60)
+class NotificationTests(BookingFixtures, TestCase):
+    def book_in(self, minutes, **fields):
+        # Five minute booking starting ``minutes`` from now
+        start = timezone.now() + timedelta(minutes=minutes)
+        return Booking.objects.create(
+            classroom=self.classroom,
+            user=self.user,
+            start_time=start,
+            end_time=start + timedelta(minutes=5),
+            **fields,
+        )
+
+    def test_reminders_read_due_bookings_in_one_query(self):
+        self.user.email = "student@example.com"
+        self.user.save()
+        for minutes in (10, 20, 30):
+            self.book_in(minutes)
+        self.book_in(40, reminder_sent_at=timezone.now())
+        self.book_in(180)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(notifications.send_reminders(), 3)
+        selects = [q for q in queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(notifications.send_reminders(), 0)
+
+    @override_settings(EMAIL_BACKEND="main.tests.FailingEmailBackend")
+    def test_reminders_failing_to_send_are_not_marked(self):
+        self.user.email = "student@example.com"
+        self.user.save()
+        booking = self.book_in(10)
+        with self.assertRaises(ConnectionError):
+            notifications.send_reminders()
+        booking.refresh_from_db()
+        self.assertIsNone(booking.reminder_sent_at)
+
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+        ):
+            self.assertEqual(notifications.send_reminders(), 1)
+        booking.refresh_from_db()
+        self.assertIsNotNone(booking.reminder_sent_at)
+
+    def test_moving_a_booking_sends_the_reminder_again(self):
+        booking = self.book_in(10, reminder_sent_at=timezone.now())
+        booking.start_time += timedelta(hours=2)
+        booking.end_time += timedelta(hours=2)
+        booking.save()
+        booking.refresh_from_db()
+        self.assertIsNone(booking.reminder_sent_at)
+
+    def test_cancel_mails_the_owner(self):
+        self.user.email = "student@example.com"
+        self.user.save()
+        booking = self.book_in(10)
+        self.client.force_login(self.user)
+        self.client.post(reverse("booking_cancel", args=[booking.pk]))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("ถูกยกเลิก", mail.outbox[0].subject)
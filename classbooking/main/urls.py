@@ -3,11 +3,25 @@ from . import views
 
 urlpatterns = [
     path("overview/", views.overview, name="overview"),
+    path("overview/events/", views.overview_events, name="overview_events"),
     path("classroom/", views.classroom, name="classroom"),
     path("booking/", views.booking, name="booking"),
+    path("booking/bulk/", views.booking_bulk, name="booking_bulk"),
+    path("booking/export/<str:fmt>/", views.booking_export, name="booking_export"),
+    path("booking/feed/<str:token>.ics", views.booking_feed, name="booking_feed"),
     path("booking/<int:pk>/edit/", views.booking_edit, name="booking_edit"),
     path("booking/<int:pk>/cancel/", views.booking_cancel, name="booking_cancel"),
+    path(
+        "classroom/availability/",
+        views.classroom_availability,
+        name="classroom_availability",
+    ),
+    path("classroom/free/", views.classroom_free, name="classroom_free"),
     path("classroom/add/", views.classroom_add, name="classroom_add"),
+    path("classroom/import/", views.classroom_import, name="classroom_import"),
     path("classroom/<int:pk>/edit/", views.classroom_edit, name="classroom_edit"),
     path("classroom/<int:pk>/remove/", views.classroom_remove, name="classroom_remove"),
+    path("usage/", views.usage, name="usage"),
+    path("usage/api/", views.usage_api, name="usage_api"),
+    path("metrics/", views.request_metrics, name="request_metrics"),
 ]
@@ -1,47 +1,145 @@
+from asgiref.sync import sync_to_async
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.conf import settings
 from django.core.exceptions import PermissionDenied, ValidationError
+from django.contrib.auth.models import User
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.utils.timezone import localtime
-
-
-from .models import Classroom, Booking
-from .forms import ClassroomForm, BookingForm
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.http import require_POST
+from django.utils.timezone import (
+    get_current_timezone,
+    is_naive,
+    localtime,
+    make_aware,
+)
+
+from datetime import datetime, time, timedelta
+
+
+from . import (
+    archive,
+    availability,
+    bulk,
+    export,
+    importer,
+    ledger,
+    metrics,
+    notifications,
+    reconcile,
+    rollups,
+)
+from .models import Classroom, Booking, BookingArchive
+from .forms import ClassroomForm, BookingForm, BookingFilterForm, UsageFilterForm
+from .conditional import unless_changed
+from .pagination import keyset_page
+from .slots import find_free_rooms
 
 
 @login_required
 def overview(request):
-    bookings = Booking.objects.select_related("classroom", "user")
-    events = []
-
-    for b in bookings:
-        events.append(
-            {
-                "title": f"{b.classroom.name} (ห้อง {b.classroom.room_number}) - {b.user.username}",
-                "start": localtime(b.start_time).isoformat(),
-                "end": localtime(b.end_time).isoformat(),
-                "color": "#f56954",  # Red for booked
-            }
-        )
-
+    # Events are loaded lazily by FullCalendar from overview_events
     return render(
         request,
         "main/overview.html",
-        {"events": events, "bookings": bookings, "server_timezone": settings.TIME_ZONE},
+        {"server_timezone": settings.TIME_ZONE},
+    )
+
+
+def _parse_window_bound(value):
+    # FullCalendar sends either a date or a datetime (with or without offset),
+    # None when missing or not a real date (e.g. month 13)
+    try:
+        parsed = parse_datetime(value) if value else None
+        if parsed is None and value:
+            day = parse_date(value)
+            if day is not None:
+                parsed = datetime.combine(day, time.min)
+    except ValueError:
+        return None
+    if parsed is not None and is_naive(parsed):
+        parsed = make_aware(parsed, get_current_timezone())
+    return parsed
+
+
+EVENT_FIELDS = (
+    "start_time",
+    "end_time",
+    "classroom__name",
+    "classroom__room_number",
+    "user__username",
+)
+
+
+def _event(row):
+    return {
+        "title": f"{row['classroom__name']} (ห้อง {row['classroom__room_number']})"
+        f" - {row['user__username']}",
+        "start": localtime(row["start_time"]).isoformat(),
+        "end": localtime(row["end_time"]).isoformat(),
+        "color": "#f56954",  # Red for booked
+    }
+
+
+@login_required
+@unless_changed
+async def overview_events(request):
+    # JSON feed for FullCalendar, only bookings overlapping the requested window
+    # Async so calendar viewers waiting on the database don't each hold a worker
+    start = _parse_window_bound(request.GET.get("start"))
+    end = _parse_window_bound(request.GET.get("end"))
+
+    if start is None or end is None or end <= start:
+        return JsonResponse(
+            {"error": "ต้องระบุช่วงเวลา start และ end ให้ถูกต้อง"}, status=400
+        )
+
+    # values() rather than values_list(): in Django 5.2 aiterator() over a
+    # values_list() of several fields runs the query inside the event loop
+    rows = (
+        Booking.objects.filter(start_time__lt=end, end_time__gt=start)
+        .order_by("start_time")
+        .values(*EVENT_FIELDS)
     )
 
+    events = [_event(row) async for row in rows.aiterator()]
+
+    # Only windows that can hold archived bookings read the archive too
+    if await archive.amay_reach_archive(start):
+        archived = BookingArchive.objects.filter(
+            start_time__lt=end, end_time__gt=start
+        ).values(*EVENT_FIELDS)
+        events = [_event(row) async for row in archived.aiterator()] + events
+
+    return JsonResponse(events, safe=False)
+
 
 @login_required
 def booking(request):
+    filter_form = None
+    next_cursor = None
+
     if request.user.is_staff:
-        # Admins see every booking
-        user_bookings = Booking.objects.all()
+        # Admins see every booking, filtered and paginated by (start_time, id)
+        filter_form = BookingFilterForm(request.GET)
+        user_bookings, next_cursor = keyset_page(
+            filter_form.filter(Booking.objects.select_related("classroom", "user")),
+            cursor=request.GET.get("cursor"),
+            page_size=settings.BOOKING_PAGE_SIZE,
+        )
     else:
         # Normal users see only their own
-        user_bookings = Booking.objects.filter(user=request.user).order_by("start_time")
+        user_bookings = (
+            Booking.objects.filter(user=request.user)
+            .select_related("classroom")
+            .order_by("start_time")
+        )
 
     if request.method == "POST":
         form = BookingForm(request.POST, user=request.user)
@@ -51,14 +149,33 @@ def booking(request):
         if form.is_valid():
             booking = form.save(commit=False)
             booking.user = request.user  # Assign logged-in user
-            booking.save()  # Signals update classroom availability automatically
-            messages.success(request, "ห้องเรียนถูกจองเรียบร้อยแล้ว")
-            return redirect("booking")
+            try:
+                booking.save()  # Settles classroom hours and availability in one update
+            except ValidationError as e:
+                # Another request took the slot after our checks ran
+                form.add_error(None, e)
+            else:
+                notifications.booking_changed(notifications.CREATED, booking)
+                messages.success(request, "ห้องเรียนถูกจองเรียบร้อยแล้ว")
+                return redirect("booking")
     else:
         form = BookingForm(user=request.user)
 
+    # Subscribable calendar of the user's own bookings
+    feed_url = request.build_absolute_uri(
+        reverse("booking_feed", args=[export.feed_token(request.user)])
+    )
+
     return render(
-        request, "main/booking.html", {"form": form, "bookings": user_bookings}
+        request,
+        "main/booking.html",
+        {
+            "form": form,
+            "bookings": user_bookings,
+            "filter_form": filter_form,
+            "next_cursor": next_cursor,
+            "feed_url": feed_url,
+        },
     )
 
 
@@ -87,27 +204,16 @@ def booking_edit(request, pk):
         )
 
         if form.is_valid():
-            # Get the correct classroom and unedited booking object
-            old_booking = get_object_or_404(Booking, pk=pk)
-            classroom = booking.classroom
-            duration = (
-                old_booking.end_time - old_booking.start_time
-            ).total_seconds() / 3600.0
-
-            # Restore classroom hours
-            classroom.hours_left += duration
-            if classroom.hours_left > classroom.total_hours:
-                classroom.hours_left = classroom.total_hours
-            classroom.is_available = classroom.hours_left > 0
-
-            # Save the classroom object
-            classroom.save()
-
-            # Save the form
-            form.save()
-
-            messages.success(request, "อัปเดตการจองเรียบร้อยแล้ว")
-            return redirect("booking")
+            try:
+                # Booking.save gives back the old span and deducts the new one
+                # from the classroom in a single transaction
+                form.save()
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                notifications.booking_changed(notifications.UPDATED, booking)
+                messages.success(request, "อัปเดตการจองเรียบร้อยแล้ว")
+                return redirect("booking")
     else:
         form = BookingForm(instance=booking, user=request.user)
 
@@ -125,6 +231,62 @@ def booking_edit(request, pk):
     )
 
 
+EXPORT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ics": "text/calendar; charset=utf-8",
+}
+
+
+@staff_member_required
+def booking_export(request, fmt):
+    # Stream every booking matching the staff list filters, in CSV or iCalendar
+    if fmt not in EXPORT_TYPES:
+        raise Http404
+    # Archived bookings are included, reports cover the whole history
+    filter_form = BookingFilterForm(request.GET)
+    bookings = filter_form.filter(Booking.objects.all())
+    archived = filter_form.filter(BookingArchive.objects.all())
+
+    if fmt == "csv":
+        lines = export.csv_lines(bookings, archived)
+    else:
+        lines = export.ics_lines(
+            bookings, "การจองห้องเรียน", request.get_host(), archived
+        )
+
+    response = StreamingHttpResponse(lines, content_type=EXPORT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="bookings.{fmt}"'
+    return response
+
+
+def booking_feed(request, token):
+    # Per-user iCalendar feed, authenticated by the signed token in the URL
+    user_id = export.feed_user_id(token)
+    if user_id is None:
+        raise Http404
+    user = get_object_or_404(User, pk=user_id, is_active=True)
+    bookings = Booking.objects.filter(user=user)
+
+    # Polling calendar clients get a 304 after one aggregate query
+    etag, last_modified = export.feed_state(bookings)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=quote_etag(etag), last_modified=timestamp
+    )
+    if response is None:
+        response = StreamingHttpResponse(
+            export.ics_lines(
+                bookings, f"การจองของ {user.username}", request.get_host()
+            ),
+            content_type=EXPORT_TYPES["ics"],
+        )
+    response["ETag"] = quote_etag(etag)
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @login_required
 def booking_cancel(request, pk):
     # If admin then allow for all bookings to be canceled
@@ -138,19 +300,10 @@ def booking_cancel(request, pk):
         if booking.user != request.user and not request.user.is_staff:
             raise PermissionDenied("คุณไม่สามารถยกเลิกการจองนี้ได้")
 
-        # Calculate booked hours
+        # Delete booking and restore classroom hours atomically
         classroom = booking.classroom
-        duration = (booking.end_time - booking.start_time).total_seconds() / 3600.0
-
-        # Restore classroom hours
-        classroom.hours_left += duration
-        if classroom.hours_left > classroom.total_hours:
-            classroom.hours_left = classroom.total_hours
-        classroom.is_available = classroom.hours_left > 0
-        classroom.save()
-
-        # Delete booking
-        booking.delete()
+        ledger.cancel_booking(booking)
+        notifications.booking_changed(notifications.CANCELLED, booking)
 
         messages.success(
             request, f"การจองของคุณสำหรับห้องเรียน {classroom.name} ถูกยกเลิกแล้ว"
@@ -160,10 +313,75 @@ def booking_cancel(request, pk):
     return render(request, "main/booking/cancel.html", {"booking": booking})
 
 
+async def _arender(request, template_name, context):
+    # Templates read request.user, reuse the user loaded by the async login check
+    # instead of querying it again, and render in a thread as templates may hit
+    # the database (sessions, messages)
+    request.user = await request.auser()
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@login_required
+@unless_changed
+async def classroom(request):
+    # Served from the cached availability snapshot, the room cards are cached
+    # per snapshot version (see the template)
+    snapshot = await availability.asnapshot()
+    return await _arender(
+        request,
+        "main/classroom.html",
+        {
+            "classrooms": snapshot["rooms"],
+            "snapshot_version": snapshot["version"],
+            "cache_timeout": settings.AVAILABILITY_CACHE_TIMEOUT,
+        },
+    )
+
+
+@login_required
+def classroom_free(request):
+    # Rooms with free time in a window: ?start=&end=&duration=<minutes>&capacity=
+    start = _parse_window_bound(request.GET.get("start"))
+    end = _parse_window_bound(request.GET.get("end"))
+    try:
+        duration = timedelta(minutes=int(request.GET.get("duration", 60)))
+        capacity = int(request.GET.get("capacity", 0))
+    except (ValueError, OverflowError):
+        # OverflowError: more minutes than timedelta can hold
+        duration = capacity = None
+
+    if start is None or end is None or end <= start:
+        return JsonResponse(
+            {"error": "ต้องระบุช่วงเวลา start และ end ให้ถูกต้อง"}, status=400
+        )
+    if duration is None or duration <= timedelta(0) or capacity < 0:
+        return JsonResponse(
+            {"error": "duration และ capacity ต้องเป็นจำนวนเต็มบวก"}, status=400
+        )
+    if end - start > timedelta(days=settings.FREE_SLOT_MAX_DAYS):
+        return JsonResponse(
+            {"error": f"ค้นหาได้ไม่เกิน {settings.FREE_SLOT_MAX_DAYS} วันต่อครั้ง"},
+            status=400,
+        )
+
+    rooms = find_free_rooms(start, end, duration, capacity)
+    for room in rooms:
+        room["free"] = [
+            {"start": localtime(s).isoformat(), "end": localtime(e).isoformat()}
+            for s, e in room["free"]
+        ]
+    return JsonResponse({"rooms": rooms})
+
+
 @login_required
-def classroom(request):
-    classrooms = Classroom.objects.all()
-    return render(request, "main/classroom.html", {"classrooms": classrooms})
+@unless_changed
+async def classroom_availability(request):
+    # JSON view of the availability snapshot, staff also get the cache counters
+    data = dict(await availability.asnapshot())
+    user = await request.auser()
+    if user.is_staff:
+        data["cache"] = await availability.astats()
+    return JsonResponse(data)
 
 
 @staff_member_required
@@ -187,53 +405,22 @@ def classroom_edit(request, pk):
         form = ClassroomForm(request.POST, instance=classroom)
 
         if form.is_valid():
-            # get the unchanged classroom data
-            old_classroom = get_object_or_404(Classroom, pk=pk)
+            # hours already taken by bookings since the last reset
+            booked_hours = Classroom.objects.with_booked_time().get(pk=pk).booked_hours
 
-            # create variable named total_hours_diff to check changed value (total_hours_diff can only go positive)
-            total_hours_diff = classroom.total_hours - old_classroom.total_hours
-            total_hours_diff = total_hours_diff if not (total_hours_diff < 0) else 0
-
-            # get already booked hours from old classroom (before form changes)
-            hours_left_diff = old_classroom.hours_left - old_classroom.total_hours
-            # if total hours diff is more than 0 don't change hours left
-            hours_left_diff = hours_left_diff if not (total_hours_diff > 0) else 0
-
-            # DEBUG: messages for total_hours_diff and hours_left_diff
-            messages.success(
-                request,
-                f"total_hours_diff = {total_hours_diff}, hours_left_diff = {hours_left_diff}",
-            )
-
-            # commit the form
-            form.save()
-
-            # if hours_left is less than 0 then something is totally wrong with the admin
-            # since you can't directly set hours_left in the first place, it must be the admin setting it lower than 0
-            if (classroom.hours_left + total_hours_diff + hours_left_diff) < 0:
-                # raise an error
+            # total hours can't go below what is already booked
+            if form.cleaned_data["total_hours"] < booked_hours:
                 form.add_error(
                     "total_hours",
                     forms.ValidationError(
                         "จำนวนชั่วโมงรวมจะต้องไม่ต่ำกว่าจำนวนชั่วโมงรวมที่จองจากการจองทั้งหมด"
                     ),
                 )
-
-                # reset the classroom value
-                classroom.total_hours = old_classroom.total_hours
-                classroom.hours_left = old_classroom.hours_left
-
-                # then save the classroom object
-                classroom.save()
             else:
-
-                # if total_hours increase then increment hours_left by the same amount
-                classroom.hours_left = (
-                    classroom.hours_left + total_hours_diff + hours_left_diff
-                )
-                # then save the classroom object
-                classroom.save()
-
+                # commit the form, then derive hours_left from the bookings
+                # instead of patching it by the difference in total hours
+                form.save()
+                reconcile.correct(reconcile.find_drift([pk]))
                 return redirect("classroom")
     else:
         form = ClassroomForm(instance=classroom)
@@ -247,3 +434,130 @@ def classroom_remove(request, pk):
         classroom.delete()
         return redirect("classroom")
     return render(request, "main/classroom/remove.html", {"classroom": classroom})
+
+
+@staff_member_required
+@require_POST
+def booking_bulk(request):
+    # Create many bookings from a CSV/JSON upload or body, or from a recurrence rule
+    upload = request.FILES.get("file")
+    try:
+        if upload:
+            content = upload.read().decode("utf-8-sig")
+            fmt = "csv" if upload.name.lower().endswith(".csv") else "json"
+        else:
+            content = request.body.decode("utf-8-sig")
+            fmt = "csv" if request.content_type == "text/csv" else "json"
+        rows = bulk.parse_rows(content, fmt)
+    except UnicodeDecodeError:
+        return JsonResponse({"error": "ไฟล์ต้องเข้ารหัสแบบ UTF-8"}, status=400)
+    except bulk.BulkBookingError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # ?dry_run=1 validates every row without creating anything
+    commit = request.GET.get("dry_run") != "1"
+    report = bulk.book_many(request.user, rows, commit=commit)
+    return JsonResponse(bulk.summarize(report))
+
+
+@staff_member_required
+@require_POST
+def classroom_import(request):
+    # Create or update many classrooms from a CSV/JSON upload, matched on room_number
+    upload = request.FILES.get("file")
+    if upload is None:
+        return JsonResponse({"error": "กรุณาแนบไฟล์ csv หรือ json"}, status=400)
+
+    fmt = "csv" if upload.name.lower().endswith(".csv") else "json"
+    # ?dry_run=1 validates every row without saving anything
+    commit = request.GET.get("dry_run") != "1"
+    try:
+        rows = importer.read_rows(importer.open_upload(upload), fmt)
+        report = importer.import_classrooms(rows, commit=commit)
+    except UnicodeDecodeError:
+        return JsonResponse({"error": "ไฟล์ต้องเข้ารหัสแบบ UTF-8"}, status=400)
+    except importer.ClassroomImportError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(importer.summarize(report))
+
+
+def _usage(request):
+    # Filters and window shared by the usage dashboard and its JSON API
+    form = UsageFilterForm(request.GET)
+    date_from, date_to = form.window()
+    data = form.cleaned_data if form.is_valid() else {}
+    return form, date_from, date_to, data.get("classroom"), data.get("user")
+
+
+@staff_member_required
+def usage(request):
+    # Staff dashboard over the usage rollups, never scans the bookings table
+    form, date_from, date_to, classroom, username = _usage(request)
+    if not form.is_valid():
+        # Show what is wrong with the filters instead of a report
+        return render(request, "main/usage.html", {"form": form})
+    days = (date_to - date_from).days + 1
+
+    rooms = list(rollups.classroom_totals(date_from, date_to, classroom))
+    for room in rooms:
+        room["hours_per_day"] = room["booked_hours"] / days
+    return render(
+        request,
+        "main/usage.html",
+        {
+            "form": form,
+            "date_from": date_from,
+            "date_to": date_to,
+            "rooms": rooms,
+            "users": rollups.user_usage(date_from, date_to, username),
+        },
+    )
+
+
+@staff_member_required
+def usage_api(request):
+    # JSON of the daily classroom and weekly user rollups for the window
+    form, date_from, date_to, classroom, username = _usage(request)
+    if not form.is_valid():
+        return JsonResponse(
+            {"error": " ".join(e for errors in form.errors.values() for e in errors)},
+            status=400,
+        )
+
+    return JsonResponse(
+        {
+            "date_from": date_from.isoformat(),
+            "date_to": date_to.isoformat(),
+            "classrooms": [
+                {
+                    "classroom": row["classroom_id"],
+                    "name": row["classroom__name"],
+                    "room_number": row["classroom__room_number"],
+                    "day": row["day"].isoformat(),
+                    "booked_hours": round(row["booked_hours"], 4),
+                    "bookings": row["bookings"],
+                }
+                for row in rollups.classroom_usage(date_from, date_to, classroom)
+            ],
+            "users": [
+                {
+                    "user": row["user_id"],
+                    "username": row["user__username"],
+                    "week": row["week"].isoformat(),
+                    "booked_hours": round(row["booked_hours"], 4),
+                    "bookings": row["bookings"],
+                }
+                for row in rollups.user_usage(date_from, date_to, username)
+            ],
+        }
+    )
+
+
+@staff_member_required
+def request_metrics(request):
+    # Per-view request totals of this process in the Prometheus text format
+    if not settings.REQUEST_METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(
+        metrics.registry.prometheus(), content_type="text/plain; version=0.0.4"
+    )